@@ -0,0 +1,288 @@
+'''
+End-to-end throughput benchmark.
+Feeds a synthetic update stream through the real Dispatcher from bot.create_dispatcher
+(flood guard, admin, transfer and filter routers) against a temporary SQLite database.
+The bot session is faked in-process: API calls are counted and answered locally.
+
+Prints one JSON document, so runs can be stored and compared:
+
+Run: python -m benchmarks.bench_dispatcher --chats 200 --filters 50 --updates 20000 > run.json
+     python -m benchmarks.bench_dispatcher --chats 200 --filters 50 --updates 20000 --compare run.json
+'''
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+BOT_ID = 123456
+ADMIN_ID = 1
+FIRST_USER = 10000
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=100, help="number of group chats")
+    parser.add_argument("--filters", type=int, default=20, help="filters per chat")
+    parser.add_argument("--users", type=int, default=200, help="members per chat")
+    parser.add_argument("--updates", type=int, default=10000, help="updates to feed")
+    parser.add_argument("--commands", type=float, default=0.05, help="share of admin commands")
+    parser.add_argument("--matches", type=float, default=0.1, help="share of messages that trigger a filter")
+    parser.add_argument("--joins", type=float, default=0.05, help="share of member joins")
+    parser.add_argument("--join-storm", type=int, default=0, help="extra joins into one chat, fed back to back")
+    parser.add_argument("--blacklisted", type=float, default=0.01, help="share of users on the chat blacklist")
+    parser.add_argument("--concurrency", type=int, default=32, help="updates handled at once")
+    parser.add_argument("--flood-limit", type=int, default=0, help="FLOOD_LIMIT, off by default")
+    parser.add_argument("--write-behind", action="store_true", help="enable WRITE_BEHIND")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--compare", metavar="BASELINE", help="also report the change against an earlier run's JSON, run with the same flags")
+    return parser.parse_args()
+
+def configure_env(args: argparse.Namespace, db_path: str):
+    # Config reads the environment at import time, so this runs before gadobot is imported
+    os.environ.update({
+        "BOT_TOKEN": f"{BOT_ID}:bench",
+        "DB_URL": f"sqlite+aiosqlite:///{db_path}",
+        "METRICS": "1",
+        # Pacing would measure Telegram's limits, not the bot
+        "OUTBOUND_SCHEDULER": "0",
+        "FLOOD_LIMIT": str(args.flood_limit),
+        "WRITE_BEHIND": "1" if args.write_behind else "0",
+        "WORKERS": "1",
+    })
+
+def chat_id(index: int) -> int:
+    return -1000000000000 - index
+
+def user_id(index: int) -> int:
+    return FIRST_USER + index
+
+class UpdateGenerator:
+    def __init__(self, args: argparse.Namespace, rnd: random.Random):
+        self.args = args
+        self.rnd = rnd
+        self.update_id = 0
+        self.message_id = 0
+        self.words = ["hello", "world", "what", "time", "is", "it", "today", "here", "again", "ok"]
+
+    def _chat(self, index: int) -> dict:
+        return {"id": chat_id(index), "type": "supergroup", "title": f"bench {index}"}
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"u{uid}"}
+
+    def _next_id(self) -> int:
+        self.update_id += 1
+        return self.update_id
+
+    def message(self, chat: int, sender: int, text: str) -> dict:
+        self.message_id += 1
+        return {"update_id": self._next_id(), "message": {
+            "message_id": self.message_id, "date": int(time.time()),
+            "chat": self._chat(chat), "from": self._user(sender), "text": text,
+        }}
+
+    def join(self, chat: int, uid: int) -> dict:
+        member = self._user(uid)
+        return {"update_id": self._next_id(), "chat_member": {
+            "chat": self._chat(chat), "from": member, "date": int(time.time()),
+            "old_chat_member": {"status": "left", "user": member},
+            "new_chat_member": {"status": "member", "user": member},
+        }}
+
+    def command(self, chat: int) -> dict:
+        target = user_id(self.rnd.randrange(self.args.users))
+        text = self.rnd.choice((
+            f"/warn {target} spam", f"/unwarn {target}", f"/history {target}",
+            f"/mute {target} 1h", f"/unmute {target}", "/filters", "/limitwarn",
+        ))
+        return self.message(chat, ADMIN_ID, text)
+
+    def text(self, chat: int) -> dict:
+        sender = user_id(self.rnd.randrange(self.args.users))
+        words = self.rnd.choices(self.words, k=self.rnd.randint(3, 12))
+        if self.args.filters and self.rnd.random() < self.args.matches:
+            words.insert(self.rnd.randrange(len(words) + 1), f"trigger{self.rnd.randrange(self.args.filters)}")
+        return self.message(chat, sender, " ".join(words))
+
+    def stream(self) -> list[dict]:
+        updates = []
+        for _ in range(self.args.updates):
+            chat = self.rnd.randrange(self.args.chats)
+            roll = self.rnd.random()
+            if roll < self.args.commands:
+                updates.append(self.command(chat))
+            elif roll < self.args.commands + self.args.joins:
+                updates.append(self.join(chat, user_id(self.rnd.randrange(self.args.users))))
+            else:
+                updates.append(self.text(chat))
+        if self.args.join_storm:
+            storm = [self.join(0, user_id(self.args.users + i)) for i in range(self.args.join_storm)]
+            at = len(updates) // 2
+            updates[at:at] = storm
+        return updates
+
+def make_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Message, ChatMemberAdministrator, User
+
+    class RecordingSession(BaseSession):
+        '''Answers API calls locally and counts them per method.'''
+        def __init__(self):
+            super().__init__()
+            self.calls: dict[str, int] = {}
+            self.message_id = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if name == "GetChatAdministrators":
+                # model_construct: the set of required rights differs between Bot API versions
+                return [
+                    ChatMemberAdministrator.model_construct(
+                        status="administrator", can_restrict_members=True,
+                        user=User(id=uid, is_bot=uid == BOT_ID, first_name="admin"),
+                    )
+                    for uid in (ADMIN_ID, BOT_ID)
+                ]
+            if name.startswith("Send"):
+                self.message_id += 1
+                return Message.model_validate({
+                    "message_id": self.message_id, "date": int(time.time()),
+                    "chat": {"id": getattr(method, "chat_id", 0), "type": "supergroup"},
+                    "text": getattr(method, "text", None) or "",
+                })
+            return True
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+    return RecordingSession()
+
+async def seed(db, args: argparse.Namespace, rnd: random.Random):
+    from gadobot.database.models import CustomFilter, Blacklist
+    async with db.repository() as repo:
+        for chat in range(args.chats):
+            await repo.bulk_upsert(CustomFilter, [
+                {"chat_id": chat_id(chat), "trigger": f"trigger{i}", "response": f"response {i}",
+                 "file_id": None, "file_type": None, "mode": "contains"}
+                for i in range(args.filters)
+            ])
+            banned = [user_id(u) for u in range(args.users) if rnd.random() < args.blacklisted]
+            await repo.bulk_upsert(Blacklist, [{"chat_id": chat_id(chat), "user_id": u} for u in banned],
+                                   ["chat_id", "user_id"])
+        await repo.commit()
+
+def percentile(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+def histogram_totals(metrics, name: str) -> dict:
+    totals = {}
+    for (metric, labels), h in metrics.histograms.items():
+        if metric == name:
+            key = ",".join(v for _, v in labels)
+            totals[key] = {"count": h.count, "mean_ms": round(h.sum / h.count * 1000, 3) if h.count else 0.0}
+    return dict(sorted(totals.items()))
+
+async def run(args: argparse.Namespace) -> dict:
+    from aiogram import Bot
+    from gadobot.bot import create_dispatcher
+    from gadobot.database.engine import Database
+    from gadobot.jobs import JobScheduler
+    from gadobot.utils.metrics import metrics
+
+    rnd = random.Random(args.seed)
+    db = Database()
+    await db.migrate()
+    db.start()
+    await seed(db, args, rnd)
+
+    session = make_session()
+    bot = Bot(f"{BOT_ID}:bench", session=session)
+    jobs = JobScheduler(db, bot)
+    await jobs.start()
+    dp = create_dispatcher(db, jobs)
+    updates = UpdateGenerator(args, rnd).stream()
+
+    latencies: list[float] = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def feed(update: dict):
+        try:
+            started = time.perf_counter()
+            await dp.feed_raw_update(bot, update)
+            latencies.append(time.perf_counter() - started)
+        finally:
+            slots.release()
+
+    started = time.perf_counter()
+    tasks = []
+    for update in updates:
+        await slots.acquire()
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await jobs.stop()
+    db_stats = db.stats()
+    await db.close()
+
+    queries = sum(h.count for (name, _), h in metrics.histograms.items() if name == "db_query_seconds")
+    api_calls = sum(session.calls.values())
+    latencies.sort()
+    count = len(updates)
+    return {
+        "params": {k: v for k, v in vars(args).items() if k != "compare"},
+        "python": sys.version.split()[0],
+        "updates": count,
+        "seconds": round(elapsed, 3),
+        "updates_per_sec": round(count / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "queries_per_update": round(queries / count, 3),
+        "api_calls_per_update": round(api_calls / count, 3),
+        "api_calls": dict(sorted(session.calls.items())),
+        "handlers": histogram_totals(metrics, "handler_seconds"),
+        "queries": histogram_totals(metrics, "db_query_seconds"),
+        "db": db_stats,
+    }
+
+def compare(result: dict, baseline: dict) -> dict:
+    '''Relative change of the headline numbers; negative is better for latencies and per-update costs.'''
+    def change(new, old):
+        return round((new - old) / old * 100, 1) if old else None
+    return {
+        "updates_per_sec_pct": change(result["updates_per_sec"], baseline["updates_per_sec"]),
+        "p50_pct": change(result["latency_ms"]["p50"], baseline["latency_ms"]["p50"]),
+        "p99_pct": change(result["latency_ms"]["p99"], baseline["latency_ms"]["p99"]),
+        "queries_per_update_pct": change(result["queries_per_update"], baseline["queries_per_update"]),
+        "api_calls_per_update_pct": change(result["api_calls_per_update"], baseline["api_calls_per_update"]),
+    }
+
+def main():
+    args = parse_args()
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    with tempfile.TemporaryDirectory(prefix="gadobot-bench-") as tmp:
+        configure_env(args, os.path.join(tmp, "bench.db"))
+        result = asyncio.run(run(args))
+    if baseline:
+        result["compare"] = compare(result, baseline)
+    json.dump(result, sys.stdout, indent=2)
+    print()
+
+if __name__ == "__main__":
+    main()
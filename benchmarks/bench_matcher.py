@@ -0,0 +1,46 @@
+'''
+Filter matching benchmark.
+Shows that per-message matching time stays flat as the number of filters in a chat grows.
+
+Run: python -m benchmarks.bench_matcher
+'''
+import random
+import string
+import time
+
+from gadobot.database.cache import ChatFilterIndex, FilterRecord
+
+FILTER_COUNTS = (10, 100, 1000, 5000)
+MESSAGES = 2000
+
+def random_word(rnd: random.Random, length: int) -> str:
+    return "".join(rnd.choice(string.ascii_lowercase) for _ in range(length))
+
+def build_index(rnd: random.Random, count: int) -> ChatFilterIndex:
+    index = ChatFilterIndex()
+    for i in range(count):
+        mode = ("exact", "contains", "contains", "regex")[i % 4]
+        trigger = random_word(rnd, 8)
+        if mode == "regex":
+            trigger = trigger[:4] + r"\d+"
+        index.add(FilterRecord(trigger, "response", mode=mode))
+    return index
+
+def main():
+    rnd = random.Random(42)
+    messages = [" ".join(random_word(rnd, rnd.randint(2, 9)) for _ in range(20)) for _ in range(MESSAGES)]
+    print(f"{'filters':>8} {'build ms':>10} {'us/message':>11}")
+    for count in FILTER_COUNTS:
+        index = build_index(rnd, count)
+        start = time.perf_counter()
+        index.match("warmup")
+        build = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for text in messages:
+            index.match(text)
+        per_message = (time.perf_counter() - start) / MESSAGES
+        print(f"{count:>8} {build * 1000:>10.1f} {per_message * 1e6:>11.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,47 @@
+import importlib
 import logging
-from aiogram import Bot, Dispatcher
+from aiogram import Bot, Dispatcher, Router, types
 from aiogram.client.session.aiohttp import AiohttpSession
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
 from .config import Config
 from .utils.logging import setup_logging
-from .handlers import admin, filters
-from .database.models import Base
-from .database.repo import Repository
+from .utils.admins import admin_cache, admin_cache_middleware
+from .utils.outbound import OutboundScheduler, PRIORITY_NAMES
+from .utils.flood import FloodGuard
+from .utils.usernames import username_index, username_middleware
+from .utils.metrics import metrics, ApiMetrics, handler_metrics_middleware, instrument_engine, start_metrics_server
+from .database.repo import filter_cache, blacklist_cache, language_cache
+from .database.engine import Database
+from .database.snapshot import save_snapshot, warm_caches
+from .jobs import JobScheduler
+from .webhook import run_webhook
+from .updates import run_polling, stale_message_middleware, event_chat_id
 
-from .resources.locales import lang
+from .resources.locales import lang, use_locale, DEFAULT_LOCALE
 
 logger = logging.getLogger(__name__)
 
-async def main():
-    setup_logging()
-    
-    # Database initialization
-    engine = create_async_engine(Config.DB_URL)
-    async_session = async_sessionmaker(engine, expire_on_commit=False)
-    
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        
+# Handler modules in routing order; filters goes last, it looks at every text message
+HANDLER_MODULES = ("admin", "transfer", "language", "federation", "filters")
+
+def load_routers() -> list[Router]:
+    '''Imports the handler modules enabled in HANDLERS when first needed; disabled ones are never imported.'''
+    unknown = sorted(set(Config.HANDLERS) - set(HANDLER_MODULES))
+    if unknown:
+        raise ValueError(f"Unknown HANDLERS: {', '.join(unknown)} (available: {', '.join(HANDLER_MODULES)})")
+    return [
+        importlib.import_module(f".handlers.{name}", __package__).router
+        for name in HANDLER_MODULES if name in Config.HANDLERS
+    ]
 
+def resolve_allowed_updates() -> list[str]:
+    # chat_member updates are opt-in on Telegram's side
+    used = {"chat_member", "my_chat_member"}
+    for router in load_routers():
+        used.update(router.resolve_used_update_types())
+    return sorted(used)
+
+def create_bot() -> Bot:
     if Config.PROXY:
         proxy_url = Config.PROXY
 
@@ -32,19 +50,141 @@ async def main():
         bot = Bot(token=Config.BOT_TOKEN,session=session)
     else:
         bot = Bot(token=Config.BOT_TOKEN)
+
+    if Config.OUTBOUND_SCHEDULER:
+        # Telegram's limits are per bot, so shard workers split the global rate
+        scheduler = OutboundScheduler(
+            global_rate=Config.OUTBOUND_GLOBAL_RATE / max(Config.WORKERS, 1),
+            chat_rate=Config.OUTBOUND_CHAT_RATE,
+            group_per_minute=Config.OUTBOUND_GROUP_PER_MINUTE,
+            low_queue_limit=Config.OUTBOUND_LOW_QUEUE_LIMIT,
+            low_max_wait=Config.OUTBOUND_LOW_MAX_WAIT,
+        )
+        bot.session.middleware(scheduler)
+        if Config.METRICS:
+            metrics.collect("outbound", scheduler.stats, counters=(
+                "dropped", "merged", "retries", *(f"wait_{name}_count" for name in PRIORITY_NAMES.values()),
+            ))
+    if Config.METRICS:
+        # Registered last so it sits innermost and times the HTTP call, not the queueing
+        bot.session.middleware(ApiMetrics())
+    return bot
+
+def create_dispatcher(db: Database, jobs: JobScheduler) -> Dispatcher:
+    '''Builds the middleware and router stack. Used by the single process and by every shard worker.'''
     dp = Dispatcher()
-    
+    dp["jobs"] = jobs
+
+    # Outermost, so the flood guard's and locale lookups count towards their update too
+    dp.update.outer_middleware(db.count_update)
+
+    # Backlog from downtime: drop stale plain messages, keep commands
+    if Config.STALE_UPDATE_SECONDS:
+        dp.message.outer_middleware(stale_message_middleware)
+
+    # Flood protection runs before the routers, so dropped updates never reach them or the database
+    flood = FloodGuard(db, jobs, max_chats=Config.FLOOD_MAX_CHATS, idle=Config.FLOOD_IDLE)
+    dp["flood"] = flood
+    dp.message.outer_middleware(flood)
+
+    # Learn @username -> id from every message and member update, in memory only
+    dp.message.outer_middleware(username_middleware)
+    dp.chat_member.outer_middleware(username_middleware)
+
     # Middleware: Inject Repository into handlers
-    @dp.message.middleware
     async def db_middleware(handler, event, data):
-        async with async_session() as session:
-            data['repo'] = Repository(session)
+        async with db.repository() as repo:
+            data['repo'] = repo
             return await handler(event, data)
 
-    dp.include_router(admin.router)
-    dp.include_router(filters.router)
-    
+    dp.message.middleware(db_middleware)
+    dp.chat_member.middleware(db_middleware)
+    dp.callback_query.middleware(db_middleware)
+
+    # Every lang() call while handling an update answers in the chat's language
+    async def locale_middleware(handler, event: types.Update, data):
+        chat_id = event_chat_id(event)
+        code = language_cache.get(chat_id) if chat_id else DEFAULT_LOCALE
+        if code is None:
+            async with db.repository() as repo:
+                code = await repo.load_language(chat_id)
+        with use_locale(code):
+            return await handler(event, data)
+
+    dp.update.outer_middleware(locale_middleware)
+
+    # Keep the admin rights cache in sync with Telegram
+    dp.chat_member.outer_middleware(admin_cache_middleware)
+    dp.my_chat_member.outer_middleware(admin_cache_middleware)
+
+    if Config.METRICS:
+        setup_metrics(dp, db, jobs, flood)
+
+    for router in load_routers():
+        dp.include_router(router)
+    return dp
+
+# Running totals of the caches' stats()
+CACHE_COUNTERS = ("hits", "misses")
+
+def setup_metrics(dp: Dispatcher, db: Database, jobs: JobScheduler, flood: FloodGuard):
+    '''Hooks handler and query timing in and registers the stats of every cache and queue.'''
+    for observer in (dp.message, dp.chat_member, dp.my_chat_member, dp.callback_query):
+        observer.middleware(handler_metrics_middleware)
+    instrument_engine(db.engine, "write", Config.METRICS_SLOW_QUERY_MS)
+    if db.read_engine is not db.engine:
+        instrument_engine(db.read_engine, "read", Config.METRICS_SLOW_QUERY_MS)
+
+    metrics.collect("db", db.stats, counters=(
+        "updates_without_db", "updates_with_db",
+        "write_behind_statements", "write_behind_commits", "write_behind_failed_commits",
+    ))
+    metrics.collect("jobs", jobs.stats, counters=("executed", "failed", "dropped"))
+    metrics.collect("flood", flood.stats, counters=("dropped", "mutes", "raids"))
+    metrics.collect("filter_cache", filter_cache.stats, counters=CACHE_COUNTERS + ("empty_hits",))
+    metrics.collect("blacklist_cache", blacklist_cache.stats, counters=CACHE_COUNTERS + ("bloom_rejects",))
+    metrics.collect("admin_cache", admin_cache.stats, counters=CACHE_COUNTERS)
+    metrics.collect("usernames", username_index.stats, counters=CACHE_COUNTERS + ("written",))
+    metrics.collect("language_cache", language_cache.stats, counters=CACHE_COUNTERS)
+
+async def main():
+    setup_logging()
+
+    if Config.WORKERS > 1:
+        # Ingest here, handle updates in worker processes
+        from .sharding import run_sharded
+        return await run_sharded()
+
+    # Database initialization
+    db = Database()
+    await db.migrate()
+    db.start()
+    if Config.CACHE_SNAPSHOT:
+        await warm_caches(db, Config.CACHE_SNAPSHOT, Config.CACHE_SNAPSHOT_CHATS)
+
+    bot = create_bot()
+    jobs = JobScheduler(db, bot, horizon=Config.JOB_HORIZON)
+    await jobs.start()
+    username_index.start(db)
+    dp = create_dispatcher(db, jobs)
+
     logger.info(lang("bot_started"))
-    
-    await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
\ No newline at end of file
+
+    metrics_server = None
+    if Config.METRICS:
+        metrics_server = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+
+    allowed_updates = resolve_allowed_updates()
+    try:
+        if Config.UPDATES_MODE == "webhook":
+            await run_webhook(dp, bot, allowed_updates)
+        else:
+            await run_polling(dp, bot, db, allowed_updates)
+    finally:
+        if metrics_server:
+            await metrics_server.cleanup()
+        await username_index.close()
+        await jobs.stop()
+        await db.close()
+        if Config.CACHE_SNAPSHOT:
+            save_snapshot(Config.CACHE_SNAPSHOT, Config.CACHE_SNAPSHOT_CHATS)
@@ -6,8 +6,108 @@ load_dotenv()
 class Config:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
     PROXY = os.getenv("PROXY")
-    # New DB location
-    DB_URL = "sqlite+aiosqlite:///gado.db"
+    # Bot owners, allowed to run whole-database commands like /export and /import
+    ADMINS = [int(x) for x in os.getenv("ADMINS", "").replace(",", " ").split()]
+    # New DB location, an SQLAlchemy async URL of SQLite or PostgreSQL (e.g. postgresql+asyncpg://...)
+    DB_URL = os.getenv("DB_URL", "sqlite+aiosqlite:///gado.db")
+    DB_ECHO = os.getenv("DB_ECHO", "0").lower() in ("1", "true", "yes")
+    # Connection pool of server databases
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    # SQLite: read connections next to the single writer, and per-connection pragmas
+    DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    # Negative values are KiB, as in PRAGMA cache_size
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))
+    # Max number of chats kept in the in-memory filter index
+    FILTER_CACHE_SIZE = int(os.getenv("FILTER_CACHE_SIZE", "10000"))
+    # Triggers per page of /filters
+    FILTERS_PAGE_SIZE = int(os.getenv("FILTERS_PAGE_SIZE", "50"))
+    # Max number of chats remembered as having no filters at all
+    FILTER_EMPTY_CACHE_SIZE = int(os.getenv("FILTER_EMPTY_CACHE_SIZE", "100000"))
+    # Max number of chats whose blacklist is kept in memory
+    BLACKLIST_CACHE_SIZE = int(os.getenv("BLACKLIST_CACHE_SIZE", "10000"))
+    # Also enforce blacklist rows stored with chat_id 0, checked through a Bloom filter
+    GLOBAL_BLACKLIST = os.getenv("GLOBAL_BLACKLIST", "0").lower() in ("1", "true", "yes")
+    GLOBAL_BLACKLIST_CAPACITY = int(os.getenv("GLOBAL_BLACKLIST_CAPACITY", "1000000"))
+    # Seconds a chat's administrator list is trusted before refetching
+    ADMIN_CACHE_TTL = int(os.getenv("ADMIN_CACHE_TTL", "300"))
+    # Max number of chats whose administrator list is kept
+    ADMIN_CACHE_SIZE = int(os.getenv("ADMIN_CACHE_SIZE", "10000"))
+    # Write-behind: batch DB writes into one commit per interval (ms) or per batch size
+    WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0").lower() in ("1", "true", "yes")
+    WRITE_BEHIND_INTERVAL_MS = int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "50"))
+    WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "256"))
+    # Days after which a warn expires on its own (0 = never)
+    WARN_DECAY_DAYS = int(os.getenv("WARN_DECAY_DAYS", "0"))
+    # Seconds of upcoming scheduled jobs held in memory, the rest stays in the database
+    JOB_HORIZON = int(os.getenv("JOB_HORIZON", "3600"))
+    # Flood protection defaults for chats without their own /flood settings:
+    # FLOOD_LIMIT messages (0 = off) per FLOOD_WINDOW seconds mutes for FLOOD_MUTE seconds
+    FLOOD_LIMIT = int(os.getenv("FLOOD_LIMIT", "10"))
+    FLOOD_WINDOW = int(os.getenv("FLOOD_WINDOW", "5"))
+    FLOOD_MUTE = int(os.getenv("FLOOD_MUTE", "600"))
+    # Messages per FLOOD_WINDOW from a whole chat that count as a raid (0 = off)
+    FLOOD_CHAT_LIMIT = int(os.getenv("FLOOD_CHAT_LIMIT", "60"))
+    # Max chats tracked, and seconds after which a quiet chat's counters are dropped
+    FLOOD_MAX_CHATS = int(os.getenv("FLOOD_MAX_CHATS", "10000"))
+    FLOOD_IDLE = int(os.getenv("FLOOD_IDLE", "600"))
+    # Prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics (shard workers use the next ports)
+    METRICS = os.getenv("METRICS", "0").lower() in ("1", "true", "yes")
+    METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+    # Queries slower than this are logged with their SQL (0 = off)
+    METRICS_SLOW_QUERY_MS = int(os.getenv("METRICS_SLOW_QUERY_MS", "0"))
+    # File the recently active chats are saved to on shutdown and preloaded from on start, empty = off
+    CACHE_SNAPSHOT = os.getenv("CACHE_SNAPSHOT", "")
+    CACHE_SNAPSHOT_CHATS = int(os.getenv("CACHE_SNAPSHOT_CHATS", "5000"))
+    # Max chats whose language is kept in memory
+    LANGUAGE_CACHE_SIZE = int(os.getenv("LANGUAGE_CACHE_SIZE", "100000"))
+    # Max @usernames kept in memory for resolving command targets
+    USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", "100000"))
+    # Seconds between batched writes of newly seen usernames
+    USERNAME_FLUSH_INTERVAL = int(os.getenv("USERNAME_FLUSH_INTERVAL", "30"))
+    # How updates are received: polling | webhook
+    UPDATES_MODE = os.getenv("UPDATES_MODE", "polling")
+    # Handler modules to load, e.g. "admin,filters" for a filters-only bot
+    HANDLERS = os.getenv("HANDLERS", "admin,transfer,language,federation,filters").replace(",", " ").split()
+    # Public base URL Telegram posts to, e.g. https://bot.example.com
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    # Token Telegram sends with each update; a random one is generated per start when unset
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+    # Updates buffered between the HTTP server and the dispatcher
+    WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+    # Updates handled at once, across chats (in order within a chat)
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+    # Keep updates sent while the bot was down, skipping ones already handled before it stopped
+    KEEP_PENDING_UPDATES = os.getenv("KEEP_PENDING_UPDATES", "1").lower() in ("1", "true", "yes")
+    # Seconds between saves of the handled update offset while polling
+    OFFSET_SAVE_INTERVAL = int(os.getenv("OFFSET_SAVE_INTERVAL", "5"))
+    # Messages older than this are backlog: commands still run, the rest is skipped (0 = off)
+    STALE_UPDATE_SECONDS = int(os.getenv("STALE_UPDATE_SECONDS", "120"))
+    # Worker processes; above 1 this process only ingests and shards updates by chat_id
+    WORKERS = int(os.getenv("WORKERS", "1"))
+    WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+    # Updates in flight per process or worker (different chats run concurrently, one chat in order)
+    WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "64"))
+    # Seconds without a heartbeat before a worker is considered hung and restarted
+    WORKER_HEARTBEAT_TIMEOUT = int(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30"))
+    # Outbound pacing (per process; split between workers when sharded)
+    OUTBOUND_SCHEDULER = os.getenv("OUTBOUND_SCHEDULER", "1").lower() in ("1", "true", "yes")
+    OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+    OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+    OUTBOUND_GROUP_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20"))
+    # Filter replies: max queued per chat, and seconds before a queued one is dropped
+    OUTBOUND_LOW_QUEUE_LIMIT = int(os.getenv("OUTBOUND_LOW_QUEUE_LIMIT", "10"))
+    OUTBOUND_LOW_MAX_WAIT = float(os.getenv("OUTBOUND_LOW_MAX_WAIT", "30"))
+    # /fban: ban calls in flight at once (the outbound scheduler still paces them), and seconds between progress edits
+    FED_BAN_CONCURRENCY = int(os.getenv("FED_BAN_CONCURRENCY", "8"))
+    FED_PROGRESS_INTERVAL = float(os.getenv("FED_PROGRESS_INTERVAL", "3"))
 
     if not BOT_TOKEN:
         raise ValueError("BOT_TOKEN environment variable not set in .env")
\ No newline at end of file
@@ -0,0 +1,233 @@
+from collections import OrderedDict
+from typing import Callable, Optional
+from ..utils.matcher import TriggerMatcher
+from ..utils.bloom import BloomFilter
+
+class FilterRecord:
+    '''Compact, session-independent copy of a CustomFilter row.'''
+    __slots__ = ("trigger", "response", "file_id", "file_type", "mode")
+
+    def __init__(self, trigger: str, response: str, file_id: Optional[str] = None, file_type: Optional[str] = None, mode: str = "exact"):
+        self.trigger = trigger
+        self.response = response
+        self.file_id = file_id
+        self.file_type = file_type
+        self.mode = mode
+
+def normalize_trigger(text: str) -> str:
+    return text.lower()
+
+class ChatFilterIndex:
+    '''
+    All filters of one chat.
+    Exact triggers are a dict probe; "contains" and regex triggers are compiled into
+    one TriggerMatcher, built on first use and rebuilt only after the chat's filters change.
+    '''
+    __slots__ = ("exact", "patterns", "_matcher")
+
+    def __init__(self):
+        self.exact: dict[str, FilterRecord] = {}
+        self.patterns: list[FilterRecord] = []
+        self._matcher: Optional[TriggerMatcher] = None
+
+    def add(self, record: FilterRecord):
+        if record.mode == "exact":
+            # The first filter stored for a trigger wins, same as the old linear scan
+            self.exact.setdefault(normalize_trigger(record.trigger), record)
+        else:
+            self.patterns.append(record)
+            self._matcher = None
+
+    def match(self, text: str) -> Optional[FilterRecord]:
+        record = self.exact.get(normalize_trigger(text))
+        if record is not None or not self.patterns:
+            return record
+        if self._matcher is None:
+            self._matcher = TriggerMatcher((r.mode, r.trigger, r) for r in self.patterns)
+        return self._matcher.match(text)
+
+    def __len__(self):
+        return len(self.exact) + len(self.patterns)
+
+EMPTY_INDEX = ChatFilterIndex()
+
+# Blacklist rows with this chat_id apply to every chat
+GLOBAL_CHAT_ID = 0
+
+class FilterCache:
+    '''
+    Process-wide per-chat filter index.
+    Maps chat_id -> ChatFilterIndex, evicting least recently used chats.
+    Chats known to have no filters live in a separate, larger negative index of bare ids,
+    so the many quiet chats neither cost a query per message nor crowd the LRU.
+    '''
+    def __init__(self, max_chats: int = 10000, max_empty: int = 100000):
+        self.max_chats = max_chats
+        self.max_empty = max_empty
+        self._chats: "OrderedDict[int, ChatFilterIndex]" = OrderedDict()
+        self._empty: "OrderedDict[int, None]" = OrderedDict()
+        self.hits = 0
+        self.empty_hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int) -> Optional[ChatFilterIndex]:
+        if chat_id in self._empty:
+            self._empty.move_to_end(chat_id)
+            self.empty_hits += 1
+            return EMPTY_INDEX
+        index = self._chats.get(chat_id)
+        if index is None:
+            self.misses += 1
+            return None
+        self._chats.move_to_end(chat_id)
+        self.hits += 1
+        return index
+
+    def load(self, chat_id: int, rows) -> ChatFilterIndex:
+        index = ChatFilterIndex()
+        for row in rows:
+            index.add(FilterRecord(row.trigger, row.response, row.file_id, row.file_type, row.mode or "exact"))
+        if not len(index):
+            self._empty[chat_id] = None
+            while len(self._empty) > self.max_empty:
+                self._empty.popitem(last=False)
+            return EMPTY_INDEX
+        self._store(chat_id, index)
+        return index
+
+    def _store(self, chat_id: int, index: ChatFilterIndex):
+        self._chats[chat_id] = index
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def add(self, chat_id: int, record: FilterRecord):
+        if chat_id in self._empty:
+            # First filter of a chat known to be empty
+            del self._empty[chat_id]
+            index = ChatFilterIndex()
+            index.add(record)
+            self._store(chat_id, index)
+            return
+        # Only update chats that are already indexed, others load lazily on next lookup
+        index = self._chats.get(chat_id)
+        if index is not None:
+            index.add(record)
+
+    def invalidate(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+        self._empty.pop(chat_id, None)
+
+    def clear(self):
+        self._chats.clear()
+        self._empty.clear()
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "empty_chats": len(self._empty),
+            "hits": self.hits,
+            "empty_hits": self.empty_hits,
+            "misses": self.misses,
+        }
+
+    def __len__(self):
+        return len(self._chats)
+
+class BlacklistCache:
+    '''
+    Per-chat blacklist as sets of user ids, evicting least recently used chats.
+    The global blacklist is only kept as a Bloom filter; its positives are confirmed in the DB.
+    '''
+    def __init__(self, max_chats: int = 10000):
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, set[int]]" = OrderedDict()
+        self.global_bloom: Optional[BloomFilter] = None
+        # Set in sharded workers: tells the workers serving other chats that their blacklists changed
+        self.on_change: Optional[Callable[[list[int]], None]] = None
+        self.hits = 0
+        self.misses = 0
+        self.bloom_rejects = 0
+
+    def get(self, chat_id: int) -> Optional[set]:
+        members = self._chats.get(chat_id)
+        if members is None:
+            self.misses += 1
+            return None
+        self._chats.move_to_end(chat_id)
+        self.hits += 1
+        return members
+
+    def load(self, chat_id: int, user_ids) -> set:
+        members = set(user_ids)
+        self._chats[chat_id] = members
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+        return members
+
+    def add(self, chat_id: int, user_id: int):
+        members = self._chats.get(chat_id)
+        if members is not None:
+            members.add(user_id)
+        if self.global_bloom is not None and chat_id == GLOBAL_CHAT_ID:
+            self.global_bloom.add(user_id)
+
+    def invalidate(self, chat_ids):
+        for chat_id in chat_ids:
+            self._chats.pop(chat_id, None)
+
+    def discard(self, chat_id: int, user_id: int):
+        # Bloom filters can't delete; a removed global id just fails the DB confirmation
+        members = self._chats.get(chat_id)
+        if members is not None:
+            members.discard(user_id)
+
+    def clear(self):
+        self._chats.clear()
+        self.global_bloom = None
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "hits": self.hits,
+            "misses": self.misses,
+            "bloom_rejects": self.bloom_rejects,
+        }
+
+class LanguageCache:
+    '''
+    chat_id -> language code, evicting least recently used chats.
+    Private chats (positive ids) carry the user's language, groups the chat's.
+    '''
+    def __init__(self, max_chats: int = 100000):
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int) -> Optional[str]:
+        code = self._chats.get(chat_id)
+        if code is None:
+            self.misses += 1
+            return None
+        self._chats.move_to_end(chat_id)
+        self.hits += 1
+        return code
+
+    def set(self, chat_id: int, code: str):
+        self._chats[chat_id] = code
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    def recent(self, limit: int) -> list[int]:
+        '''Up to `limit` most recently active chats, least recent first.'''
+        chats = list(self._chats)
+        return chats[-limit:] if limit else []
+
+    def clear(self):
+        self._chats.clear()
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "hits": self.hits, "misses": self.misses}
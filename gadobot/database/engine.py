@@ -0,0 +1,159 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
+from ..config import Config
+from .migrations import migrate
+from .repo import Repository
+from .writebehind import WriteBehind
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_BACKENDS = ("sqlite", "postgresql")
+
+class UpdateUsage:
+    '''Set by Database.count_update for the update being handled; any repository that queried marks it.'''
+    __slots__ = ("used_db",)
+
+    def __init__(self):
+        self.used_db = False
+
+_update_usage: ContextVar[Optional[UpdateUsage]] = ContextVar("update_usage", default=None)
+
+def _sqlite_pragmas(engine: AsyncEngine, readonly: bool):
+    @event.listens_for(engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={Config.SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size={Config.SQLITE_CACHE_SIZE}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if readonly:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+        if not readonly:
+            # pysqlite emits no BEGIN before a SAVEPOINT, so releasing the outermost savepoint
+            # would commit on its own and a write-behind batch couldn't be rolled back.
+            # Take over transaction control and begin explicitly (SQLAlchemy's pysqlite recipe).
+            dbapi_connection.isolation_level = None
+
+    if not readonly:
+        @event.listens_for(engine.sync_engine, "begin")
+        def on_begin(conn):
+            conn.exec_driver_sql("BEGIN")
+
+def create_engines() -> tuple[AsyncEngine, AsyncEngine]:
+    '''
+    Builds (write_engine, read_engine) from Config.DB_URL, which must be SQLite or PostgreSQL.
+    SQLite: one writer connection plus a pool of WAL readers, so lookups never wait behind commits.
+    Server databases: one pooled engine serves both.
+    '''
+    url = make_url(Config.DB_URL)
+    echo = Config.DB_ECHO
+    # Upserts are written with the ON CONFLICT dialects of these two
+    if url.get_backend_name() not in SUPPORTED_BACKENDS:
+        raise ValueError(f"Unsupported DB_URL backend {url.get_backend_name()!r} (supported: {', '.join(SUPPORTED_BACKENDS)})")
+
+    if url.get_backend_name() != "sqlite":
+        engine = create_async_engine(
+            url, echo=echo, pool_pre_ping=True,
+            pool_size=Config.DB_POOL_SIZE, max_overflow=Config.DB_MAX_OVERFLOW,
+        )
+        return engine, engine
+
+    if url.database in (None, "", ":memory:"):
+        # In-memory databases are per connection, there is nothing to split
+        engine = create_async_engine(url, echo=echo)
+        return engine, engine
+
+    writer = create_async_engine(url, echo=echo, pool_size=1, max_overflow=0)
+    _sqlite_pragmas(writer, readonly=False)
+    reader = create_async_engine(url, echo=echo, pool_size=Config.DB_READ_POOL_SIZE, max_overflow=0)
+    _sqlite_pragmas(reader, readonly=True)
+    return writer, reader
+
+class Database:
+    '''Engines, session factories and the optional write-behind queue of one process.'''
+    def __init__(self):
+        self.engine, self.read_engine = create_engines()
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.read_session = None
+        if self.read_engine is not self.engine:
+            self.read_session = async_sessionmaker(self.read_engine, expire_on_commit=False)
+        self.write_behind = None
+
+        # Updates handled without opening any session (cache-only fast path)
+        self.updates_without_db = 0
+        self.updates_with_db = 0
+
+    async def migrate(self):
+        '''Brings the schema to the current version; checks a single row when it already is.'''
+        started = time.monotonic()
+        async with self.engine.begin() as conn:
+            before, after = await conn.run_sync(migrate)
+        if before != after:
+            logger.info("Schema at version %d (was %s) in %.2fs", after, before, time.monotonic() - started)
+
+    def start(self):
+        if Config.WRITE_BEHIND:
+            self.write_behind = WriteBehind(
+                self.session,
+                interval=Config.WRITE_BEHIND_INTERVAL_MS / 1000,
+                max_batch=Config.WRITE_BEHIND_BATCH,
+                on_rollback=Repository.invalidate_caches,
+            )
+            self.write_behind.start()
+
+    @asynccontextmanager
+    async def repository(self):
+        '''Yields a Repository that opens its sessions only when a handler first queries.'''
+        repo = Repository(
+            write_behind=self.write_behind,
+            session_factory=self.session,
+            read_session_factory=self.read_session,
+        )
+        try:
+            yield repo
+        finally:
+            if repo.used_db:
+                usage = _update_usage.get()
+                if usage:
+                    usage.used_db = True
+                await repo.close()
+
+    async def count_update(self, handler, event, data):
+        '''Outer update middleware: counts each update once, as handled with or without the database.'''
+        usage = UpdateUsage()
+        token = _update_usage.set(usage)
+        try:
+            return await handler(event, data)
+        finally:
+            _update_usage.reset(token)
+            if usage.used_db:
+                self.updates_with_db += 1
+            else:
+                self.updates_without_db += 1
+
+    def stats(self) -> dict:
+        stats = {
+            "updates_without_db": self.updates_without_db,
+            "updates_with_db": self.updates_with_db,
+        }
+        if self.write_behind:
+            stats.update({f"write_behind_{k}": v for k, v in self.write_behind.stats().items()})
+        return stats
+
+    async def close(self):
+        # Drain queued writes before the process exits
+        if self.write_behind:
+            await self.write_behind.close()
+            self.write_behind = None
+        await self.engine.dispose()
+        if self.read_engine is not self.engine:
+            await self.read_engine.dispose()
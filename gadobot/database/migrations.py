@@ -0,0 +1,79 @@
+import logging
+from typing import Optional
+from sqlalchemy import inspect, text
+from .models import Base
+
+logger = logging.getLogger(__name__)
+
+# Columns added before schema versioning: table -> {column: DDL type}
+LEGACY_COLUMNS = {
+    "filters": {"mode": "VARCHAR"},
+    "chat_settings": {"flood_limit": "INTEGER", "flood_window": "INTEGER", "flood_mute": "INTEGER"},
+    "users": {"username": "VARCHAR"},
+}
+
+# Indexes added before schema versioning: index name -> (table, columns)
+LEGACY_INDEXES = {
+    "ix_users_username": ("users", "username"),
+    "ix_filters_chat_id_id": ("filters", "chat_id, id"),
+}
+
+def _upgrade_legacy(conn):
+    '''Databases from before versioning: created by create_all, with columns added in place since.'''
+    # Tables added since, e.g. bot_state and federations
+    Base.metadata.create_all(conn)
+    inspector = inspect(conn)
+    for table, columns in LEGACY_COLUMNS.items():
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for name, ddl in columns.items():
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    for index, (table, columns) in LEGACY_INDEXES.items():
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {index} ON {table} ({columns})"))
+
+# version -> (description, sync function run with the connection)
+# The models always describe the latest version: a new database is created from them
+# and stamped with SCHEMA_VERSION, older ones run every migration above their version.
+# To change the schema, change the models and append the matching step here.
+MIGRATIONS = {
+    1: ("Columns and indexes added before schema versioning", _upgrade_legacy),
+}
+SCHEMA_VERSION = max(MIGRATIONS)
+
+def read_version(conn) -> Optional[int]:
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    return conn.execute(text("SELECT version FROM schema_version")).scalar()
+
+def write_version(conn, version: int):
+    conn.execute(text("DELETE FROM schema_version"))
+    conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+
+def migrate(conn) -> tuple[Optional[int], int]:
+    '''
+    Sync helper for conn.run_sync(), inside one transaction.
+    An up-to-date database costs one SELECT, no reflection.
+    Returns: (version before, version after)
+    '''
+    version = read_version(conn)
+    if version == SCHEMA_VERSION:
+        return version, version
+
+    if version is None:
+        if not inspect(conn).has_table("warns"):
+            Base.metadata.create_all(conn)
+            write_version(conn, SCHEMA_VERSION)
+            return None, SCHEMA_VERSION
+        # Created before versioning
+        version = 0
+
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than this code ({SCHEMA_VERSION})")
+
+    start = version
+    for target in sorted(v for v in MIGRATIONS if v > version):
+        description, step = MIGRATIONS[target]
+        logger.info("Migrating schema to version %d: %s", target, description)
+        step(conn)
+        version = target
+    write_version(conn, version)
+    return start, version
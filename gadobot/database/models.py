@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, BigInteger, UniqueConstraint
+from sqlalchemy import Column, Integer, String, BigInteger, UniqueConstraint, Index
 from sqlalchemy.orm import DeclarativeBase
 from sqlalchemy.ext.asyncio import AsyncAttrs
 
@@ -18,6 +18,11 @@ class ChatSettings(Base):
     chat_id = Column(BigInteger, primary_key=True)
     warn_limit = Column(Integer, default=3)
     lang = Column(String, default="eng")
+    # Flood protection: messages per window (0 = off), window and mute length in seconds.
+    # NULL means the defaults from Config.
+    flood_limit = Column(Integer, nullable=True)
+    flood_window = Column(Integer, nullable=True)
+    flood_mute = Column(Integer, nullable=True)
 
 class Blacklist(Base):
     __tablename__ = "blacklist"
@@ -34,8 +39,45 @@ class CustomFilter(Base):
     response = Column(String)
     file_id = Column(String, nullable=True) 
     file_type = Column(String, nullable=True) 
+    # exact | contains | regex; NULL on rows created before modes existed means exact
+    mode = Column(String, nullable=True, default="exact")
+    # Keyset pagination of /filters walks (chat_id, id)
+    __table_args__ = (Index("ix_filters_chat_id_id", "chat_id", "id"),)
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True)
     user_id = Column(BigInteger, unique=True, index=True)
-    lang = Column(String, default="eng")
\ No newline at end of file
+    lang = Column(String, default="eng")
+    # Last seen @username, lowercase and without the @
+    username = Column(String, nullable=True, index=True)
+
+class ScheduledJob(Base):
+    __tablename__ = "scheduled_jobs"
+    id = Column(Integer, primary_key=True)
+    # Unix timestamp the job is due at
+    run_at = Column(BigInteger, index=True)
+    # unwarn | unban | unmute | filter_expire
+    kind = Column(String)
+    chat_id = Column(BigInteger, index=True)
+    user_id = Column(BigInteger, nullable=True)
+    payload = Column(String, nullable=True)
+
+# Small key/value state of the bot itself, e.g. the last handled update_id
+class BotState(Base):
+    __tablename__ = "bot_state"
+    key = Column(String, primary_key=True)
+    value = Column(BigInteger)
+
+# Linked chats sharing bans; /fban in any member chat bans in all of them
+class Federation(Base):
+    __tablename__ = "federations"
+    id = Column(Integer, primary_key=True)
+    name = Column(String)
+    owner_id = Column(BigInteger, index=True)
+
+# A chat belongs to at most one federation
+class FederationChat(Base):
+    __tablename__ = "federation_chats"
+    chat_id = Column(BigInteger, primary_key=True)
+    fed_id = Column(Integer, index=True)
@@ -1,101 +1,526 @@
-from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete, update
-from .models import Warn, ChatSettings, Blacklist, CustomFilter, User
+from typing import Callable, Optional
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy import select, insert, delete, update, func, case, tuple_
+from sqlalchemy.dialects import sqlite, postgresql
+from .models import Warn, ChatSettings, Blacklist, CustomFilter, User, ScheduledJob, BotState, Federation, FederationChat
+from .cache import FilterCache, FilterRecord, ChatFilterIndex, BlacklistCache, LanguageCache, GLOBAL_CHAT_ID
+from ..utils.bloom import BloomFilter
+from .writebehind import WriteBehind
+from ..config import Config
+from ..resources.locales import DEFAULT_LOCALE
+
+filter_cache = FilterCache(Config.FILTER_CACHE_SIZE, Config.FILTER_EMPTY_CACHE_SIZE)
+blacklist_cache = BlacklistCache(Config.BLACKLIST_CACHE_SIZE)
+language_cache = LanguageCache(Config.LANGUAGE_CACHE_SIZE)
+
+DEFAULT_WARN_LIMIT = 3
 
 class Repository:
-    def __init__(self, session: AsyncSession):
-        self.session = session
+    # Set in sharded workers: has the ingest tell every other worker to drop its caches too
+    on_invalidate_all: Optional[Callable[[], None]] = None
+
+    def __init__(self, session: AsyncSession = None, write_behind: WriteBehind = None, read_session: AsyncSession = None,
+                 session_factory: async_sessionmaker = None, read_session_factory: async_sessionmaker = None):
+        '''
+        Pass sessions directly, or factories to open them lazily on first use
+        (then call close() when done). Cached lookups never open a session at all.
+        '''
+        self._session = session
+        self._read_session = read_session
+        self._session_factory = session_factory
+        self._read_session_factory = read_session_factory
+        self._opened: list[AsyncSession] = []
+        self.write_behind = write_behind
+
+    @property
+    def session(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_factory()
+            self._opened.append(self._session)
+        return self._session
+
+    @property
+    def read_session(self) -> AsyncSession:
+        # Separate read-only session (SQLite WAL readers); falls back to the write session
+        if self._read_session is None:
+            if not self._read_session_factory:
+                return self.session
+            self._read_session = self._read_session_factory()
+            self._opened.append(self._read_session)
+        return self._read_session
+
+    @property
+    def used_db(self) -> bool:
+        return bool(self._opened)
+
+    async def close(self):
+        for session in self._opened:
+            await session.close()
+        self._opened.clear()
+
+    async def _write(self, stmt):
+        if self.write_behind:
+            return await self.write_behind.execute(stmt)
+        return await self.session.execute(stmt)
+
+    async def _read(self, stmt):
+        # Read-your-writes: while a batch is open, read on its session (cache loads must see it)
+        if self.write_behind and self.write_behind.pending:
+            return await self.write_behind.read(stmt)
+        return await self.read_session.execute(stmt)
+
+    async def _commit(self):
+        # In write-behind mode the batch is committed by WriteBehind
+        if not self.write_behind:
+            await self.session.commit()
+
+    def _insert(self, model):
+        '''Dialect-specific INSERT, for ON CONFLICT upserts.'''
+        if self.session.bind.dialect.name == "postgresql":
+            return postgresql.insert(model)
+        return sqlite.insert(model)
+
+    def _warn_limit_expr(self, chat_id: int):
+        return func.coalesce(
+            select(ChatSettings.warn_limit).where(ChatSettings.chat_id == chat_id).scalar_subquery(),
+            DEFAULT_WARN_LIMIT,
+        )
 
     # --- Warns ---
-    async def add_warn(self, chat_id: int, user_id: int) -> int:
-        result = await self.session.execute(
-            select(Warn).where(Warn.chat_id == chat_id, Warn.user_id == user_id)
+    async def warn(self, chat_id: int, user_id: int) -> tuple[int, int, bool]:
+        '''
+        Atomically adds a warn in one statement.
+        The count is reset when it reaches the chat's limit.
+        Returns: (count, limit, should_ban)
+        '''
+        limit = self._warn_limit_expr(chat_id)
+        stmt = self._insert(Warn).values(
+            chat_id=chat_id, user_id=user_id,
+            count=case((limit <= 1, 0), else_=1),
         )
-        warn = result.scalar_one_or_none()
-        if not warn:
-            warn = Warn(chat_id=chat_id, user_id=user_id, count=1)
-            self.session.add(warn)
-        else:
-            warn.count += 1
-        await self.session.commit()
-        return warn.count
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Warn.chat_id, Warn.user_id],
+            set_={"count": case((Warn.count + 1 >= limit, 0), else_=Warn.count + 1)},
+        ).returning(Warn.count, limit)
+        result = await self._write(stmt)
+        count, limit = result.one()
+        await self._commit()
+        # A stored count of 0 means the limit was just reached and the warns were reset
+        if count == 0:
+            return limit, limit, True
+        return count, limit, False
+
+    async def add_warn(self, chat_id: int, user_id: int) -> int:
+        stmt = self._insert(Warn).values(chat_id=chat_id, user_id=user_id, count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Warn.chat_id, Warn.user_id],
+            set_={"count": Warn.count + 1},
+        ).returning(Warn.count)
+        result = await self._write(stmt)
+        count = result.scalar_one()
+        await self._commit()
+        return count
 
     async def remove_warn(self, chat_id: int, user_id: int):
         # Decrement or delete? Original logic deleted on 0, but usually removing a warn decreases count
-        result = await self.session.execute(
-            select(Warn).where(Warn.chat_id == chat_id, Warn.user_id == user_id)
-        )
-        warn = result.scalar_one_or_none()
-        if warn:
-            if warn.count > 1:
-                warn.count -= 1
-            else:
-                await self.session.delete(warn)
-            await self.session.commit()
+        where = (Warn.chat_id == chat_id, Warn.user_id == user_id)
+        await self._write(delete(Warn).where(*where, Warn.count <= 1))
+        await self._write(update(Warn).where(*where).values(count=Warn.count - 1))
+        await self._commit()
 
     async def reset_warns(self, chat_id: int, user_id: int):
-        await self.session.execute(
+        await self._write(
             delete(Warn).where(Warn.chat_id == chat_id, Warn.user_id == user_id)
         )
-        await self.session.commit()
+        await self._commit()
 
     async def get_warns(self, chat_id: int, user_id: int) -> int:
-        result = await self.session.execute(
+        result = await self._read(
             select(Warn.count).where(Warn.chat_id == chat_id, Warn.user_id == user_id)
         )
         return result.scalar_one_or_none() or 0
 
     # --- Settings ---
     async def set_warn_limit(self, chat_id: int, limit: int):
-        result = await self.session.execute(select(ChatSettings).where(ChatSettings.chat_id == chat_id))
-        settings = result.scalar_one_or_none()
-        if not settings:
-            settings = ChatSettings(chat_id=chat_id, warn_limit=limit)
-            self.session.add(settings)
-        else:
-            settings.warn_limit = limit
-        await self.session.commit()
+        stmt = self._insert(ChatSettings).values(chat_id=chat_id, warn_limit=limit)
+        stmt = stmt.on_conflict_do_update(index_elements=[ChatSettings.chat_id], set_={"warn_limit": limit})
+        await self._write(stmt)
+        await self._commit()
 
     async def get_warn_limit(self, chat_id: int) -> int:
-        result = await self.session.execute(select(ChatSettings.warn_limit).where(ChatSettings.chat_id == chat_id))
-        return result.scalar_one_or_none() or 3
+        result = await self._read(select(ChatSettings.warn_limit).where(ChatSettings.chat_id == chat_id))
+        return result.scalar_one_or_none() or DEFAULT_WARN_LIMIT
+
+    async def set_flood_settings(self, chat_id: int, limit: int, window: int, mute: int):
+        values = {"flood_limit": limit, "flood_window": window, "flood_mute": mute}
+        stmt = self._insert(ChatSettings).values(chat_id=chat_id, **values)
+        stmt = stmt.on_conflict_do_update(index_elements=[ChatSettings.chat_id], set_=values)
+        await self._write(stmt)
+        await self._commit()
+
+    async def get_flood_settings(self, chat_id: int) -> tuple[int, int, int]:
+        '''(limit, window, mute) of the chat, with unset values taken from Config.'''
+        result = await self._read(
+            select(ChatSettings.flood_limit, ChatSettings.flood_window, ChatSettings.flood_mute)
+            .where(ChatSettings.chat_id == chat_id)
+        )
+        limit, window, mute = result.one_or_none() or (None, None, None)
+        return (
+            Config.FLOOD_LIMIT if limit is None else limit,
+            window or Config.FLOOD_WINDOW,
+            mute or Config.FLOOD_MUTE,
+        )
+
+    async def load_language(self, chat_id: int) -> str:
+        '''Reads the language of a chat, or of the user for private chats, into language_cache.'''
+        if chat_id > 0:
+            stmt = select(User.lang).where(User.user_id == chat_id)
+        else:
+            stmt = select(ChatSettings.lang).where(ChatSettings.chat_id == chat_id)
+        result = await self._read(stmt)
+        code = result.scalar_one_or_none() or DEFAULT_LOCALE
+        language_cache.set(chat_id, code)
+        return code
+
+    async def set_language(self, chat_id: int, code: str):
+        if chat_id > 0:
+            stmt = self._insert(User).values(user_id=chat_id, lang=code)
+            stmt = stmt.on_conflict_do_update(index_elements=[User.user_id], set_={"lang": code})
+        else:
+            stmt = self._insert(ChatSettings).values(chat_id=chat_id, lang=code)
+            stmt = stmt.on_conflict_do_update(index_elements=[ChatSettings.chat_id], set_={"lang": code})
+        await self._write(stmt)
+        await self._commit()
+        language_cache.set(chat_id, code)
 
     # --- Blacklist ---
     async def add_blacklist(self, chat_id: int, user_id: int):
-        exists = await self.session.execute(select(Blacklist).where(Blacklist.chat_id == chat_id, Blacklist.user_id == user_id))
-        if not exists.scalar_one_or_none():
-            self.session.add(Blacklist(chat_id=chat_id, user_id=user_id))
-            await self.session.commit()
+        stmt = self._insert(Blacklist).values(chat_id=chat_id, user_id=user_id)
+        await self._write(stmt.on_conflict_do_nothing(index_elements=[Blacklist.chat_id, Blacklist.user_id]))
+        await self._commit()
+        blacklist_cache.add(chat_id, user_id)
 
     async def remove_blacklist(self, chat_id: int, user_id: int) -> bool:
-        result = await self.session.execute(
+        result = await self._write(
             delete(Blacklist).where(Blacklist.chat_id == chat_id, Blacklist.user_id == user_id)
         )
-        await self.session.commit()
+        await self._commit()
+        blacklist_cache.discard(chat_id, user_id)
         return result.rowcount > 0
 
+    async def add_blacklist_many(self, entries: list[tuple[int, int]], chunk: int = 500):
+        '''Blacklists many (chat_id, user_id) pairs with one multi-row INSERT per chunk and a single commit.'''
+        for start in range(0, len(entries), chunk):
+            rows = [{"chat_id": c, "user_id": u} for c, u in entries[start:start + chunk]]
+            stmt = self._insert(Blacklist).values(rows)
+            await self._write(stmt.on_conflict_do_nothing(index_elements=[Blacklist.chat_id, Blacklist.user_id]))
+        await self._commit()
+        for chat_id, user_id in entries:
+            blacklist_cache.add(chat_id, user_id)
+        if blacklist_cache.on_change:
+            blacklist_cache.on_change(sorted({chat_id for chat_id, _ in entries}))
+
     async def get_blacklist(self, chat_id: int) -> list[int]:
-        result = await self.session.execute(select(Blacklist.user_id).where(Blacklist.chat_id == chat_id))
+        result = await self._read(select(Blacklist.user_id).where(Blacklist.chat_id == chat_id))
+        return list(result.scalars().all())
+
+    async def is_blacklisted(self, chat_id: int, user_id: int) -> bool:
+        '''O(1) membership check against the cached chat blacklist, then the global one.'''
+        members = blacklist_cache.get(chat_id)
+        if members is None:
+            members = blacklist_cache.load(chat_id, await self.get_blacklist(chat_id))
+        if user_id in members:
+            return True
+        if not Config.GLOBAL_BLACKLIST:
+            return False
+
+        if blacklist_cache.global_bloom is None:
+            await self._load_global_bloom()
+        if user_id not in blacklist_cache.global_bloom:
+            blacklist_cache.bloom_rejects += 1
+            return False
+        result = await self._read(
+            select(Blacklist.id).where(Blacklist.chat_id == GLOBAL_CHAT_ID, Blacklist.user_id == user_id)
+        )
+        return result.scalar_one_or_none() is not None
+
+    async def _load_global_bloom(self):
+        bloom = BloomFilter(Config.GLOBAL_BLACKLIST_CAPACITY)
+        result = await self.read_session.stream(
+            select(Blacklist.user_id).where(Blacklist.chat_id == GLOBAL_CHAT_ID).execution_options(yield_per=10000)
+        )
+        async for user_id in result.scalars():
+            bloom.add(user_id)
+        blacklist_cache.global_bloom = bloom
+
+    # --- Federations ---
+    async def create_federation(self, name: str, owner_id: int) -> int:
+        result = await self._write(insert(Federation).values(name=name, owner_id=owner_id).returning(Federation.id))
+        fed_id = result.scalar_one()
+        await self._commit()
+        return fed_id
+
+    async def get_federation(self, fed_id: int) -> Optional[Federation]:
+        result = await self._read(select(Federation).where(Federation.id == fed_id))
+        return result.scalar_one_or_none()
+
+    async def get_chat_federation(self, chat_id: int) -> Optional[Federation]:
+        result = await self._read(
+            select(Federation).join(FederationChat, FederationChat.fed_id == Federation.id)
+            .where(FederationChat.chat_id == chat_id)
+        )
+        return result.scalar_one_or_none()
+
+    async def join_federation(self, chat_id: int, fed_id: int):
+        stmt = self._insert(FederationChat).values(chat_id=chat_id, fed_id=fed_id)
+        await self._write(stmt.on_conflict_do_update(index_elements=[FederationChat.chat_id], set_={"fed_id": fed_id}))
+        await self._commit()
+
+    async def leave_federation(self, chat_id: int) -> bool:
+        result = await self._write(delete(FederationChat).where(FederationChat.chat_id == chat_id))
+        await self._commit()
+        return result.rowcount > 0
+
+    async def get_federation_chats(self, fed_id: int) -> list[int]:
+        result = await self._read(select(FederationChat.chat_id).where(FederationChat.fed_id == fed_id))
         return list(result.scalars().all())
 
     # --- Filters ---
-    async def add_filter(self, chat_id: int, trigger: str, response: str, file_id=None, file_type=None):
-        self.session.add(CustomFilter(chat_id=chat_id, trigger=trigger, response=response, file_id=file_id, file_type=file_type))
-        await self.session.commit()
+    async def add_filter(self, chat_id: int, trigger: str, response: str, file_id=None, file_type=None, mode: str = "exact"):
+        await self._write(insert(CustomFilter).values(
+            chat_id=chat_id, trigger=trigger, response=response, file_id=file_id, file_type=file_type, mode=mode
+        ))
+        await self._commit()
+        filter_cache.add(chat_id, FilterRecord(trigger, response, file_id, file_type, mode))
 
     async def remove_filter(self, chat_id: int, trigger: str) -> bool:
-        result = await self.session.execute(
+        result = await self._write(
             delete(CustomFilter).where(CustomFilter.chat_id == chat_id, CustomFilter.trigger == trigger)
         )
-        await self.session.commit()
+        await self._commit()
+        filter_cache.invalidate(chat_id)
         return result.rowcount > 0
     
     async def remove_all_filters(self, chat_id: int):
-        await self.session.execute(delete(CustomFilter).where(CustomFilter.chat_id == chat_id))
-        await self.session.commit()
+        await self._write(delete(CustomFilter).where(CustomFilter.chat_id == chat_id))
+        await self._commit()
+        filter_cache.invalidate(chat_id)
 
     async def get_filters(self, chat_id: int):
-        result = await self.session.execute(
+        result = await self._read(
             select(CustomFilter).where(CustomFilter.chat_id == chat_id)
         )
-        return result.scalars().all()
\ No newline at end of file
+        return result.scalars().all()
+
+    async def get_filter_page(self, chat_id: int, after_id: int = 0, before_id: int = 0, limit: int = 50):
+        '''
+        One page of (id, trigger) rows in id order, walked by keyset on (chat_id, id):
+        the page after after_id, or the one before before_id. Fetches one extra row
+        to tell whether more follow in that direction; returns (rows, has_more).
+        '''
+        stmt = select(CustomFilter.id, CustomFilter.trigger).where(CustomFilter.chat_id == chat_id)
+        if before_id:
+            stmt = stmt.where(CustomFilter.id < before_id).order_by(CustomFilter.id.desc())
+        else:
+            stmt = stmt.where(CustomFilter.id > after_id).order_by(CustomFilter.id)
+        result = await self._read(stmt.limit(limit + 1))
+        rows = result.all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before_id:
+            rows.reverse()
+        return rows, has_more
+
+    async def get_filter_index(self, chat_id: int) -> ChatFilterIndex:
+        '''Returns the chat's compiled filter index, hitting the DB only on cache miss.'''
+        index = filter_cache.get(chat_id)
+        if index is None:
+            index = filter_cache.load(chat_id, await self.get_filters(chat_id))
+        return index
+
+    async def match_filter(self, chat_id: int, text: str):
+        index = await self.get_filter_index(chat_id)
+        return index.match(text)
+
+    # --- Cache warm-up ---
+    async def warm_chats(self, chat_ids: list[int], chunk: int = 500):
+        '''Preloads languages and filter indexes of many chats with a few IN queries per chunk.'''
+        for start in range(0, len(chat_ids), chunk):
+            batch = chat_ids[start:start + chunk]
+            groups = [c for c in batch if c <= 0]
+            users = [c for c in batch if c > 0]
+            languages = {}
+            if groups:
+                result = await self._read(select(ChatSettings.chat_id, ChatSettings.lang).where(ChatSettings.chat_id.in_(groups)))
+                languages.update(result.all())
+            if users:
+                result = await self._read(select(User.user_id, User.lang).where(User.user_id.in_(users)))
+                languages.update(result.all())
+
+            rows = {chat_id: [] for chat_id in batch}
+            result = await self._read(select(CustomFilter).where(CustomFilter.chat_id.in_(batch)))
+            for row in result.scalars():
+                rows[row.chat_id].append(row)
+
+            # Oldest first, so the LRU order of the snapshot is kept
+            for chat_id in batch:
+                language_cache.set(chat_id, languages.get(chat_id) or DEFAULT_LOCALE)
+                filter_cache.load(chat_id, rows[chat_id])
+
+    # --- Usernames ---
+    async def get_user_by_username(self, username: str) -> Optional[int]:
+        result = await self._read(select(User.user_id).where(User.username == username).limit(1))
+        return result.scalar_one_or_none()
+
+    async def save_usernames(self, names: dict[int, str], chunk: int = 500):
+        '''
+        Points each username at its latest owner: clears it from earlier owners, then upserts.
+        A name given to several users in `names` goes to the last of them.
+        '''
+        owners = {name: user_id for user_id, name in names.items()}
+        items = [(user_id, name) for name, user_id in owners.items()]
+        for start in range(0, len(items), chunk):
+            rows = [{"user_id": u, "username": n} for u, n in items[start:start + chunk]]
+            await self._write(
+                update(User).where(User.username.in_([r["username"] for r in rows])).values(username=None)
+            )
+            stmt = self._insert(User).values(rows)
+            await self._write(stmt.on_conflict_do_update(
+                index_elements=[User.user_id], set_={"username": stmt.excluded.username}
+            ))
+        await self._commit()
+
+    # --- Bot state ---
+    async def get_state(self, key: str) -> Optional[int]:
+        result = await self._read(select(BotState.value).where(BotState.key == key))
+        return result.scalar_one_or_none()
+
+    async def set_state(self, key: str, value: int):
+        stmt = self._insert(BotState).values(key=key, value=value)
+        await self._write(stmt.on_conflict_do_update(index_elements=[BotState.key], set_={"value": value}))
+        await self._commit()
+
+    # --- Scheduled jobs ---
+    async def add_job(self, run_at: int, kind: str, chat_id: int, user_id: int = None, payload: str = None) -> int:
+        result = await self._write(
+            insert(ScheduledJob).values(run_at=run_at, kind=kind, chat_id=chat_id, user_id=user_id, payload=payload)
+            .returning(ScheduledJob.id)
+        )
+        job_id = result.scalar_one()
+        await self._commit()
+        return job_id
+
+    async def get_job_times(self, start: int, end: int, shard: int = 0, shards: int = 1) -> list[tuple[int, int]]:
+        '''(run_at, id) of jobs due in [start, end) whose chat belongs to this shard; start=None means overdue too.'''
+        stmt = select(ScheduledJob.run_at, ScheduledJob.id).where(ScheduledJob.run_at < end)
+        if start is not None:
+            stmt = stmt.where(ScheduledJob.run_at >= start)
+        if shards > 1:
+            # Same bucket as Python's chat_id % shards, also for negative ids
+            stmt = stmt.where((ScheduledJob.chat_id % shards + shards) % shards == shard)
+        result = await self._read(stmt)
+        return [tuple(row) for row in result.all()]
+
+    async def get_jobs(self, ids: list[int]) -> list:
+        result = await self._read(select(ScheduledJob).where(ScheduledJob.id.in_(ids)).order_by(ScheduledJob.run_at))
+        return list(result.scalars().all())
+
+    async def delete_jobs(self, ids: list[int]):
+        await self._write(delete(ScheduledJob).where(ScheduledJob.id.in_(ids)))
+        await self._commit()
+
+    async def cancel_jobs(self, kind: str, chat_id: int, user_id: int = None, payload: str = None):
+        stmt = delete(ScheduledJob).where(ScheduledJob.kind == kind, ScheduledJob.chat_id == chat_id)
+        if user_id is not None:
+            stmt = stmt.where(ScheduledJob.user_id == user_id)
+        if payload is not None:
+            stmt = stmt.where(ScheduledJob.payload == payload)
+        await self._write(stmt)
+        await self._commit()
+
+    # --- Bulk transfer (export/import) ---
+    async def iter_rows(self, model, key_columns: list, columns: list, chunk: int = 5000):
+        '''
+        Yields lists of row dicts ordered by key_columns, one keyset-paginated query per chunk,
+        so memory stays at one chunk regardless of table size.
+        '''
+        keys = [getattr(model, c) for c in key_columns]
+        selected = keys + [getattr(model, c) for c in columns if c not in key_columns]
+        last = None
+        while True:
+            stmt = select(*selected).order_by(*keys).limit(chunk)
+            if last is not None:
+                stmt = stmt.where(tuple_(*keys) > tuple_(*last))
+            result = await self.read_session.execute(stmt)
+            rows = result.all()
+            if not rows:
+                return
+            last = rows[-1][:len(keys)]
+            yield [{c: row._mapping[c] for c in columns} for row in rows]
+            if len(rows) < chunk:
+                return
+
+    async def bulk_upsert(self, model, rows: list[dict], conflict: list = None):
+        '''
+        One executemany INSERT for the whole batch; on conflict with `conflict` columns
+        the remaining columns are overwritten. Not committed, the caller bounds transactions.
+        '''
+        if not rows:
+            return
+        stmt = self._insert(model)
+        if conflict:
+            updates = {c: stmt.excluded[c] for c in rows[0] if c not in conflict}
+            if updates:
+                stmt = stmt.on_conflict_do_update(index_elements=conflict, set_=updates)
+            else:
+                stmt = stmt.on_conflict_do_nothing(index_elements=conflict)
+        await self.session.execute(stmt, rows)
+
+    async def merge_filters(self, rows: list[dict]):
+        '''
+        Filters have no unique key, so imports match them on (chat_id, trigger, mode) here:
+        a matching row gets the new response and media, other rows are inserted. The first
+        of several rows with one key wins, as it does in the matcher. Not committed.
+        '''
+        merged: dict[tuple, dict] = {}
+        for row in rows:
+            merged.setdefault((row["chat_id"], row["trigger"], row["mode"] or "exact"), row)
+        mode = func.coalesce(CustomFilter.mode, "exact")
+        result = await self.session.execute(
+            select(CustomFilter.id, CustomFilter.chat_id, CustomFilter.trigger, mode)
+            .where(
+                CustomFilter.chat_id.in_({key[0] for key in merged}),
+                CustomFilter.trigger.in_({key[1] for key in merged}),
+            )
+            .order_by(CustomFilter.id)
+        )
+        existing: dict[tuple, int] = {}
+        for filter_id, chat_id, trigger, filter_mode in result.all():
+            existing.setdefault((chat_id, trigger, filter_mode), filter_id)
+
+        updates = [
+            {"id": existing[key], "response": row["response"], "file_id": row["file_id"], "file_type": row["file_type"]}
+            for key, row in merged.items() if key in existing
+        ]
+        inserts = [row for key, row in merged.items() if key not in existing]
+        if updates:
+            await self.session.execute(update(CustomFilter), updates)
+        if inserts:
+            await self.session.execute(insert(CustomFilter), inserts)
+
+    async def commit(self):
+        await self.session.commit()
+
+    @staticmethod
+    def invalidate_caches():
+        '''Drops every in-memory index after out-of-band bulk changes or a failed write-behind batch.'''
+        filter_cache.clear()
+        blacklist_cache.clear()
+        language_cache.clear()
+
+    @classmethod
+    def invalidate_all_caches(cls):
+        '''invalidate_caches() here and, in sharded mode, in every other worker.'''
+        cls.invalidate_caches()
+        if cls.on_invalidate_all:
+            cls.on_invalidate_all()
\ No newline at end of file
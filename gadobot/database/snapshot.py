@@ -0,0 +1,45 @@
+import json
+import logging
+import os
+import time
+from .engine import Database
+from .repo import language_cache
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "gadobot-cache-snapshot"
+
+# Only chat ids are kept: languages and filters are re-read from the database on warm-up,
+# so a snapshot can be stale but never serves stale data.
+
+def save_snapshot(path: str, max_chats: int):
+    '''Writes the most recently active chats (every handled update touches the language cache).'''
+    chats = language_cache.recent(max_chats)
+    tmp = f"{path}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"format": FORMAT, "saved_at": int(time.time()), "chats": chats}, f)
+        os.replace(tmp, path)
+        logger.info("Saved cache snapshot of %d chats", len(chats))
+    except OSError:
+        logger.exception("Saving the cache snapshot failed")
+
+async def warm_caches(db: Database, path: str, max_chats: int) -> int:
+    '''Preloads the chats of a snapshot; a missing or unreadable snapshot just means a cold start.'''
+    try:
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        if snapshot.get("format") != FORMAT:
+            raise ValueError(snapshot.get("format"))
+        chats = [int(c) for c in snapshot["chats"]][-max_chats:]
+    except FileNotFoundError:
+        return 0
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.warning("Ignoring unreadable cache snapshot %s", path)
+        return 0
+
+    started = time.monotonic()
+    async with db.repository() as repo:
+        await repo.warm_chats(chats)
+    logger.info("Warmed caches for %d chats in %.2fs", len(chats), time.monotonic() - started)
+    return len(chats)
@@ -0,0 +1,131 @@
+import asyncio
+import gzip
+import json
+import time
+from typing import Awaitable, Callable, Optional
+from .models import Warn, ChatSettings, Blacklist, CustomFilter, User
+from .repo import Repository
+
+FORMAT = "gadobot-export"
+VERSION = 1
+
+# table -> (model, keyset columns, exported columns, natural key for upserts)
+# Surrogate ids are not exported, rows are matched on their natural key instead.
+# Filters have no unique key in the table; Repository.merge_filters matches them on theirs.
+TABLES = {
+    "chat_settings": (ChatSettings, ["chat_id"], ["chat_id", "warn_limit", "lang", "flood_limit", "flood_window", "flood_mute"], ["chat_id"]),
+    "users": (User, ["id"], ["user_id", "lang", "username"], ["user_id"]),
+    "warns": (Warn, ["chat_id", "id"], ["chat_id", "user_id", "count"], ["chat_id", "user_id"]),
+    "blacklist": (Blacklist, ["chat_id", "id"], ["chat_id", "user_id"], ["chat_id", "user_id"]),
+    "filters": (CustomFilter, ["chat_id", "id"], ["chat_id", "trigger", "response", "file_id", "file_type", "mode"], ["chat_id", "trigger", "mode"]),
+}
+
+Progress = Optional[Callable[[str, int], Awaitable[None]]]
+
+class InvalidExportFile(ValueError):
+    pass
+
+class _Throttle:
+    '''Calls progress at most every `interval` seconds.'''
+    def __init__(self, progress: Progress, interval: float = 3.0):
+        self.progress = progress
+        self.interval = interval
+        self.last = 0.0
+
+    async def __call__(self, table: str, rows: int, force: bool = False):
+        now = time.monotonic()
+        if self.progress and (force or now - self.last >= self.interval):
+            self.last = now
+            await self.progress(table, rows)
+
+async def export_ndjson(repo: Repository, path: str, progress: Progress = None, chunk: int = 5000) -> int:
+    '''
+    Streams every table into a gzip-compressed NDJSON file, one {"t": table, "r": row} per line.
+    Returns the number of rows written.
+    '''
+    report = _Throttle(progress)
+    total = 0
+    with gzip.open(path, "wt", encoding="utf-8", compresslevel=6) as out:
+        out.write(json.dumps({"format": FORMAT, "version": VERSION}) + "\n")
+        for table, (model, keys, columns, _) in TABLES.items():
+            async for rows in repo.iter_rows(model, keys, columns, chunk):
+                lines = "".join(json.dumps({"t": table, "r": row}, ensure_ascii=False) + "\n" for row in rows)
+                # Compression is CPU-bound, keep it off the event loop
+                await asyncio.to_thread(out.write, lines)
+                total += len(rows)
+                await report(table, total)
+    await report("done", total, force=True)
+    return total
+
+def _read_lines(f, count: int) -> list[str]:
+    lines = []
+    for line in f:
+        lines.append(line)
+        if len(lines) >= count:
+            break
+    return lines
+
+async def import_ndjson(repo: Repository, path: str, progress: Progress = None,
+                        batch: int = 1000, transaction_rows: int = 20000) -> int:
+    '''
+    Streams an export file back in with executemany upserts of `batch` rows,
+    committing every `transaction_rows` rows. Rows are matched on their natural key,
+    so importing a file again, e.g. after a failure, doesn't duplicate anything.
+    Returns the number of rows imported.
+    '''
+    report = _Throttle(progress)
+    total = 0
+    uncommitted = 0
+    pending: dict[str, list[dict]] = {}
+
+    async def flush(table: str):
+        nonlocal uncommitted
+        rows = pending.pop(table, None)
+        if not rows:
+            return
+        model, _, _, conflict = TABLES[table]
+        if model is CustomFilter:
+            await repo.merge_filters(rows)
+        else:
+            await repo.bulk_upsert(model, rows, conflict)
+        uncommitted += len(rows)
+        if uncommitted >= transaction_rows:
+            await repo.commit()
+            uncommitted = 0
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = await asyncio.to_thread(f.readline)
+        try:
+            meta = json.loads(header)
+        except ValueError:
+            meta = None
+        if not isinstance(meta, dict) or meta.get("format") != FORMAT or meta.get("version") != VERSION:
+            raise InvalidExportFile("Not a GadoBot export file")
+
+        try:
+            while True:
+                lines = await asyncio.to_thread(_read_lines, f, batch)
+                if not lines:
+                    break
+                for line in lines:
+                    item = json.loads(line)
+                    table = item["t"]
+                    if table not in TABLES:
+                        continue
+                    _, _, columns, _ = TABLES[table]
+                    pending.setdefault(table, []).append({c: item["r"].get(c) for c in columns})
+                    if len(pending[table]) >= batch:
+                        await flush(table)
+                    total += 1
+                await report("import", total)
+            for table in list(pending):
+                await flush(table)
+            await repo.commit()
+        except Exception:
+            await repo.session.rollback()
+            raise
+        finally:
+            # Committed batches may already have changed filters and blacklists, in any worker's chats
+            repo.invalidate_all_caches()
+    await report("done", total, force=True)
+    return total
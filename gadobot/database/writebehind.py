@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger(__name__)
+
+class WriteBehind:
+    '''
+    Group-commit layer for Repository mutations.
+    Statements run at once on one shared writer session, each under its own savepoint,
+    so RETURNING values are available immediately and one failing statement doesn't
+    spoil the batch. The transaction is committed every `interval` seconds or once
+    `max_batch` statements are pending, turning many fsyncs into one.
+    '''
+    def __init__(self, sessionmaker: async_sessionmaker, interval: float = 0.05, max_batch: int = 256,
+                 on_rollback: Callable[[], None] = None):
+        self.sessionmaker = sessionmaker
+        # Called when a batch fails to commit: its writes were already acknowledged and cached
+        self.on_rollback = on_rollback
+        self.interval = interval
+        self.max_batch = max_batch
+        self.pending = 0
+        self._session: AsyncSession = None
+        self._lock = asyncio.Lock()
+        self._task: asyncio.Task = None
+        self._first_pending = 0.0
+
+        # Tuning stats
+        self.commits = 0
+        self.statements = 0
+        self.failed_commits = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self.delay_seconds_max = 0.0
+
+    def start(self):
+        self._session = self.sessionmaker()
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self.pending:
+                await self.flush()
+
+    async def execute(self, stmt):
+        '''Executes a statement inside the open batch transaction and returns its buffered Result.'''
+        async with self._lock:
+            async with self._session.begin_nested():
+                result = await self._session.execute(stmt)
+            if not self.pending:
+                self._first_pending = time.monotonic()
+            self.pending += 1
+            self.statements += 1
+            if self.pending >= self.max_batch:
+                await self._commit()
+        return result
+
+    async def read(self, stmt):
+        '''
+        Runs a query on the batch session, so it sees the batch's uncommitted writes.
+        Not a batch statement: no savepoint, not counted towards pending or the batch size.
+        The lock only serializes it with other statements on the shared session.
+        '''
+        async with self._lock:
+            return await self._session.execute(stmt)
+
+    async def flush(self):
+        async with self._lock:
+            if self.pending:
+                await self._commit()
+
+    async def _commit(self):
+        started = time.monotonic()
+        batch = self.pending
+        try:
+            await self._session.commit()
+            self.commits += 1
+        except Exception:
+            self.failed_commits += 1
+            logger.exception("Write-behind commit of %d statements failed", batch)
+            await self._session.rollback()
+            if self.on_rollback:
+                self.on_rollback()
+        finally:
+            self.pending = 0
+        elapsed = time.monotonic() - started
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+        self.delay_seconds_max = max(self.delay_seconds_max, started - self._first_pending)
+        logger.debug("Write-behind committed %d statements in %.1f ms", batch, elapsed * 1000)
+
+    async def close(self):
+        '''Stops the flush loop and drains pending writes.'''
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._session:
+            await self.flush()
+            await self._session.close()
+            self._session = None
+        logger.info("Write-behind drained: %s", self.stats())
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending,
+            "statements": self.statements,
+            "commits": self.commits,
+            "failed_commits": self.failed_commits,
+            "statements_per_commit": self.statements / self.commits if self.commits else 0.0,
+            "flush_ms_avg": self.flush_seconds_total / self.commits * 1000 if self.commits else 0.0,
+            "flush_ms_max": self.flush_seconds_max * 1000,
+            "delay_ms_max": self.delay_seconds_max * 1000,
+        }
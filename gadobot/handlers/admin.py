@@ -1,41 +1,22 @@
+import logging
 import time
 from aiogram import Router, types, Bot
-from aiogram.filters import Command
+from aiogram.filters import Command, ChatMemberUpdatedFilter, JOIN_TRANSITION
 from ..database.repo import Repository
 from ..resources.locales import lang
-from ..utils.helpers import parse_target_args
+from ..jobs import JobScheduler
+from ..config import Config
+from ..utils.helpers import parse_target_args, parse_duration, FULL_PERMISSIONS
+from ..utils.flood import FloodGuard
+from ..utils.admins import admin_cache, is_admin
 
 router = Router()
-
-def is_admin(func):
-    '''Decorator: Checks if user and bot have admin rights.'''
-    async def wrapper(message: types.Message, bot: Bot, repo: Repository, **kwargs):
-        # 1. User check
-        try:
-            member = await bot.get_chat_member(message.chat.id, message.from_user.id)
-        except:
-            return # Bot probably kicked
-            
-        if member.status not in ('administrator', 'creator'):
-            await message.reply(lang("user_no_perm"))
-            return
-        
-        # 2. Bot check
-        try:
-            bot_member = await bot.get_chat_member(message.chat.id, bot.id)
-            if not bot_member.can_restrict_members:
-                await message.reply(lang("bot_no_perm"))
-                return
-        except:
-            pass # Ignore if can't check
-            
-        return await func(message, bot, repo, **kwargs)
-    return wrapper
+logger = logging.getLogger(__name__)
 
 @router.message(Command("ban"))
 @is_admin
-async def cmd_ban(message: types.Message, bot: Bot, repo: Repository):
-    user_id, reason, duration = await parse_target_args(message)
+async def cmd_ban(message: types.Message, bot: Bot, repo: Repository, jobs: JobScheduler):
+    user_id, reason, duration = await parse_target_args(message, repo)
     if not user_id:
         return await message.reply(lang("invalid_user"))
     if user_id == bot.id:
@@ -45,6 +26,10 @@ async def cmd_ban(message: types.Message, bot: Bot, repo: Repository):
     
     try:
         await bot.ban_chat_member(message.chat.id, user_id, until_date=until)
+        await repo.cancel_jobs("unban", message.chat.id, user_id)
+        if duration:
+            # Telegram lifts the ban itself, the job announces it
+            await jobs.schedule(repo, "unban", duration, message.chat.id, user_id)
         timer_str = f"-time {duration}s" if duration else ""
         reason_str = f"-reason {reason}" if reason else ""
         await message.reply(lang("banned", user_id=user_id, timer=timer_str, reason=reason_str))
@@ -53,8 +38,8 @@ async def cmd_ban(message: types.Message, bot: Bot, repo: Repository):
 
 @router.message(Command("mute"))
 @is_admin
-async def cmd_mute(message: types.Message, bot: Bot, repo: Repository):
-    user_id, reason, duration = await parse_target_args(message)
+async def cmd_mute(message: types.Message, bot: Bot, repo: Repository, jobs: JobScheduler):
+    user_id, reason, duration = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     if user_id == bot.id: return await message.reply(lang("self_action_error"))
     
@@ -63,6 +48,9 @@ async def cmd_mute(message: types.Message, bot: Bot, repo: Repository):
     
     try:
         await bot.restrict_chat_member(message.chat.id, user_id, permissions=perms, until_date=until)
+        await repo.cancel_jobs("unmute", message.chat.id, user_id)
+        if duration:
+            await jobs.schedule(repo, "unmute", duration, message.chat.id, user_id)
         timer_str = f"-time {duration}s" if duration else ""
         reason_str = f"-reason {reason}" if reason else ""
         await message.reply(lang("muted", user_id=user_id, timer=timer_str, reason=reason_str))
@@ -72,51 +60,54 @@ async def cmd_mute(message: types.Message, bot: Bot, repo: Repository):
 @router.message(Command("unban"))
 @is_admin
 async def cmd_unban(message: types.Message, bot: Bot, repo: Repository):
-    user_id, _, _ = await parse_target_args(message)
+    user_id, _, _ = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     
     try:
         await bot.unban_chat_member(message.chat.id, user_id)
+        await repo.cancel_jobs("unban", message.chat.id, user_id)
         await message.reply(lang("unbanned", user_id=user_id))
     except Exception:
         await message.reply(lang("action_failed"))
 
 @router.message(Command("unmute"))
 @is_admin
-async def cmd_unmute(message: types.Message, bot: Bot, repo: Repository):
-    user_id, _, _ = await parse_target_args(message)
+async def cmd_unmute(message: types.Message, bot: Bot, repo: Repository, flood: FloodGuard):
+    user_id, _, _ = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     
-    perms = types.ChatPermissions(
-        can_send_messages=True, can_send_media_messages=True,
-        can_send_polls=True, can_send_other_messages=True
-    )
     try:
-        await bot.restrict_chat_member(message.chat.id, user_id, permissions=perms)
+        await bot.restrict_chat_member(message.chat.id, user_id, permissions=FULL_PERMISSIONS)
+        await repo.cancel_jobs("unmute", message.chat.id, user_id)
+        flood.unmute(message.chat.id, user_id)
         await message.reply(lang("unmuted", user_id=user_id))
     except Exception:
         await message.reply(lang("action_failed"))
 
 @router.message(Command("warn"))
 @is_admin
-async def cmd_warn(message: types.Message, bot: Bot, repo: Repository):
-    user_id, reason, _ = await parse_target_args(message)
+async def cmd_warn(message: types.Message, bot: Bot, repo: Repository, jobs: JobScheduler):
+    user_id, reason, _ = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     
-    count = await repo.add_warn(message.chat.id, user_id)
-    limit = await repo.get_warn_limit(message.chat.id)
+    # Increment, limit lookup and reset happen in one statement
+    count, limit, should_ban = await repo.warn(message.chat.id, user_id)
+    if should_ban:
+        # The counter was reset, decays of the old warns have nothing left to remove
+        await repo.cancel_jobs("unwarn", message.chat.id, user_id)
+    elif Config.WARN_DECAY_DAYS:
+        await jobs.schedule(repo, "unwarn", Config.WARN_DECAY_DAYS * 86400, message.chat.id, user_id)
     
     await message.reply(lang("warned", user_id=user_id, reason=reason or "", count=count, limit=limit))
     
-    if count >= limit:
+    if should_ban:
         await bot.ban_chat_member(message.chat.id, user_id)
         await message.reply(lang("banned", user_id=user_id, timer="", reason="Max warns reached"))
-        await repo.reset_warns(message.chat.id, user_id)
 
 @router.message(Command("unwarn"))
 @is_admin
 async def cmd_unwarn(message: types.Message, repo: Repository, bot: Bot):
-    user_id, _, _ = await parse_target_args(message)
+    user_id, _, _ = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     
     await repo.remove_warn(message.chat.id, user_id)
@@ -138,23 +129,98 @@ async def cmd_limitwarn(message: types.Message, repo: Repository, bot: Bot):
     except ValueError:
         await message.reply(lang("warn_limit_invalid"))
 
+@router.message(Command("flood"))
+@is_admin
+async def cmd_flood(message: types.Message, bot: Bot, repo: Repository, flood: FloodGuard):
+    # /flood [off | <messages> [seconds] [mute duration]]
+    args = message.text.split()[1:]
+    if not args:
+        limit, window, mute = await repo.get_flood_settings(message.chat.id)
+        if not limit:
+            return await message.reply(lang("flood_off"))
+        return await message.reply(lang("flood_curr", limit=limit, window=window, mute=mute))
+
+    _, window, mute = await repo.get_flood_settings(message.chat.id)
+    if args[0] == "off":
+        limit = 0
+    else:
+        try:
+            limit = int(args[0])
+            if len(args) > 1:
+                window = int(args[1])
+            if len(args) > 2:
+                mute = parse_duration(args[2])
+            if limit < 2 or window < 1 or not mute:
+                raise ValueError
+        except ValueError:
+            return await message.reply(lang("flood_invalid"))
+
+    await repo.set_flood_settings(message.chat.id, limit, window, mute)
+    flood.reset(message.chat.id)
+    if not limit:
+        return await message.reply(lang("flood_off"))
+    await message.reply(lang("flood_curr", limit=limit, window=window, mute=mute))
+
 @router.message(Command("history"))
 @is_admin
 async def cmd_history(message: types.Message, repo: Repository, bot: Bot):
-    user_id, _, _ = await parse_target_args(message)
+    user_id, _, _ = await parse_target_args(message, repo)
     if not user_id: return await message.reply(lang("invalid_user"))
     
     warns = await repo.get_warns(message.chat.id, user_id)
     limit = await repo.get_warn_limit(message.chat.id)
-    bl_list = await repo.get_blacklist(message.chat.id)
-    is_bl = "Yes" if user_id in bl_list else "No"
+    is_bl = "Yes" if await repo.is_blacklisted(message.chat.id, user_id) else "No"
     
     await message.reply(lang("history", user_id=user_id, warns=warns, limit=limit, bl=is_bl))
 
+@router.message(Command("blacklist"))
+@is_admin
+async def cmd_blacklist(message: types.Message, bot: Bot, repo: Repository):
+    user_id, _, _ = await parse_target_args(message, repo)
+    if not user_id:
+        entries = await repo.get_blacklist(message.chat.id)
+        if not entries:
+            return await message.reply(lang("blacklist_empty"))
+        return await message.reply(lang("blacklist_list", entries=", ".join(map(str, entries))))
+    if user_id == bot.id: return await message.reply(lang("self_action_error"))
+
+    await repo.add_blacklist(message.chat.id, user_id)
+    try:
+        await bot.ban_chat_member(message.chat.id, user_id)
+    except Exception:
+        pass # Not in the chat right now, the join check will catch them
+    await message.reply(lang("blacklist_added", user_id=user_id))
+
+@router.message(Command("unblacklist"))
+@is_admin
+async def cmd_unblacklist(message: types.Message, bot: Bot, repo: Repository):
+    user_id, _, _ = await parse_target_args(message, repo)
+    if not user_id: return await message.reply(lang("invalid_user"))
+
+    if await repo.remove_blacklist(message.chat.id, user_id):
+        await message.reply(lang("blacklist_removed", user_id=user_id))
+    else:
+        await message.reply(lang("blacklist_not_found"))
+
+@router.chat_member(ChatMemberUpdatedFilter(JOIN_TRANSITION))
+async def on_member_join(event: types.ChatMemberUpdated, bot: Bot, repo: Repository):
+    # Runs for every join, so the check is an in-memory set lookup once the chat is loaded
+    user_id = event.new_chat_member.user.id
+    if not await repo.is_blacklisted(event.chat.id, user_id):
+        return
+    try:
+        await bot.ban_chat_member(event.chat.id, user_id)
+        logger.info("Banned blacklisted user %s on join to %s", user_id, event.chat.id)
+    except Exception:
+        logger.warning("Failed to ban blacklisted user %s in %s", user_id, event.chat.id)
+
 @router.message(Command("kickme"))
 async def cmd_kickme(message: types.Message, bot: Bot):
-    member = await bot.get_chat_member(message.chat.id, message.from_user.id)
-    if member.status in ('administrator', 'creator'):
+    try:
+        member = await admin_cache.get_member(bot, message.chat.id, message.from_user.id)
+    except Exception:
+        return await message.reply(lang("action_failed"))
+    if member:
         return await message.reply(lang("kickme_admin"))
         
     try:
@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import time
+from aiogram import Router, types, Bot
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.filters import Command
+from ..config import Config
+from ..database.repo import Repository
+from ..resources.locales import lang
+from ..utils.admins import is_admin
+from ..utils.helpers import parse_target_list
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+# Failed chats listed in the /fban summary
+MAX_REPORTED_FAILURES = 10
+
+# Running /fban fan-outs; holds the references so the tasks aren't garbage collected
+_fban_tasks: set[asyncio.Task] = set()
+
+@router.message(Command("newfed"))
+async def cmd_newfed(message: types.Message, repo: Repository):
+    args = message.text.split(" ", 1)
+    if len(args) < 2 or not args[1].strip():
+        return
+    name = args[1].strip()
+    fed_id = await repo.create_federation(name, message.from_user.id)
+    await message.reply(lang("fed_created", name=name, fed_id=fed_id))
+
+@router.message(Command("joinfed"))
+@is_admin
+async def cmd_joinfed(message: types.Message, bot: Bot, repo: Repository):
+    args = message.text.split()
+    if len(args) < 2 or not args[1].isdigit():
+        return await message.reply(lang("fed_not_found"))
+    fed = await repo.get_federation(int(args[1]))
+    if not fed:
+        return await message.reply(lang("fed_not_found"))
+    await repo.join_federation(message.chat.id, fed.id)
+    await message.reply(lang("fed_joined", name=fed.name))
+
+@router.message(Command("leavefed"))
+@is_admin
+async def cmd_leavefed(message: types.Message, bot: Bot, repo: Repository):
+    if await repo.leave_federation(message.chat.id):
+        await message.reply(lang("fed_left"))
+    else:
+        await message.reply(lang("fed_none"))
+
+@router.message(Command("fedinfo"))
+async def cmd_fedinfo(message: types.Message, repo: Repository):
+    fed = await repo.get_chat_federation(message.chat.id)
+    if not fed:
+        return await message.reply(lang("fed_none"))
+    chats = await repo.get_federation_chats(fed.id)
+    await message.reply(lang("fed_info", name=fed.name, fed_id=fed.id, owner_id=fed.owner_id, chats=len(chats)))
+
+class BanFanOut:
+    '''
+    Bans every user in every chat, at most `concurrency` calls in flight.
+    The outbound scheduler paces the calls to Telegram's limits; a 429 that still gets
+    through (scheduler off) is waited out once. A chat where the bot was removed or
+    lost its rights is skipped for the remaining users instead of failing call by call.
+    '''
+    def __init__(self, bot: Bot, chat_ids: list[int], user_ids: list[int], concurrency: int):
+        self.bot = bot
+        self.chat_ids = chat_ids
+        self.user_ids = user_ids
+        self.slots = asyncio.Semaphore(concurrency)
+        self.total = len(chat_ids) * len(user_ids)
+        self.done = 0
+        self.banned = 0
+        # chat_id -> error of its first failure
+        self.failed_chats: dict[int, str] = {}
+        self.failed = 0
+        self._dead_chats: set[int] = set()
+
+    async def _ban(self, chat_id: int, user_id: int):
+        async with self.slots:
+            if chat_id in self._dead_chats:
+                self.failed += 1
+                self.done += 1
+                return
+            try:
+                try:
+                    await self.bot.ban_chat_member(chat_id, user_id)
+                except TelegramRetryAfter as e:
+                    await asyncio.sleep(e.retry_after)
+                    await self.bot.ban_chat_member(chat_id, user_id)
+                self.banned += 1
+            except TelegramAPIError as e:
+                self.failed += 1
+                self.failed_chats.setdefault(chat_id, e.message)
+                if isinstance(e, TelegramForbiddenError) or "not enough rights" in e.message:
+                    self._dead_chats.add(chat_id)
+            finally:
+                self.done += 1
+
+    async def run(self, progress=None, interval: float = 3.0):
+        '''Runs all bans; progress(fan_out) is awaited every `interval` seconds meanwhile.'''
+        # Chat by chat, so a dead chat is found on its first call
+        tasks = [asyncio.create_task(self._ban(c, u)) for c in self.chat_ids for u in self.user_ids]
+        pending = set(tasks)
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=interval)
+            if pending and progress:
+                await progress(self)
+
+@router.message(Command("fban"))
+async def cmd_fban(message: types.Message, bot: Bot, repo: Repository):
+    fed = await repo.get_chat_federation(message.chat.id)
+    if not fed:
+        return await message.reply(lang("fed_none"))
+    if message.from_user.id != fed.owner_id and message.from_user.id not in Config.ADMINS:
+        return await message.reply(lang("fed_owner_only"))
+
+    user_ids, reason = await parse_target_list(message, repo)
+    user_ids = [u for u in user_ids if u != bot.id]
+    if not user_ids:
+        return await message.reply(lang("fban_usage"))
+
+    chat_ids = await repo.get_federation_chats(fed.id)
+    # Blacklisted first: chats where the ban call fails still catch them on join
+    await repo.add_blacklist_many([(c, u) for c in chat_ids for u in user_ids])
+
+    status = await message.reply(lang("fban_started", users=len(user_ids), chats=len(chat_ids)))
+    # Detached: the calls take minutes in a big federation, and the chat's update slot
+    # and database session must not be held meanwhile
+    fan_out = BanFanOut(bot, chat_ids, user_ids, Config.FED_BAN_CONCURRENCY)
+    task = asyncio.create_task(run_fban(fan_out, status, fed.id, reason))
+    _fban_tasks.add(task)
+    task.add_done_callback(_fban_tasks.discard)
+
+async def run_fban(fan_out: BanFanOut, status: types.Message, fed_id: int, reason: str = None):
+    '''Runs the fan-out, editing the status message with progress and then the summary.'''
+    async def report(fan_out: BanFanOut):
+        try:
+            await status.edit_text(lang("fban_progress", done=fan_out.done, total=fan_out.total, failed=fan_out.failed))
+        except Exception:
+            pass # Progress is best effort
+
+    started = time.monotonic()
+    try:
+        await fan_out.run(report, Config.FED_PROGRESS_INTERVAL)
+    except Exception:
+        logger.exception("fban in federation %s failed", fed_id)
+    logger.info("fban in federation %s: %d users, %d chats, %d failed, %.1fs",
+                fed_id, len(fan_out.user_ids), len(fan_out.chat_ids), fan_out.failed, time.monotonic() - started)
+
+    reason_str = f"-reason {reason}" if reason else ""
+    lines = [lang("fban_done", users=len(fan_out.user_ids), chats=len(fan_out.chat_ids), banned=fan_out.banned,
+                  failed=fan_out.failed, reason=reason_str)]
+    if fan_out.failed_chats:
+        lines.append(lang("fban_failures"))
+        for chat_id, error in list(fan_out.failed_chats.items())[:MAX_REPORTED_FAILURES]:
+            lines.append(f"• {chat_id}: {error}")
+        if len(fan_out.failed_chats) > MAX_REPORTED_FAILURES:
+            lines.append(f"… +{len(fan_out.failed_chats) - MAX_REPORTED_FAILURES}")
+    text = "\n".join(lines)
+    try:
+        await status.edit_text(text)
+    except Exception:
+        try:
+            await status.answer(text)
+        except Exception:
+            logger.warning("Could not report the fban summary in chat %s", status.chat.id)
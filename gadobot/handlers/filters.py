@@ -1,22 +1,58 @@
-from aiogram import Router, F, types
+from html import escape
+from aiogram import Bot, Router, F, types
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from ..config import Config
 from ..database.repo import Repository
+from ..jobs import JobScheduler
 from ..resources.locales import lang
+from ..utils.admins import admin_cache
+from ..utils.matcher import validate_regex, RegexRejected
+from ..utils.outbound import send_priority, LOW, OutboundDropped
+from ..utils.helpers import parse_duration
 
 router = Router()
 
 @router.message(Command("filter"))
-async def add_filter(message: types.Message, repo: Repository):
+async def add_filter(message: types.Message, bot: Bot, repo: Repository, jobs: JobScheduler):
     raw_text = message.text or message.caption
     if not raw_text:
         return
 
+    # /filter [-contains|-regex] [-30m|-2h|-7d] <trigger> [response]
     args = raw_text.split(" ", 2)
     if len(args) < 2:
         return
+
+    mode = "exact"
+    expire = None
+    while len(args) > 2 and args[1].startswith("-"):
+        if args[1] in ("-contains", "-regex"):
+            mode = args[1][1:]
+        elif parse_duration(args[1][1:]):
+            expire = parse_duration(args[1][1:])
+        else:
+            break
+        args = [args[0]] + args[2].split(" ", 1)
         
     trigger = args[1]
     response = args[2] if len(args) > 2 else ""
+
+    if mode == "regex":
+        # Even time-bounded, a regex costs every message of the chat: admins only
+        if message.chat.type != "private":
+            try:
+                admins = await admin_cache.get_admins(bot, message.chat.id)
+            except Exception:
+                return await message.reply(lang("action_failed"))
+            if not message.from_user or message.from_user.id not in admins:
+                return await message.reply(lang("user_no_perm"))
+        try:
+            validate_regex(trigger)
+        except RegexRejected:
+            return await message.reply(lang("filter_invalid_regex"))
     
     file_id = None
     file_type = None
@@ -34,7 +70,11 @@ async def add_filter(message: types.Message, repo: Repository):
         file_id = target.animation.file_id
         file_type = "animation"
             
-    await repo.add_filter(message.chat.id, trigger, response, file_id, file_type)
+    await repo.add_filter(message.chat.id, trigger, response, file_id, file_type, mode)
+    # A leftover expiry of an earlier filter with this trigger must not remove the new one
+    await repo.cancel_jobs("filter_expire", message.chat.id, payload=trigger)
+    if expire:
+        await jobs.schedule(repo, "filter_expire", expire, message.chat.id, payload=trigger)
     await message.reply(lang("filter_added", trigger=trigger))
 
 @router.message(Command("stop"))
@@ -45,28 +85,58 @@ async def remove_filter(message: types.Message, repo: Repository):
     trigger = args[1]
     res = await repo.remove_filter(message.chat.id, trigger)
     if res:
+        await repo.cancel_jobs("filter_expire", message.chat.id, payload=trigger)
         await message.reply(lang("filter_removed"))
 
+class FilterPage(CallbackData, prefix="filters"):
+    # Keyset position: the page after `after`, or the one before `before` (filter row ids)
+    after: int = 0
+    before: int = 0
+
+async def render_filter_page(repo: Repository, chat_id: int, after: int = 0, before: int = 0):
+    rows, has_more = await repo.get_filter_page(chat_id, after, before, Config.FILTERS_PAGE_SIZE)
+    if not rows and (after or before):
+        # Filters were removed since the page was sent, start over
+        return await render_filter_page(repo, chat_id)
+    if not rows:
+        return lang("filters_none"), None
+
+    text = "\n".join([lang("filters_title"), ""] + [f"• <code>{escape(trigger)}</code>" for _, trigger in rows])
+    has_prev = has_more if before else bool(after)
+    has_next = True if before else has_more
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton(text="◀️", callback_data=FilterPage(before=rows[0].id).pack()))
+    if has_next:
+        buttons.append(InlineKeyboardButton(text="▶️", callback_data=FilterPage(after=rows[-1].id).pack()))
+    markup = InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+    return text, markup
+
 @router.message(Command("filters"))
 async def cmd_list_filters(message: types.Message, repo: Repository):
-    filters = await repo.get_filters(message.chat.id)
-    
-    if not filters:
-        await message.reply("No filters active in this chat.")
-        return
+    text, markup = await render_filter_page(repo, message.chat.id)
+    await message.reply(text, parse_mode="HTML", reply_markup=markup)
 
-    # Create a list of triggers
-    text = "📂 **Active Filters:**\n\n"
-    for f in filters:
-        text += f"• <code>{f.trigger}</code>\n"
-        
-    await message.reply(text, parse_mode="HTML")
+@router.callback_query(FilterPage.filter())
+async def filters_page(callback: types.CallbackQuery, callback_data: FilterPage, repo: Repository):
+    if not callback.message:
+        return await callback.answer()
+    text, markup = await render_filter_page(repo, callback.message.chat.id, callback_data.after, callback_data.before)
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=markup)
+    except TelegramBadRequest:
+        # Double click: the page is already shown
+        pass
+    await callback.answer()
 
 @router.message(F.text)
 async def check_filters(message: types.Message, repo: Repository):
-    filters = await repo.get_filters(message.chat.id)
-    for f in filters:
-        if f.trigger.lower() == message.text.lower(): # Bonus: case-insensitive check
+    f = await repo.match_filter(message.chat.id, message.text) # Bonus: case-insensitive check
+    if not f:
+        return
+    # Filter replies yield to moderation and command replies, and may be dropped under flood
+    with send_priority(LOW):
+        try:
             if f.file_id:
                 if f.file_type == "photo":
                     await message.reply_photo(f.file_id, caption=f.response)
@@ -76,4 +146,5 @@ async def check_filters(message: types.Message, repo: Repository):
                     await message.reply_animation(f.file_id, caption=f.response)
             else:
                 await message.reply(f.response)
-            return
\ No newline at end of file
+        except OutboundDropped:
+            pass
\ No newline at end of file
@@ -0,0 +1,32 @@
+from aiogram import Router, types, Bot
+from aiogram.filters import Command
+from ..database.repo import Repository
+from ..resources.locales import lang, use_locale, available_locales, locale_var
+from ..utils.admins import admin_cache
+
+router = Router()
+
+@router.message(Command("lang"))
+async def cmd_lang(message: types.Message, bot: Bot, repo: Repository):
+    # /lang [code] - private chats set the user's language, groups the chat's (admins only)
+    args = message.text.split()
+    available = available_locales()
+    if len(args) < 2:
+        return await message.reply(lang("lang_curr", code=locale_var.get(), available=", ".join(available)))
+
+    code = args[1].lower()
+    if code not in available:
+        return await message.reply(lang("lang_unknown", available=", ".join(available)))
+
+    if message.chat.type != "private":
+        try:
+            admins = await admin_cache.get_admins(bot, message.chat.id)
+        except Exception:
+            return await message.reply(lang("action_failed"))
+        if message.from_user.id not in admins:
+            return await message.reply(lang("user_no_perm"))
+
+    # Also updates the cached language, later replies need no lookup
+    await repo.set_language(message.chat.id, code)
+    with use_locale(code):
+        await message.reply(lang("lang_set"))
@@ -0,0 +1,75 @@
+import functools
+import logging
+import os
+import tempfile
+import time
+from aiogram import Router, types, Bot
+from aiogram.filters import Command
+from ..config import Config
+from ..database.repo import Repository
+from ..database.transfer import export_ndjson, import_ndjson
+from ..resources.locales import lang
+from ..utils.flood import FloodGuard
+
+router = Router()
+logger = logging.getLogger(__name__)
+
+def is_owner(func):
+    '''Decorator: whole-database commands are limited to the ADMINS from .env.'''
+    @functools.wraps(func)
+    async def wrapper(message: types.Message, bot: Bot, repo: Repository, **kwargs):
+        if message.from_user.id not in Config.ADMINS:
+            await message.reply(lang("owner_only"))
+            return
+        return await func(message, bot=bot, repo=repo, **kwargs)
+    return wrapper
+
+def progress_reporter(status: types.Message, key: str):
+    async def report(table: str, rows: int):
+        try:
+            await status.edit_text(lang(key, table=table, rows=rows))
+        except Exception:
+            pass # Unchanged text or rate limited, progress is best effort
+    return report
+
+@router.message(Command("export"))
+@is_owner
+async def cmd_export(message: types.Message, bot: Bot, repo: Repository):
+    status = await message.reply(lang("export_started"))
+    fd, path = tempfile.mkstemp(prefix="gadobot-export-", suffix=".ndjson.gz")
+    os.close(fd)
+    try:
+        started = time.monotonic()
+        rows = await export_ndjson(repo, path, progress_reporter(status, "export_progress"))
+        await message.reply_document(
+            types.FSInputFile(path, filename=f"gadobot-export-{int(time.time())}.ndjson.gz"),
+            caption=lang("export_done", rows=rows, seconds=round(time.monotonic() - started, 1)),
+        )
+    except Exception:
+        logger.exception("Export failed")
+        await message.reply(lang("action_failed"))
+    finally:
+        os.remove(path)
+
+@router.message(Command("import"))
+@is_owner
+async def cmd_import(message: types.Message, bot: Bot, repo: Repository, flood: FloodGuard):
+    source = message if message.document else message.reply_to_message
+    if not source or not source.document:
+        return await message.reply(lang("import_no_file"))
+
+    status = await message.reply(lang("import_started"))
+    fd, path = tempfile.mkstemp(prefix="gadobot-import-", suffix=".ndjson.gz")
+    os.close(fd)
+    try:
+        started = time.monotonic()
+        await bot.download(source.document, destination=path)
+        rows = await import_ndjson(repo, path, progress_reporter(status, "import_progress"))
+        await message.reply(lang("import_done", rows=rows, seconds=round(time.monotonic() - started, 1)))
+    except Exception:
+        logger.exception("Import failed")
+        await message.reply(lang("import_failed"))
+    finally:
+        # Imported chat_settings may carry new flood thresholds; other workers reset on the broadcast
+        flood.clear()
+        os.remove(path)
@@ -0,0 +1,180 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Optional
+from aiogram import Bot
+
+from .database.engine import Database
+from .database.repo import Repository, language_cache
+from .resources.locales import lang, use_locale
+from .utils.helpers import FULL_PERMISSIONS
+
+logger = logging.getLogger(__name__)
+
+# A failed job is retried after RETRY_DELAY * attempts seconds, and dropped after MAX_ATTEMPTS
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 5
+
+class JobScheduler:
+    '''
+    Persistent timers for delayed moderation actions.
+
+    Jobs live in the scheduled_jobs table. Only the ones due within `horizon` seconds are
+    held in memory, as (run_at, id) pairs in one heap driven by one task, and the window
+    is topped up from the run_at index as time passes. Memory therefore depends on how
+    many jobs fall into the window, not on how many are pending overall, and pending jobs
+    survive restarts. Delivery is at-least-once: a row is deleted after its action ran,
+    failed actions are retried with a growing delay up to MAX_ATTEMPTS times.
+    In sharded mode each worker only runs the jobs of its own chats.
+    '''
+    def __init__(self, db: Database, bot: Bot, shard: int = 0, shards: int = 1,
+                 horizon: int = 3600, batch: int = 500):
+        self.db = db
+        self.bot = bot
+        self.shard = shard
+        self.shards = shards
+        self.horizon = horizon
+        self.batch = batch
+        self._heap: list[tuple[int, int]] = []
+        self._loaded_until: Optional[int] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # job id -> failed attempts so far
+        self._attempts: dict[int, int] = {}
+
+        self.executed = 0
+        self.failed = 0
+        self.dropped = 0
+
+        self.handlers = {
+            "unwarn": self._unwarn,
+            "unban": self._unban,
+            "unmute": self._unmute,
+            "filter_expire": self._filter_expire,
+        }
+
+    async def start(self):
+        await self._refill()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # A flag rather than cancel(): wait_for() may swallow a cancellation that races a wakeup
+        self._stopping = True
+        self._wakeup.set()
+        if self._task:
+            await self._task
+            self._task = None
+
+    async def schedule(self, repo: Repository, kind: str, delay: int, chat_id: int,
+                       user_id: int = None, payload: str = None) -> int:
+        run_at = int(time.time()) + delay
+        job_id = await repo.add_job(run_at, kind, chat_id, user_id, payload)
+        # Jobs beyond the window are picked up by a later refill
+        if self._loaded_until is not None and run_at < self._loaded_until:
+            heapq.heappush(self._heap, (run_at, job_id))
+            self._wakeup.set()
+        return job_id
+
+    async def _refill(self):
+        start, end = self._loaded_until, int(time.time()) + self.horizon
+        # Moved before the query: schedule() pushes what it adds meanwhile instead of leaving it to no refill
+        self._loaded_until = end
+        try:
+            async with self.db.repository() as repo:
+                due = await repo.get_job_times(start, end, self.shard, self.shards)
+        except Exception:
+            self._loaded_until = start
+            raise
+        # The query may also see jobs schedule() pushed while it ran
+        queued = {job_id for _, job_id in self._heap}
+        for item in due:
+            if item[1] not in queued:
+                heapq.heappush(self._heap, item)
+
+    async def _run(self):
+        while not self._stopping:
+            now = time.time()
+            if now >= self._loaded_until - self.horizon / 2:
+                try:
+                    await self._refill()
+                except Exception:
+                    logger.exception("Loading scheduled jobs failed")
+
+            if self._heap and self._heap[0][0] <= now:
+                ids = []
+                while self._heap and self._heap[0][0] <= now and len(ids) < self.batch:
+                    ids.append(heapq.heappop(self._heap)[1])
+                await self._execute(ids)
+                continue
+
+            next_refill = self._loaded_until - self.horizon / 2
+            wait = min(self._heap[0][0] if self._heap else next_refill, next_refill) - now
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(wait, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _execute(self, ids: list[int]):
+        retry = []
+        try:
+            async with self.db.repository() as repo:
+                jobs = await repo.get_jobs(ids)
+                # Cancelled jobs are simply gone from the table
+                done = set(ids) - {job.id for job in jobs}
+                for job in jobs:
+                    try:
+                        code = language_cache.get(job.chat_id) or await repo.load_language(job.chat_id)
+                        with use_locale(code):
+                            await self.handlers[job.kind](repo, job)
+                        self.executed += 1
+                        done.add(job.id)
+                    except Exception:
+                        self.failed += 1
+                        logger.exception("Scheduled %s for chat %s failed", job.kind, job.chat_id)
+                        if self._attempts.get(job.id, 0) + 1 >= MAX_ATTEMPTS:
+                            logger.error("Dropping scheduled %s %d after %d attempts", job.kind, job.id, MAX_ATTEMPTS)
+                            self.dropped += 1
+                            done.add(job.id)
+                        else:
+                            retry.append(job.id)
+                if done:
+                    await repo.delete_jobs(list(done))
+        except Exception:
+            # At-least-once: jobs that already ran may run again
+            logger.exception("Running scheduled jobs failed, retrying")
+            retry = ids
+            done = set()
+
+        for job_id in done:
+            self._attempts.pop(job_id, None)
+        now = int(time.time())
+        for job_id in retry:
+            attempts = self._attempts[job_id] = self._attempts.get(job_id, 0) + 1
+            # The row's run_at is already past, so no refill loads it twice; after a restart it's due at once
+            heapq.heappush(self._heap, (now + RETRY_DELAY * attempts, job_id))
+
+    async def _unwarn(self, repo: Repository, job):
+        await repo.remove_warn(job.chat_id, job.user_id)
+
+    async def _unban(self, repo: Repository, job):
+        await self.bot.unban_chat_member(job.chat_id, job.user_id, only_if_banned=True)
+        await self.bot.send_message(job.chat_id, lang("unbanned", user_id=job.user_id))
+
+    async def _unmute(self, repo: Repository, job):
+        await self.bot.restrict_chat_member(job.chat_id, job.user_id, permissions=FULL_PERMISSIONS)
+        await self.bot.send_message(job.chat_id, lang("unmuted", user_id=job.user_id))
+
+    async def _filter_expire(self, repo: Repository, job):
+        await repo.remove_filter(job.chat_id, job.payload)
+
+    def stats(self) -> dict:
+        return {
+            "in_memory": len(self._heap),
+            "executed": self.executed,
+            "failed": self.failed,
+            "retrying": len(self._attempts),
+            "dropped": self.dropped,
+        }
@@ -1,48 +1,79 @@
-# Centralized translation strings
-TR = {
-    "eng": {
-        "bot_started": "Bot started",
-        "bot_no_perm": "I don't have permission to restrict members.",
-        "user_no_perm": "You don't have permission to use this.",
-        "invalid_user": "User not found or invalid.",
-        "mention_error": "I cannot resolve mentions. Please reply to the user or use their ID.",
-        "self_action_error": "I cannot perform this action on myself.",
-        "action_failed": "Failed to perform action.",
-        
-        "banned": "<a href='tg://user?id={user_id}'>User</a> banned. {timer} {reason}",
-        "muted": "<a href='tg://user?id={user_id}'>User</a> muted. {timer} {reason}",
-        "kicked": "<a href='tg://user?id={user_id}'>User</a> kicked. {reason}",
-        "warned": "<a href='tg://user?id={user_id}'>User</a> warned. {reason} ({count}/{limit})",
-        "unwarned": "<a href='tg://user?id={user_id}'>User</a> unwarned.",
-        "unbanned": "User {user_id} unbanned.",
-        "unmuted": "User {user_id} unmuted.",
-        
-        "warn_limit_curr": "Current warn limit: {limit}",
-        "warn_limit_set": "Warn limit set to {limit}",
-        "warn_limit_invalid": "Invalid limit number.",
-        
-        "blacklist_added": "User {user_id} added to blacklist.",
-        "blacklist_removed": "User {user_id} removed from blacklist.",
-        "blacklist_not_found": "User is not in blacklist.",
-        "blacklist_empty": "Blacklist is empty.",
-        "blacklist_list": "Blacklist: \
-{entries}",
-        
-        "history": "History for {user_id}: \
-Warns: {warns}/{limit} \
-Blacklisted: {bl}",
-        "kickme_admin": "Sorry, you must work.",
-        "kickme_self": "User {user_id} kicked themselves.",
-        
-        "filter_added": "Filter added: {trigger}",
-        "filter_removed": "Filter removed.",
-        "filters_cleared": "All filters cleared."
-    }
-}
-
-def lang(key: str, **kwargs) -> str:
-    # Defaults to English for now
-    text = TR["eng"].get(key, f"MISSING:{key}")
-    if kwargs:
-        return text.format(**kwargs)
-    return text
\ No newline at end of file
+# Translation strings live in lang/<code>.json, one catalog per language
+import json
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+from contextvars import ContextVar
+from string import Formatter
+from typing import Callable
+
+DEFAULT_LOCALE = "eng"
+LANG_DIR = os.path.join(os.path.dirname(__file__), "lang")
+
+# Language of the update being handled, set by the locale middleware in bot.py
+locale_var: ContextVar[str] = ContextVar("locale", default=DEFAULT_LOCALE)
+
+_catalogs: dict[str, dict[str, Callable[..., str]]] = {}
+
+@lru_cache(maxsize=None)
+def available_locales() -> tuple[str, ...]:
+    '''Codes of all catalogs on disk, without loading any of them. Listed once per process.'''
+    return tuple(sorted(name[:-5] for name in os.listdir(LANG_DIR) if name.endswith(".json")))
+
+def compile_template(text: str) -> Callable[..., str]:
+    '''
+    Splits "User {user_id} unbanned." into literal and field parts once at load time,
+    so a call only joins them instead of parsing the template on every str.format call.
+    Templates with format specs, conversions or attribute access fall back to format_map.
+    '''
+    # (is_field, literal text or field name)
+    parts = []
+    for literal, field, spec, conversion in Formatter().parse(text):
+        if literal:
+            parts.append((False, literal))
+        if field is None:
+            continue
+        if spec or conversion or not field.isidentifier():
+            return lambda **kwargs: text.format_map(kwargs)
+        parts.append((True, field))
+    if not any(is_field for is_field, _ in parts):
+        # Formatter() already turned "{{" into "{"
+        constant = "".join(value for _, value in parts)
+        return lambda **kwargs: constant
+    parts = tuple(parts)
+    return lambda **kwargs: "".join(format(kwargs[value]) if is_field else value for is_field, value in parts)
+
+def load_catalog(code: str) -> dict[str, Callable[..., str]]:
+    '''Loads and compiles a catalog on first use; unused languages cost nothing.'''
+    catalog = _catalogs.get(code)
+    if catalog is None:
+        path = os.path.join(LANG_DIR, f"{code}.json")
+        if code not in available_locales():
+            raise KeyError(code)
+        with open(path, encoding="utf-8") as f:
+            catalog = {key: compile_template(text) for key, text in json.load(f).items()}
+        _catalogs[code] = catalog
+    return catalog
+
+@contextmanager
+def use_locale(code: str):
+    token = locale_var.set(code or DEFAULT_LOCALE)
+    try:
+        yield
+    finally:
+        locale_var.reset(token)
+
+def translate(code: str, key: str, /, **kwargs) -> str:
+    try:
+        template = load_catalog(code).get(key)
+    except KeyError:
+        template = None
+    if template is None and code != DEFAULT_LOCALE:
+        template = load_catalog(DEFAULT_LOCALE).get(key)
+    if template is None:
+        return f"MISSING:{key}"
+    return template(**kwargs)
+
+def lang(key: str, /, **kwargs) -> str:
+    '''Translates key into the language of the chat the current update came from.'''
+    return translate(locale_var.get(), key, **kwargs)
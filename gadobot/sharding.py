@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import multiprocessing as mp
+import queue as queue_module
+import signal
+import time
+from aiogram import Bot
+
+from .config import Config
+from .bot import create_bot, create_dispatcher, resolve_allowed_updates
+from .database.snapshot import save_snapshot, warm_caches
+from .database.engine import Database
+from .jobs import JobScheduler
+from .utils.helpers import shutdown_event
+from .utils.logging import setup_logging
+from .webhook import run_webhook
+from .updates import ChatSerializer, OffsetTracker, update_chat_id, poll_updates, prepare_polling, save_offset
+from .utils.metrics import metrics, start_metrics_server
+from .utils.usernames import username_index
+from .database.repo import Repository, blacklist_cache
+from .utils.flood import FloodGuard
+
+logger = logging.getLogger(__name__)
+
+_IDLE = object()
+
+def _get(q, timeout: float = 1.0):
+    try:
+        return q.get(timeout=timeout)
+    except queue_module.Empty:
+        return _IDLE
+
+# Control messages travel through the update queues next to raw updates, marked by this key
+CONTROL = "_control"
+
+def worker_main(index: int, q, events, heartbeat):
+    '''Worker process entry point.'''
+    # Shutdown is driven by the ingest process through a sentinel, not by terminal signals
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_run_worker(index, q, events, heartbeat))
+
+def _send_acks(events, index: int, handled: list[int]):
+    if handled:
+        events.put(("handled", index, handled[:]))
+        handled.clear()
+
+async def _heartbeat(heartbeat, events, index: int, handled: list[int]):
+    # Handled update ids go back to the ingest in batches, at most a second late
+    while True:
+        heartbeat.value = time.time()
+        _send_acks(events, index, handled)
+        await asyncio.sleep(1)
+
+def _handle_control(message: dict, flood: FloodGuard):
+    if message[CONTROL] == "invalidate_blacklist":
+        blacklist_cache.invalidate(message["chat_ids"])
+    elif message[CONTROL] == "invalidate_all":
+        Repository.invalidate_caches()
+        flood.clear()
+
+async def _run_worker(index: int, q, events, heartbeat):
+    setup_logging(f"bot-worker{index}.log")
+    db = Database()
+    db.start()
+    # Chats are routed by id, so each worker keeps its own snapshot of the chats it serves
+    snapshot = f"{Config.CACHE_SNAPSHOT}.worker{index}" if Config.CACHE_SNAPSHOT else None
+    if snapshot:
+        await warm_caches(db, snapshot, Config.CACHE_SNAPSHOT_CHATS)
+    bot = create_bot()
+    # Each worker runs the jobs of the chats routed to it
+    jobs = JobScheduler(db, bot, shard=index, shards=Config.WORKERS, horizon=Config.JOB_HORIZON)
+    await jobs.start()
+    username_index.start(db)
+    # Blacklist writes for chats of other workers (/fban) are relayed to them by the ingest
+    blacklist_cache.on_change = lambda chat_ids: events.put(("invalidate_blacklist", index, chat_ids))
+    # And bulk changes (/import) to all of them
+    Repository.on_invalidate_all = lambda: events.put(("invalidate_all", index, None))
+    dp = create_dispatcher(db, jobs)
+    serializer = ChatSerializer(Config.WORKER_CONCURRENCY)
+    handled: list[int] = []
+
+    async def handle(update: dict):
+        try:
+            await dp.feed_raw_update(bot, update)
+        finally:
+            handled.append(update["update_id"])
+
+    loop = asyncio.get_running_loop()
+    beat = asyncio.create_task(_heartbeat(heartbeat, events, index, handled))
+    metrics_server = None
+    if Config.METRICS:
+        metrics_server = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT + 1 + index)
+    logger.info("Worker %d started", index)
+    try:
+        while True:
+            update = await loop.run_in_executor(None, _get, q)
+            if update is _IDLE:
+                continue
+            if update is None:
+                break
+            if CONTROL in update:
+                _handle_control(update, dp["flood"])
+                continue
+            await serializer.submit(update_chat_id(update), lambda u=update: handle(u))
+        await serializer.drain()
+    finally:
+        beat.cancel()
+        _send_acks(events, index, handled)
+        if metrics_server:
+            await metrics_server.cleanup()
+        await username_index.close()
+        await jobs.stop()
+        await db.close()
+        await bot.session.close()
+        if snapshot:
+            save_snapshot(snapshot, Config.CACHE_SNAPSHOT_CHATS)
+        logger.info("Worker %d stopped", index)
+
+class ShardedIngest:
+    '''
+    Routes raw updates to worker processes by chat_id, so each chat is always handled
+    by the same worker (in order, with that worker's caches) while chats spread over cores.
+    Quacks like Dispatcher.feed_raw_update, so the webhook server can feed it directly.
+
+    Workers acknowledge the updates they handled; `tracker.handled` only moves past
+    acknowledged ones. A restarted worker gets the updates its predecessor left unacknowledged,
+    once: an update that was in flight on two workers that died is dropped.
+    '''
+    def __init__(self, workers: int, queue_size: int = 1000):
+        self.ctx = mp.get_context("spawn")
+        self.queue_size = queue_size
+        self.queues = [self.ctx.Queue(queue_size) for _ in range(workers)]
+        # Lock-free: a worker killed while writing its heartbeat must not leave a lock held
+        self.heartbeats = [self.ctx.Value("d", 0.0, lock=False) for _ in range(workers)]
+        # Worker -> ingest, one queue each: (kind, worker index, payload)
+        self.events = [self.ctx.Queue() for _ in range(workers)]
+        self.processes: list = [None] * workers
+        self.tracker = OffsetTracker()
+        # Per worker: update_id -> update, routed but not acknowledged yet, in routing order
+        self.in_flight: list[dict[int, dict]] = [{} for _ in range(workers)]
+        self._refed: set[int] = set()
+        self._stopped = False
+        self.routed = [0] * workers
+        self.restarts = 0
+        self.lost = 0
+
+    def _spawn(self, index: int):
+        self.heartbeats[index].value = time.time()
+        process = self.ctx.Process(
+            target=worker_main, args=(index, self.queues[index], self.events[index], self.heartbeats[index]),
+            name=f"gadobot-worker-{index}",
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self):
+        for index in range(len(self.processes)):
+            self._spawn(index)
+
+    def shard_of(self, update: dict) -> int:
+        key = update_chat_id(update)
+        if key is None:
+            key = update.get("update_id", 0)
+        return key % len(self.queues)
+
+    async def feed_raw_update(self, bot: Bot, update: dict):
+        index = self.shard_of(update)
+        update_id = update["update_id"]
+        self.tracker.fed(update_id)
+        self.in_flight[index][update_id] = update
+        await self._put(index, update)
+        self.routed[index] += 1
+
+    async def _put(self, index: int, item):
+        # Backpressure: when the queue is full, hold the caller until the worker catches up
+        q = self.queues[index]
+        try:
+            q.put_nowait(item)
+            return
+        except queue_module.Full:
+            pass
+        loop = asyncio.get_running_loop()
+        while self.queues[index] is q:
+            try:
+                return await loop.run_in_executor(None, q.put, item, True, 1.0)
+            except queue_module.Full:
+                pass
+        # The worker was restarted meanwhile: its fresh queue already holds every unacknowledged update,
+        # and control messages don't matter to a worker that starts with empty caches
+
+    async def relay(self):
+        '''
+        Handles events sent by the workers: acknowledgements, and cache invalidations forwarded
+        to the owning workers (or to all of them, after an import). Returns once stop() is done and every event was read.
+        '''
+        await asyncio.gather(*(self._relay_worker(index) for index in range(len(self.processes))))
+
+    async def _relay_worker(self, index: int):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Picks up the fresh queue of a restarted worker
+            events = self.events[index]
+            try:
+                event = await loop.run_in_executor(None, _get, events)
+            except Exception:
+                if events is self.events[index]:
+                    raise
+                # The old queue of a killed worker, it may hold half an event
+                continue
+            if event is _IDLE:
+                if self._stopped:
+                    return
+                continue
+            await self._handle_event(event)
+
+    async def _handle_event(self, event: tuple):
+        kind, sender, payload = event
+        if kind == "handled":
+            in_flight = self.in_flight[sender]
+            for update_id in payload:
+                in_flight.pop(update_id, None)
+                self._refed.discard(update_id)
+                self.tracker.done(update_id)
+        elif kind == "invalidate_blacklist" and not self._stopped:
+            owned: dict[int, list[int]] = {}
+            for chat_id in payload:
+                owned.setdefault(chat_id % len(self.queues), []).append(chat_id)
+            for index, chat_ids in owned.items():
+                if index != sender:
+                    await self._put(index, {CONTROL: kind, "chat_ids": chat_ids})
+        elif kind == "invalidate_all" and not self._stopped:
+            for index in range(len(self.queues)):
+                if index != sender:
+                    await self._put(index, {CONTROL: kind})
+
+    def check_health(self):
+        '''Restarts workers that died or stopped sending heartbeats.'''
+        now = time.time()
+        for index, process in enumerate(self.processes):
+            stale = now - self.heartbeats[index].value > Config.WORKER_HEARTBEAT_TIMEOUT
+            if process.is_alive() and not stale:
+                continue
+            logger.error("Worker %d %s, restarting", index, "hung" if process.is_alive() else f"exited ({process.exitcode})")
+            if process.is_alive():
+                # Workers ignore SIGTERM (they drain on the ingest's sentinel instead), and a hung
+                # one can't drain: kill it, then replace everything it may have left half-written
+                process.kill()
+                process.join()
+            self.restarts += 1
+            self._requeue(index)
+            self.events[index] = self.ctx.Queue()
+            self.heartbeats[index] = self.ctx.Value("d", 0.0, lock=False)
+            self._spawn(index)
+
+    def _requeue(self, index: int):
+        '''
+        Gives the replacement of a dead worker a fresh queue holding the updates its predecessor
+        never acknowledged, then the ones routed meanwhile. Updates it handled but had not
+        acknowledged yet run again.
+        '''
+        pending = self.in_flight[index]
+        for update_id in [u for u in pending if u in self._refed]:
+            # Second worker to die on it
+            logger.error("Dropping update %d, in flight on two workers that died", update_id)
+            del pending[update_id]
+            self._refed.discard(update_id)
+            self.tracker.done(update_id)
+            self.lost += 1
+        self._refed.update(pending)
+        # The old queue may hold half a message or a lock the dead worker took; never read again,
+        # so don't let its unsent buffer hold up this process's exit
+        self.queues[index].cancel_join_thread()
+        # Sized to take the backlog without blocking; feeders put after it, so order is kept
+        q = self.ctx.Queue(self.queue_size + len(pending))
+        for update in pending.values():
+            q.put_nowait(update)
+        self.queues[index] = q
+        if pending:
+            logger.warning("Handing %d unacknowledged updates to the new worker %d", len(pending), index)
+
+    async def monitor(self, interval: float = 5.0):
+        while True:
+            await asyncio.sleep(interval)
+            self.check_health()
+            logger.debug("Shards: %s", self.stats())
+
+    async def stop(self, timeout: float = 30.0):
+        '''Lets every worker drain its queue, then stops it.'''
+        loop = asyncio.get_running_loop()
+        for index, q in enumerate(self.queues):
+            try:
+                await loop.run_in_executor(None, q.put, None, True, timeout)
+            except queue_module.Full:
+                logger.warning("Worker %d queue still full after %ss", index, timeout)
+                q.cancel_join_thread()
+        for index, process in enumerate(self.processes):
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                # SIGTERM is ignored by workers
+                logger.warning("Worker %d did not stop in %ss, killing it", index, timeout)
+                process.kill()
+                process.join()
+        self._stopped = True
+
+    def stats(self) -> dict:
+        now = time.time()
+        workers = []
+        for index, process in enumerate(self.processes):
+            try:
+                depth = self.queues[index].qsize()
+            except NotImplementedError: # macOS
+                depth = -1
+            workers.append({
+                "alive": process.is_alive(),
+                "queue_depth": depth,
+                "routed": self.routed[index],
+                "in_flight": len(self.in_flight[index]),
+                "heartbeat_age": now - self.heartbeats[index].value,
+            })
+        return {"workers": workers, "restarts": self.restarts, "lost": self.lost, "handled_offset": self.tracker.handled}
+
+async def run_sharded():
+    # Migrate once, before workers open their own engines
+    db = Database()
+    await db.migrate()
+
+    ingest = ShardedIngest(Config.WORKERS, Config.WORKER_QUEUE_SIZE)
+    ingest.start()
+    bot = create_bot()
+    allowed_updates = resolve_allowed_updates()
+    monitor = asyncio.create_task(ingest.monitor())
+    relay = asyncio.create_task(ingest.relay())
+    saver = None
+    metrics_server = None
+    if Config.METRICS:
+        metrics.collect("shards", ingest.stats, counters=("restarts", "routed", "lost"))
+        metrics_server = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT)
+    logger.info("Ingest started with %d workers", Config.WORKERS)
+
+    async def save_offsets():
+        # Only as far as the workers acknowledged, so a restart skips what Telegram resends of it.
+        # Updates still queued at a crash were already confirmed to Telegram and are not replayed.
+        saved = None
+        while True:
+            await asyncio.sleep(Config.OFFSET_SAVE_INTERVAL)
+            if ingest.tracker.handled != saved:
+                saved = ingest.tracker.handled
+                await save_offset(db, saved)
+
+    try:
+        if Config.UPDATES_MODE == "webhook":
+            # A single feeder keeps per-chat order on the way into the shard queues
+            await run_webhook(ingest, bot, allowed_updates, workers=1)
+        else:
+            offset = await prepare_polling(bot, db)
+            saver = asyncio.create_task(save_offsets())
+
+            async def feed(update):
+                await ingest.feed_raw_update(bot, update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+            stop = shutdown_event()
+            polling = asyncio.create_task(poll_updates(bot, allowed_updates, feed, offset))
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait([polling, stopping], return_when=asyncio.FIRST_COMPLETED)
+            polling.cancel()
+            stopping.cancel()
+    finally:
+        if metrics_server:
+            await metrics_server.cleanup()
+        monitor.cancel()
+        if saver:
+            saver.cancel()
+        await ingest.stop()
+        # Read the last acknowledgements before saving
+        await asyncio.gather(relay, return_exceptions=True)
+        if saver:
+            await save_offset(db, ingest.tracker.handled)
+        await db.close()
+        await bot.session.close()
+        logger.info("Ingest stopped: %s", ingest.stats())
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import time
+from typing import Optional
+from aiogram import Bot, Dispatcher, types
+
+from .config import Config
+from .database.engine import Database
+from .utils.helpers import shutdown_event
+
+logger = logging.getLogger(__name__)
+
+# Update types whose payload carries the chat under ["chat"]
+CHAT_UPDATES = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "chat_member", "my_chat_member", "chat_join_request", "message_reaction",
+)
+
+OFFSET_KEY = "update_offset"
+
+def update_chat_id(update: dict) -> Optional[int]:
+    '''Returns the chat a raw update belongs to, or None for chat-less updates (inline queries, polls, ...).'''
+    for kind in CHAT_UPDATES:
+        payload = update.get(kind)
+        if payload:
+            return payload["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        return message["chat"]["id"] if message else callback["from"]["id"]
+    return None
+
+def event_chat_id(update: types.Update) -> Optional[int]:
+    '''update_chat_id() for parsed updates.'''
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    return user.id if user else None
+
+class ChatSerializer:
+    '''
+    Runs update handlers concurrently across chats but strictly in order within a chat.
+    At most `limit` updates are in flight; submit() waits for a free slot.
+    '''
+    def __init__(self, limit: int = 64):
+        self._slots = asyncio.Semaphore(limit)
+        self._tails: dict = {}
+
+    async def submit(self, key, make_coro):
+        await self._slots.acquire()
+        prev = self._tails.get(key)
+        task = asyncio.create_task(self._run(key, prev, make_coro))
+        self._tails[key] = task
+
+    async def _run(self, key, prev: Optional[asyncio.Task], make_coro):
+        try:
+            if prev:
+                await asyncio.wait([prev])
+            await make_coro()
+        except Exception:
+            logger.exception("Update handling failed")
+        finally:
+            self._slots.release()
+            if self._tails.get(key) is asyncio.current_task():
+                del self._tails[key]
+
+    async def drain(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+class OffsetTracker:
+    '''
+    Highest update_id up to which every update was handled, while later ones may
+    still be in flight. This is what gets persisted, and it only deduplicates: getUpdates
+    confirms a batch to Telegram as soon as the next one is requested, so updates still
+    in flight when the process dies are not sent again. What a restart does skip is the
+    handled part of the last batch, which Telegram resends since it was never confirmed.
+    '''
+    def __init__(self, last: Optional[int] = None):
+        self.last_fed = last
+        self._in_flight: set[int] = set()
+
+    def fed(self, update_id: int):
+        self._in_flight.add(update_id)
+        self.last_fed = update_id
+
+    def done(self, update_id: int):
+        self._in_flight.discard(update_id)
+
+    @property
+    def handled(self) -> Optional[int]:
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self.last_fed
+
+async def poll_updates(bot: Bot, allowed_updates: list[str], feed, offset: Optional[int] = None, timeout: int = 30):
+    '''Long-polls getUpdates from offset and hands each parsed update to feed(update), in order.'''
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except Exception:
+            logger.exception("getUpdates failed, retrying in %ds", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await feed(update)
+            offset = update.update_id + 1
+
+async def load_offset(db: Database) -> Optional[int]:
+    async with db.repository() as repo:
+        return await repo.get_state(OFFSET_KEY)
+
+async def save_offset(db: Database, update_id: Optional[int]):
+    if update_id is None:
+        return
+    try:
+        async with db.repository() as repo:
+            await repo.set_state(OFFSET_KEY, update_id)
+    except Exception:
+        logger.exception("Saving the update offset failed")
+
+async def prepare_polling(bot: Bot, db: Database) -> Optional[int]:
+    '''Removes any webhook and returns the getUpdates offset to resume from.'''
+    if not Config.KEEP_PENDING_UPDATES:
+        await bot.delete_webhook(drop_pending_updates=True)
+        return None
+    await bot.delete_webhook(drop_pending_updates=False)
+    last = await load_offset(db)
+    if last is not None:
+        logger.info("Resuming updates after %d", last)
+        return last + 1
+    return None
+
+async def run_polling(dp: Dispatcher, bot: Bot, db: Database, allowed_updates: list[str]):
+    '''
+    Polls until SIGINT/SIGTERM. Updates run concurrently across chats and in order within
+    a chat, and the handled offset is saved every OFFSET_SAVE_INTERVAL seconds and on exit.
+    Pending updates are kept across restarts unless KEEP_PENDING_UPDATES is off; updates
+    still in flight when the process dies are lost (see OffsetTracker).
+    '''
+    offset = await prepare_polling(bot, db)
+    serializer = ChatSerializer(Config.WORKER_CONCURRENCY)
+    tracker = OffsetTracker()
+    saved = None
+    next_save = time.monotonic() + Config.OFFSET_SAVE_INTERVAL
+
+    async def handle(update: types.Update):
+        try:
+            await dp.feed_update(bot, update)
+        finally:
+            tracker.done(update.update_id)
+
+    async def feed(update: types.Update):
+        nonlocal saved, next_save
+        tracker.fed(update.update_id)
+        await serializer.submit(event_chat_id(update), lambda: handle(update))
+        if time.monotonic() >= next_save and tracker.handled != saved:
+            saved = tracker.handled
+            next_save = time.monotonic() + Config.OFFSET_SAVE_INTERVAL
+            await save_offset(db, saved)
+
+    stop = shutdown_event()
+    polling = asyncio.create_task(poll_updates(bot, allowed_updates, feed, offset))
+    stopping = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait([polling, stopping], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        polling.cancel()
+        stopping.cancel()
+        await serializer.drain()
+        await save_offset(db, tracker.handled)
+        await bot.session.close()
+
+async def stale_message_middleware(handler, event: types.Message, data):
+    '''
+    Outer middleware: messages older than STALE_UPDATE_SECONDS are backlog from downtime.
+    Commands still run (moderation must be applied late rather than never); everything
+    else, such as filter replies nobody is waiting for any more, is skipped before any work.
+    '''
+    age = time.time() - event.date.timestamp()
+    if age > Config.STALE_UPDATE_SECONDS:
+        text = event.text or event.caption or ""
+        if not text.startswith("/"):
+            return None
+    return await handler(event, data)
@@ -0,0 +1,118 @@
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+from typing import Optional
+from aiogram import Bot, types
+from ..config import Config
+from ..database.repo import Repository
+from ..resources.locales import lang
+
+ADMIN_STATUSES = ('administrator', 'creator')
+
+class AdminCache:
+    '''
+    Per-chat administrator list, filled in bulk with get_chat_administrators.
+    Entries expire after ttl seconds and are dropped at once on chat_member/my_chat_member updates.
+    At most max_chats are kept, evicting the least recently used.
+    '''
+    def __init__(self, ttl: float = 300, max_chats: int = 10000):
+        self.ttl = ttl
+        self.max_chats = max_chats
+        self._chats: "OrderedDict[int, tuple[float, dict[int, types.ChatMember]]]" = OrderedDict()
+        self._pending: dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_admins(self, bot: Bot, chat_id: int) -> dict[int, types.ChatMember]:
+        '''Returns {user_id: ChatMember} of the chat's administrators. Raises if the API call fails.'''
+        entry = self._chats.get(chat_id)
+        if entry and entry[0] > time.monotonic():
+            self._chats.move_to_end(chat_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        # Concurrent commands in the same chat share one API call
+        pending = self._pending.get(chat_id)
+        while pending:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The fetching task was cancelled, not this one: fetch here instead
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+            pending = self._pending.get(chat_id)
+
+        future = asyncio.get_running_loop().create_future()
+        self._pending[chat_id] = future
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+            admins = {m.user.id: m for m in members}
+            self._store(chat_id, admins)
+            future.set_result(admins)
+            return admins
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved so a future nobody awaited doesn't log it; waiters still get it
+            future.exception()
+            raise
+        finally:
+            # Cancelled mid-call: waiters must not hang on a future nobody resolves
+            if not future.done():
+                future.cancel()
+            del self._pending[chat_id]
+
+    def _store(self, chat_id: int, admins: dict[int, types.ChatMember]):
+        self._chats[chat_id] = (time.monotonic() + self.ttl, admins)
+        self._chats.move_to_end(chat_id)
+        while len(self._chats) > self.max_chats:
+            self._chats.popitem(last=False)
+
+    async def get_member(self, bot: Bot, chat_id: int, user_id: int) -> Optional[types.ChatMember]:
+        '''Returns the admin ChatMember of user_id, or None if the user is not an administrator.'''
+        admins = await self.get_admins(bot, chat_id)
+        return admins.get(user_id)
+
+    def invalidate(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+
+    def clear(self):
+        self._chats.clear()
+
+    def stats(self) -> dict:
+        return {"chats": len(self._chats), "hits": self.hits, "misses": self.misses}
+
+admin_cache = AdminCache(Config.ADMIN_CACHE_TTL, Config.ADMIN_CACHE_SIZE)
+
+async def admin_cache_middleware(handler, event: types.ChatMemberUpdated, data):
+    '''Outer middleware for chat_member/my_chat_member: drops the chat's cached admin list on any rights change.'''
+    old, new = event.old_chat_member, event.new_chat_member
+    if old.status in ADMIN_STATUSES or new.status in ADMIN_STATUSES:
+        admin_cache.invalidate(event.chat.id)
+    return await handler(event, data)
+
+def is_admin(func):
+    '''Decorator: Checks if user and bot have admin rights.'''
+    # wraps() lets aiogram see the handler's own parameters, so only those are injected
+    @functools.wraps(func)
+    async def wrapper(message: types.Message, bot: Bot, repo: Repository, **kwargs):
+        # Both checks are served from one cached get_chat_administrators call
+        try:
+            admins = await admin_cache.get_admins(bot, message.chat.id)
+        except:
+            return # Bot probably kicked
+            
+        # 1. User check
+        if message.from_user.id not in admins:
+            await message.reply(lang("user_no_perm"))
+            return
+        
+        # 2. Bot check
+        bot_member = admins.get(bot.id)
+        if not getattr(bot_member, "can_restrict_members", False):
+            await message.reply(lang("bot_no_perm"))
+            return
+            
+        return await func(message, bot=bot, repo=repo, **kwargs)
+    return wrapper
@@ -0,0 +1,38 @@
+import math
+
+_MASK = (1 << 64) - 1
+
+class BloomFilter:
+    '''
+    Fixed-size Bloom filter for integer ids.
+    No false negatives; false positives at roughly `error_rate` once `capacity` ids are added.
+    '''
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, value: int):
+        # Double hashing over two 64-bit mixes of the id (splitmix64 finalizer)
+        x = (value * 0x9E3779B97F4A7C15) & _MASK
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK
+        h1 = x ^ (x >> 31)
+        h2 = ((h1 * 0xFF51AFD7ED558CCD) & _MASK) | 1
+        for i in range(self.hashes):
+            yield ((h1 + i * h2) & _MASK) % self.size
+
+    def add(self, value: int):
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, value: int) -> bool:
+        bits = self.bits
+        for pos in self._positions(value):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
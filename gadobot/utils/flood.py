@@ -0,0 +1,184 @@
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from aiogram import types
+
+from ..config import Config
+from .admins import admin_cache
+from ..resources.locales import lang
+
+logger = logging.getLogger(__name__)
+
+class RateWindow:
+    '''
+    Sliding-window counter: "were there more than `limit` hits within `window` seconds?".
+    Keeps the times of the last `limit` hits in a ring, so it costs limit * 8 bytes
+    and one comparison per hit: the slot about to be overwritten holds the hit
+    `limit` hits ago, and if that one is still inside the window the rate is exceeded.
+    '''
+    __slots__ = ("times", "pos")
+
+    def __init__(self, limit: int):
+        self.times = array("d", [float("-inf")]) * limit
+        self.pos = 0
+
+    def hit(self, now: float, window: float) -> bool:
+        exceeded = now - self.times[self.pos] < window
+        self.times[self.pos] = now
+        self.pos = (self.pos + 1) % len(self.times)
+        return exceeded
+
+    def last(self) -> float:
+        return self.times[self.pos - 1]
+
+class ChatFlood:
+    __slots__ = ("limit", "window", "mute", "chat", "users", "muted", "raid_until", "seen")
+
+    def __init__(self, limit: int, window: int, mute: int, chat_limit: int):
+        self.limit = limit
+        self.window = window
+        self.mute = mute
+        self.chat = RateWindow(chat_limit) if limit and chat_limit else None
+        self.users: dict[int, RateWindow] = {}
+        self.muted: dict[int, float] = {}
+        self.raid_until = 0.0
+        self.seen = 0.0
+
+    def sweep(self, now: float):
+        '''Forgets users that were quiet for a whole window and expired mutes.'''
+        self.users = {u: w for u, w in self.users.items() if now - w.last() < self.window}
+        self.muted = {u: t for u, t in self.muted.items() if t > now}
+
+class FloodGuard:
+    '''
+    First-stage outer middleware for messages in groups.
+
+    Counts messages per user and per chat in RateWindow rings. A user sending more than `limit`
+    messages within `window` seconds is muted for `mute` seconds through the regular
+    restrict call, and their messages are dropped here until the mute ends, before any
+    filter, command or database work. When the whole chat exceeds `chat_limit` messages
+    per window (a raid), users get twice the window to stay under their limit until it calms down.
+
+    Thresholds come from ChatSettings (NULL columns fall back to Config) and are read once
+    per chat. Chats idle for `idle` seconds are evicted, and at most `max_chats` are kept.
+    '''
+    def __init__(self, db, jobs=None, max_chats: int = 10000, idle: float = 600, max_users: int = 1000):
+        self.db = db
+        self.jobs = jobs
+        self.max_chats = max_chats
+        self.idle = idle
+        self.max_users = max_users
+        self._chats: OrderedDict[int, ChatFlood] = OrderedDict()
+
+        self.dropped = 0
+        self.mutes = 0
+        self.raids = 0
+
+    async def _load(self, chat_id: int) -> ChatFlood:
+        async with self.db.repository() as repo:
+            limit, window, mute = await repo.get_flood_settings(chat_id)
+        return ChatFlood(limit, window, mute, Config.FLOOD_CHAT_LIMIT)
+
+    def _evict(self, now: float):
+        # Least recently active chats sit at the front
+        while self._chats:
+            chat_id, state = next(iter(self._chats.items()))
+            if len(self._chats) <= self.max_chats and now - state.seen < self.idle:
+                break
+            del self._chats[chat_id]
+
+    def reset(self, chat_id: int):
+        '''Drops a chat's counters, e.g. after its thresholds changed.'''
+        self._chats.pop(chat_id, None)
+
+    def clear(self):
+        '''Drops every chat's counters, e.g. after an import changed thresholds in bulk.'''
+        self._chats.clear()
+
+    def unmute(self, chat_id: int, user_id: int):
+        '''Stops dropping a flood-muted user's messages, e.g. after an admin lifted the mute.'''
+        state = self._chats.get(chat_id)
+        if state is not None:
+            state.muted.pop(user_id, None)
+            state.users.pop(user_id, None)
+
+    async def __call__(self, handler, event: types.Message, data):
+        if event.chat.type not in ("group", "supergroup") or not event.from_user:
+            return await handler(event, data)
+
+        now = time.time()
+        # Rates are measured in send time, so a backlog replayed at once isn't mistaken for a flood
+        sent = event.date.timestamp()
+        chat_id = event.chat.id
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = await self._load(chat_id)
+            self._chats[chat_id] = state
+        else:
+            self._chats.move_to_end(chat_id)
+        state.seen = now
+        self._evict(now)
+
+        if not state.limit:
+            return await handler(event, data)
+
+        user_id = event.from_user.id
+        muted_until = state.muted.get(user_id)
+        if muted_until:
+            if muted_until > now:
+                self.dropped += 1
+                return None
+            del state.muted[user_id]
+
+        if state.chat and state.chat.hit(sent, state.window):
+            if state.raid_until <= sent:
+                self.raids += 1
+                logger.warning("Message flood in chat %s, tightening limits", chat_id)
+            state.raid_until = sent + state.window
+
+        user = state.users.get(user_id)
+        if user is None:
+            if len(state.users) >= self.max_users:
+                state.sweep(now)
+            user = state.users[user_id] = RateWindow(state.limit)
+        window = state.window * 2 if state.raid_until > sent else state.window
+        if not user.hit(sent, window):
+            return await handler(event, data)
+
+        bot = data["bot"]
+        try:
+            if user_id in await admin_cache.get_admins(bot, chat_id):
+                return await handler(event, data)
+        except Exception:
+            return await handler(event, data)
+
+        # Drop the rest of the burst while the restrict call is in flight
+        state.muted[user_id] = now + state.mute
+        del state.users[user_id]
+        self.mutes += 1
+        self.dropped += 1
+        await self._mute(bot, chat_id, user_id, state.mute)
+        return None
+
+    async def _mute(self, bot, chat_id: int, user_id: int, duration: int):
+        try:
+            await bot.restrict_chat_member(
+                chat_id, user_id, permissions=types.ChatPermissions(can_send_messages=False),
+                until_date=int(time.time() + duration),
+            )
+            await bot.send_message(chat_id, lang("muted", user_id=user_id, timer=f"-time {duration}s", reason="-reason flood"))
+            if self.jobs:
+                async with self.db.repository() as repo:
+                    await repo.cancel_jobs("unmute", chat_id, user_id)
+                    await self.jobs.schedule(repo, "unmute", duration, chat_id, user_id)
+        except Exception:
+            logger.warning("Failed to mute flooding user %s in %s", user_id, chat_id)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "dropped": self.dropped,
+            "mutes": self.mutes,
+            "raids": self.raids,
+        }
@@ -1,9 +1,38 @@
+import asyncio
+import signal
 from typing import Optional, Tuple
 from aiogram import types
+from .usernames import username_index
 
-async def parse_target_args(message: types.Message) -> Tuple[Optional[int], str, Optional[int]]:
+# Everything a regular member may do, used to lift a mute
+FULL_PERMISSIONS = types.ChatPermissions(
+    can_send_messages=True, can_send_media_messages=True,
+    can_send_polls=True, can_send_other_messages=True
+)
+
+DURATION_UNITS = {'d': 86400, 'h': 3600, 'm': 60}
+
+def parse_duration(arg: str) -> Optional[int]:
+    '''Parses 30m / 2h / 7d into seconds, None if arg is not a duration.'''
+    if len(arg) > 1 and arg[-1] in DURATION_UNITS and arg[:-1].isdigit():
+        return int(arg[:-1]) * DURATION_UNITS[arg[-1]]
+    return None
+
+def shutdown_event() -> asyncio.Event:
+    '''Returns an event set on SIGINT/SIGTERM.'''
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError: # Windows
+            pass
+    return stop
+
+async def parse_target_args(message: types.Message, repo=None) -> Tuple[Optional[int], str, Optional[int]]:
     '''
     Parses arguments for moderation commands.
+    @username targets are resolved through the username index (needs repo for its DB fallback).
     Returns: (user_id, reason, duration_seconds)
     '''
     args = message.text.split()
@@ -14,24 +43,55 @@ async def parse_target_args(message: types.Message) -> Tuple[Optional[int], str,
     reason_parts = []
     timer = None
 
-    # check reply
-    if message.reply_to_message:
-        user_id = message.reply_to_message.from_user.id
+    # check reply; channel posts and anonymous admins have no from_user
+    replied = message.reply_to_message.from_user if message.reply_to_message else None
+    if replied:
+        user_id = replied.id
+
+    # Users without a username are mentioned by name, the entity carries them
+    mentioned = [e.user.id for e in message.entities or () if e.type == "text_mention" and e.user]
+    if mentioned and not user_id:
+        user_id = mentioned[0]
 
     for arg in args:
-        if arg.startswith("@"):
-            # Handle mention logic if needed, usually we need ID
-            pass 
+        if arg.startswith("@") and len(arg) > 1:
+            if not user_id and repo is not None:
+                user_id = await username_index.resolve(repo, arg)
         elif arg.isdigit():
             if not user_id:
                 user_id = int(arg)
-        elif arg.endswith(('d', 'h', 'm')) and arg[:-1].isdigit():
-            val = int(arg[:-1])
-            if arg.endswith('d'): timer = val * 86400
-            elif arg.endswith('h'): timer = val * 3600
-            elif arg.endswith('m'): timer = val * 60
+        elif parse_duration(arg) is not None:
+            timer = parse_duration(arg)
+        else:
+            reason_parts.append(arg)
+
+    reason = " ".join(reason_parts) if reason_parts else None
+    return user_id, reason, timer
+
+async def parse_target_list(message: types.Message, repo=None) -> Tuple[list[int], Optional[str]]:
+    '''
+    Like parse_target_args(), for commands acting on several users at once:
+    every id, @username, text mention and the replied-to user is a target.
+    Returns: (user_ids in order without duplicates, reason)
+    '''
+    args = message.text.split()[1:]
+    user_ids = []
+    reason_parts = []
+
+    replied = message.reply_to_message.from_user if message.reply_to_message else None
+    if replied:
+        user_ids.append(replied.id)
+    user_ids += [e.user.id for e in message.entities or () if e.type == "text_mention" and e.user]
+
+    for arg in args:
+        if arg.startswith("@") and len(arg) > 1:
+            user_id = await username_index.resolve(repo, arg) if repo is not None else None
+            if user_id:
+                user_ids.append(user_id)
+        elif arg.isdigit():
+            user_ids.append(int(arg))
         else:
             reason_parts.append(arg)
 
     reason = " ".join(reason_parts) if reason_parts else None
-    return user_id, reason, timer
\ No newline at end of file
+    return list(dict.fromkeys(user_ids)), reason
@@ -2,10 +2,11 @@ import logging
 import os
 from logging.handlers import RotatingFileHandler
 
-def setup_logging():
+def setup_logging(filename: str = "bot.log"):
+    # Each process needs its own file, RotatingFileHandler can't rotate a shared one
     log_dir = "logs"
     os.makedirs(log_dir, exist_ok=True)
-    log_path = os.path.join(log_dir, "bot.log")
+    log_path = os.path.join(log_dir, filename)
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
@@ -0,0 +1,307 @@
+import logging
+import re
+from typing import Optional
+import regex
+
+logger = logging.getLogger(__name__)
+
+# Regex triggers run on the regex module, which can stop a search after a timeout;
+# the usual catastrophic shapes are still rejected up front
+MAX_REGEX_LENGTH = 200
+# Seconds one regex search may take before the trigger is disabled
+REGEX_TIMEOUT = 0.05
+# Only this many characters of a message are scanned by "contains" and regex triggers
+MAX_SCAN_CHARS = 4096
+
+_NESTED_QUANTIFIER = re.compile(r"\((?:[^()\\]|\\.)*[+*}](?:[^()\\]|\\.)*\)\s*[+*{]")
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P[<=]")
+_REPEATED_ALTERNATION = re.compile(r"\((?:[^()\\]|\\.)*\|(?:[^()\\]|\\.)*\)\s*[+*{]")
+
+class RegexRejected(ValueError):
+    pass
+
+def validate_regex(pattern: str) -> regex.Pattern:
+    '''Compiles a user-supplied regex trigger or raises RegexRejected.'''
+    if not pattern or len(pattern) > MAX_REGEX_LENGTH:
+        raise RegexRejected("pattern is empty or too long")
+    if _BACKREFERENCE.search(pattern):
+        raise RegexRejected("backreferences and named groups are not allowed")
+    if _NESTED_QUANTIFIER.search(pattern) or _REPEATED_ALTERNATION.search(pattern):
+        raise RegexRejected("nested quantifiers are not allowed")
+    try:
+        # Compile wrapped, exactly as it is embedded into the per-chat alternation
+        regex.compile(f"(?P<f0>{pattern})", regex.IGNORECASE)
+        return regex.compile(pattern, regex.IGNORECASE)
+    except regex.error as e:
+        raise RegexRejected(str(e)) from e
+
+_COUNTED_QUANTIFIER = re.compile(r"\{(\d*)(?:(,)(\d*))?\}")
+# Escapes longer than a backslash and one character: \xhh, \uhhhh, \Uhhhhhhhh, \N{name}, octal
+_LONG_ESCAPE = re.compile(r"\\(?:x[0-9a-fA-F]{2}|u[0-9a-fA-F]{4}|U[0-9a-fA-F]{8}|N\{[^}]*\}|0[0-7]{0,2}|[1-7][0-7]{2})")
+# (?x) makes whitespace and # insignificant, literals can't be read off the pattern then
+_VERBOSE_FLAG = re.compile(r"\(\?[aiLmsu-]*x")
+
+def _skip_class(pattern: str, i: int) -> int:
+    '''Index just past the character class opening at pattern[i].'''
+    n = len(pattern)
+    i += 1
+    if i < n and pattern[i] == "^":
+        i += 1
+    if i < n and pattern[i] == "]":
+        i += 1
+    while i < n and pattern[i] != "]":
+        i += 2 if pattern[i] == "\\" else 1
+    return i + 1
+
+def _skip_group(pattern: str, i: int) -> int:
+    '''Index just past the group opening at pattern[i], nested groups and classes included.'''
+    n = len(pattern)
+    depth = 0
+    while i < n:
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = _skip_class(pattern, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+def _quantifier(pattern: str, i: int) -> tuple[int, int, Optional[int]]:
+    '''
+    Parses the quantifier at pattern[i], if any.
+    Returns: (index after it, min repeats, max repeats or None for unbounded)
+    '''
+    c = pattern[i:i + 1]
+    if c == "?":
+        i, low, high = i + 1, 0, 1
+    elif c == "*":
+        i, low, high = i + 1, 0, None
+    elif c == "+":
+        i, low, high = i + 1, 1, None
+    elif c == "{":
+        m = _COUNTED_QUANTIFIER.match(pattern, i)
+        # "{" not forming a quantifier, like "{x}", is a literal brace
+        if not m or (not m.group(1) and not m.group(2)):
+            return i, 1, 1
+        low = int(m.group(1) or 0)
+        if m.group(2):
+            high = int(m.group(3)) if m.group(3) else None
+        else:
+            high = low
+        i = m.end()
+    else:
+        return i, 1, 1
+    # Lazy or possessive suffix
+    if pattern[i:i + 1] in ("?", "+"):
+        i += 1
+    return i, low, high
+
+def required_literal(pattern: str) -> str:
+    '''
+    Returns the longest plain literal every match of pattern must contain, or "".
+    Used to prefilter regex triggers through the literal automaton, so it must never
+    return a literal some match lacks; missing a usable literal only costs speed.
+    '''
+    if _VERBOSE_FLAG.search(pattern):
+        return ""
+    runs = []
+    run = ""
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        char = None
+        if c == "|":
+            # Top-level alternation: no single literal is required
+            return ""
+        if c == "\\":
+            nxt = pattern[i + 1:i + 2]
+            m = _LONG_ESCAPE.match(pattern, i)
+            if m:
+                # A character given by its code or name: not read as literal text, the run ends
+                i = m.end()
+            else:
+                if nxt and not nxt.isalnum():
+                    char = nxt
+                i += 2
+        elif c == "[":
+            i = _skip_class(pattern, i)
+        elif c == "(":
+            i = _skip_group(pattern, i)
+        elif c in ".^$":
+            i += 1
+        elif c in "*+?)":
+            # Stray quantifier or paren, compile() rejects these anyway
+            i += 1
+        else:
+            char = c
+            i += 1
+
+        i, low, high = _quantifier(pattern, i)
+        if char is None or low == 0:
+            # Not a literal, or an optional one: the run ends here
+            runs.append(run)
+            run = ""
+        elif high == low:
+            run += char * low
+        else:
+            # The first `low` repeats are required, any more may follow before the next literal
+            runs.append(run + char * low)
+            run = ""
+    runs.append(run)
+    return max(runs, key=len).lower()
+
+class AhoCorasick:
+    '''
+    Multi-pattern literal matcher.
+    A scan costs O(len(text) + matches) regardless of how many patterns were added.
+    '''
+    __slots__ = ("_goto", "_fail", "_out")
+
+    def __init__(self, patterns):
+        # patterns: iterable of (literal, value)
+        self._goto: list[dict] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[tuple] = [()]
+        for literal, value in patterns:
+            if not literal:
+                continue
+            node = 0
+            for ch in literal:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                node = nxt
+            self._out[node] += (value,)
+        self._build()
+
+    def _build(self):
+        goto, fail, out = self._goto, self._fail, self._out
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, nxt in goto[node].items():
+                queue.append(nxt)
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0) if node else 0
+                # Fold the suffix outputs in, so a scan needs no walk along fail links
+                if out[fail[nxt]]:
+                    out[nxt] += out[fail[nxt]]
+
+    def scan(self, text: str):
+        '''Yields the values of every pattern occurring in text.'''
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                yield from out[node]
+
+class TriggerMatcher:
+    '''
+    Compiled "contains" and regex triggers of one chat.
+    Items are (mode, trigger, value); when several triggers match, the one added first wins.
+
+    "contains" literals and the required literal of each regex share one Aho-Corasick
+    automaton, so a regex only runs when its literal is present in the message.
+    Regexes without any required literal go into one combined alternation.
+    Every search is bounded by REGEX_TIMEOUT: a regex that runs out of time is disabled
+    until the chat's filters are rebuilt, and a combined alternation that does is split up.
+    '''
+    __slots__ = ("_values", "_triggers", "_literals", "_regexes", "_fallback", "_fallback_parts")
+
+    def __init__(self, items):
+        self._values = []
+        self._triggers = []
+        # priority -> compiled regex, None once disabled
+        self._regexes: dict[int, Optional[regex.Pattern]] = {}
+        self._fallback_parts: dict[int, Optional[regex.Pattern]] = {}
+        literals = []
+        for mode, trigger, value in items:
+            priority = len(self._values)
+            self._values.append(value)
+            self._triggers.append(trigger)
+            if mode == "contains":
+                literals.append((trigger.lower(), priority))
+            elif mode == "regex":
+                try:
+                    compiled = validate_regex(trigger)
+                except RegexRejected:
+                    continue
+                literal = required_literal(trigger)
+                if literal:
+                    self._regexes[priority] = compiled
+                    literals.append((literal, priority))
+                else:
+                    self._fallback_parts[priority] = compiled
+        self._literals = AhoCorasick(literals) if literals else None
+        self._fallback = None
+        if self._fallback_parts:
+            self._fallback = regex.compile(
+                "|".join(f"(?P<f{p}>{self._triggers[p]})" for p in self._fallback_parts), regex.IGNORECASE
+            )
+
+    def _search(self, patterns: dict, priority: int, text: str) -> bool:
+        compiled = patterns[priority]
+        if compiled is None:
+            return False
+        try:
+            return compiled.search(text, timeout=REGEX_TIMEOUT) is not None
+        except TimeoutError:
+            logger.warning("Regex trigger %r timed out, disabling it", self._triggers[priority])
+            patterns[priority] = None
+            return False
+
+    def _match_fallback(self, text: str) -> Optional[int]:
+        if self._fallback is not None:
+            try:
+                m = self._fallback.search(text, timeout=REGEX_TIMEOUT)
+                return int(m.lastgroup[1:]) if m else None
+            except TimeoutError:
+                # Find the slow one among the parts from now on
+                self._fallback = None
+        for priority in sorted(self._fallback_parts):
+            if self._search(self._fallback_parts, priority, text):
+                return priority
+        return None
+
+    def match(self, text: str):
+        text = text[:MAX_SCAN_CHARS]
+        best = None
+        if self._literals:
+            regexes = self._regexes
+            candidates = set()
+            for priority in self._literals.scan(text.lower()):
+                if priority in regexes:
+                    candidates.add(priority)
+                elif best is None or priority < best:
+                    best = priority
+            for priority in sorted(candidates):
+                if best is not None and priority > best:
+                    break
+                if self._search(regexes, priority, text):
+                    best = priority
+                    break
+        if self._fallback_parts:
+            priority = self._match_fallback(text)
+            if priority is not None and (best is None or priority < best):
+                best = priority
+        return self._values[best] if best is not None else None
@@ -0,0 +1,198 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Optional
+from aiohttp import web
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Seconds; handler and API latencies of a chat bot live between a millisecond and a few seconds
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "gadobot"
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf, cumulated only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    '''
+    In-process registry rendered in the Prometheus text format.
+
+    Histograms and counters are keyed by (name, labels) and only exist once something
+    was recorded. The components' own numbers are pulled from their stats() dicts at
+    scrape time, so the hot paths don't pay for them. Nothing is hooked in unless Config.METRICS is
+    set, which keeps the overhead at zero when disabled.
+    '''
+    def __init__(self):
+        self.histograms: dict[tuple[str, tuple], Histogram] = {}
+        self.counters: dict[tuple[str, tuple], float] = {}
+        self.collectors: list[tuple[str, Callable[[], dict], frozenset]] = []
+
+    def observe(self, name: str, labels: tuple, value: float):
+        histogram = self.histograms.get((name, labels))
+        if histogram is None:
+            histogram = self.histograms[(name, labels)] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, labels: tuple, value: float = 1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def collect(self, prefix: str, stats: Callable[[], dict], counters: tuple = ()):
+        '''
+        Exposes the numeric values of stats() as gauges named <prefix>_<key>, and the keys listed
+        in `counters` (running totals) as counters named <prefix>_<key>_total.
+        A list of dicts, e.g. {"workers": [{...}, ...]}, becomes one series per item, labelled
+        with its position: <prefix>_<item key>{worker="0"}.
+        '''
+        self.collectors.append((prefix, stats, frozenset(counters)))
+
+    def render(self) -> str:
+        lines = []
+        typed = set()
+
+        def declare(name: str, kind: str):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), h in sorted(self.histograms.items()):
+            name = f"{PREFIX}_{name}"
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(h.buckets + ("+Inf",), h.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {h.sum}")
+            lines.append(f"{name}_count{_labels(labels)} {h.count}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            name = f"{PREFIX}_{name}"
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+
+        # Every sample of a metric has to follow its TYPE line, so nested series are grouped first
+        families: dict[str, tuple[str, list[str]]] = {}
+
+        def sample(prefix: str, key: str, counters: frozenset, labels: tuple, value):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                return
+            kind = "counter" if key in counters else "gauge"
+            name = f"{PREFIX}_{prefix}_{key}" + ("_total" if kind == "counter" else "")
+            families.setdefault(name, (kind, []))[1].append(f"{name}{_labels(labels)} {float(value)}")
+
+        for prefix, stats, counters in self.collectors:
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Metrics collector %s failed", prefix)
+                continue
+            hits = sum(v for k, v in values.items() if k.endswith("hits"))
+            misses = values.get("misses")
+            if misses is not None and hits + misses:
+                values = {**values, "hit_ratio": hits / (hits + misses)}
+            for key, value in values.items():
+                if isinstance(value, list):
+                    # "workers" -> worker="<index>"
+                    label = key[:-1] if key.endswith("s") else key
+                    for index, item in enumerate(value):
+                        for item_key, item_value in item.items():
+                            sample(prefix, item_key, counters, ((label, index),), item_value)
+                else:
+                    sample(prefix, key, counters, (), value)
+
+        for name, (kind, samples) in families.items():
+            declare(name, kind)
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def handler_metrics_middleware(handler, event, data):
+    '''Inner middleware: latency of every handler that matched, labelled by its function name.'''
+    callback = data["handler"].callback
+    name = getattr(callback, "__name__", "unknown")
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        metrics.inc("handler_errors_total", (("handler", name),))
+        raise
+    finally:
+        metrics.observe("handler_seconds", (("handler", name),), time.perf_counter() - started)
+
+class ApiMetrics(BaseRequestMiddleware):
+    '''Bot session middleware: latency and errors per Telegram method, measured around the HTTP call.'''
+    async def __call__(self, make_request, bot, method):
+        labels = (("method", type(method).__name__),)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            metrics.inc("api_errors_total", labels + (("error", type(e).__name__),))
+            raise
+        finally:
+            metrics.observe("api_seconds", labels, time.perf_counter() - started)
+
+def instrument_engine(engine: AsyncEngine, role: str, slow_query_ms: int = 0):
+    '''Times every statement on the engine, labelled by role (write/read) and SQL verb.'''
+    slow = slow_query_ms / 1000
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper() if statement else "?"
+        metrics.observe("db_query_seconds", (("role", role), ("op", verb)), elapsed)
+        if slow and elapsed >= slow:
+            logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def on_error(context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+        metrics.inc("db_errors_total", (("role", role),))
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        logger.exception("Metrics server could not listen on %s:%d", host, port)
+        await runner.cleanup()
+        return None
+    logger.info("Metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,256 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Lower value is sent first
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# Moderation calls jump the queue
+MODERATION_METHODS = frozenset({
+    "BanChatMember", "UnbanChatMember", "RestrictChatMember", "DeleteMessage", "BanChatSenderChat",
+})
+MAX_RETRIES = 3
+
+send_priority_var: ContextVar[int] = ContextVar("send_priority", default=NORMAL)
+
+@contextmanager
+def send_priority(priority: int):
+    '''Sets the priority of messages sent inside the block, e.g. LOW for filter replies.'''
+    token = send_priority_var.set(priority)
+    try:
+        yield
+    finally:
+        send_priority_var.reset(token)
+
+class OutboundDropped(Exception):
+    '''A low-priority request was dropped because its chat's queue overflowed or it went stale.'''
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        '''Seconds until a token is available, without taking it.'''
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def reserve(self, now: float) -> float:
+        '''Takes a token, possibly on credit, and returns how long to wait before using it.'''
+        wait = self.wait_time(now)
+        self.tokens -= 1
+        return wait
+
+class OutboundScheduler(BaseRequestMiddleware):
+    '''
+    Bot session middleware pacing sends and moderation calls to Telegram's limits.
+
+    - Per-chat token buckets pace messages to one chat (groups are slower than private chats).
+    - One global bucket is shared by all paced calls, handed out in priority order:
+      moderation (HIGH) before command replies (NORMAL) before filter replies (LOW).
+    - retry_after from a 429 blocks the chat (or everything) and the call is retried.
+    - Identical pending LOW sends to a chat are merged; LOW sends are dropped when
+      a chat already has too many queued or when they would wait longer than low_max_wait,
+      without taking a token from the buckets.
+    Other methods (getUpdates, getChatAdministrators, ...) pass straight through.
+    '''
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, group_per_minute: float = 20,
+                 low_queue_limit: int = 10, low_max_wait: float = 30, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_per_minute / 60
+        self.low_queue_limit = low_queue_limit
+        self.low_max_wait = low_max_wait
+        self.max_chats = max_chats
+        # Least recently used chats first
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._low_pending: dict = {}
+        self._merge: dict = {}
+        self._heap: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._pump: Optional[asyncio.Task] = None
+
+        # Metrics, per priority
+        self.wait_count = [0, 0, 0]
+        self.wait_seconds = [0.0, 0.0, 0.0]
+        self.wait_max = [0.0, 0.0, 0.0]
+        self.dropped = 0
+        self.merged = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is not None:
+            self._chats.move_to_end(chat_id)
+            return bucket
+        # The least recently used chat has usually been idle the longest; if it wasn't
+        # quite idle yet, forgetting it only allows that chat a few messages early
+        while len(self._chats) >= self.max_chats:
+            self._chats.popitem(last=False)
+        # Negative ids are groups and channels
+        rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+        bucket = self._chats[chat_id] = TokenBucket(rate, max(1.0, rate * 3))
+        return bucket
+
+    async def _run_pump(self):
+        while True:
+            # Skip callers that were cancelled while queued
+            while self._heap and self._heap[0][2].done():
+                heapq.heappop(self._heap)
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            wait = self.global_bucket.wait_time(time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            now = time.monotonic()
+            _, _, future, deadline = heapq.heappop(self._heap)
+            if deadline is not None and now > deadline:
+                # Went stale while queued: the token goes to the next caller instead
+                future.set_result(False)
+                continue
+            self.global_bucket.reserve(now)
+            future.set_result(True)
+
+    async def _acquire_global(self, priority: int, deadline: Optional[float] = None) -> bool:
+        '''Waits for a global token in priority order. False if the deadline passed first (no token taken).'''
+        if self._pump is None or self._pump.done():
+            self._wakeup = asyncio.Event()
+            self._pump = asyncio.create_task(self._run_pump())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future, deadline))
+        self._wakeup.set()
+        return await future
+
+    def _record_wait(self, priority: int, waited: float):
+        self.wait_count[priority] += 1
+        self.wait_seconds[priority] += waited
+        if waited > self.wait_max[priority]:
+            self.wait_max[priority] = waited
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if name in MODERATION_METHODS:
+            priority = HIGH
+        elif name.startswith("Send") or name in ("CopyMessage", "ForwardMessage"):
+            priority = send_priority_var.get()
+        else:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        if priority != LOW:
+            return await self._send(make_request, bot, method, priority, chat_id)
+
+        # Merge identical low-priority sends that are still queued
+        key = (chat_id, name, getattr(method, "text", None), getattr(method, "caption", None),
+               getattr(method, "photo", None), getattr(method, "video", None), getattr(method, "animation", None))
+        try:
+            hash(key)
+        except TypeError: # InputFile payloads
+            key = None
+        if key is not None and key in self._merge:
+            self.merged += 1
+            return await asyncio.shield(self._merge[key])
+
+        if self._low_pending.get(chat_id, 0) >= self.low_queue_limit:
+            self.dropped += 1
+            raise OutboundDropped(f"{name} to {chat_id}: queue full")
+
+        task = asyncio.ensure_future(self._send(make_request, bot, method, LOW, chat_id))
+        self._low_pending[chat_id] = self._low_pending.get(chat_id, 0) + 1
+        if key is not None:
+            self._merge[key] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if key is not None and self._merge.get(key) is task:
+                del self._merge[key]
+            left = self._low_pending[chat_id] - 1
+            if left:
+                self._low_pending[chat_id] = left
+            else:
+                del self._low_pending[chat_id]
+
+    async def _send(self, make_request, bot, method, priority: int, chat_id):
+        enqueued = time.monotonic()
+        deadline = enqueued + self.low_max_wait if priority == LOW else None
+        for attempt in range(MAX_RETRIES + 1):
+            reserved = None
+            if chat_id is not None:
+                now = time.monotonic()
+                bucket = self._chat_bucket(chat_id, now)
+                if deadline is not None and now + bucket.wait_time(now) > deadline:
+                    self._drop_stale(method, chat_id, enqueued)
+                # Moderation calls aren't bound by per-chat message limits, only by 429s
+                if priority == HIGH:
+                    wait = bucket.blocked_until - now
+                else:
+                    wait = bucket.reserve(now)
+                    reserved = bucket
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            if not await self._acquire_global(priority, deadline):
+                # Nothing is sent, so the chat gets its token back
+                if reserved is not None:
+                    reserved.tokens += 1
+                self._drop_stale(method, chat_id, enqueued)
+
+            now = time.monotonic()
+            if attempt == 0:
+                self._record_wait(priority, now - enqueued)
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == MAX_RETRIES:
+                    raise
+                self.retries += 1
+                blocked_until = time.monotonic() + e.retry_after
+                if chat_id is not None:
+                    self._chat_bucket(chat_id, now).blocked_until = blocked_until
+                else:
+                    self.global_bucket.blocked_until = blocked_until
+                logger.warning("Flood control on %s, retrying in %ss", chat_id, e.retry_after)
+
+    def _drop_stale(self, method, chat_id, enqueued: float):
+        self.dropped += 1
+        waited = time.monotonic() - enqueued
+        raise OutboundDropped(f"{type(method).__name__} to {chat_id}: stale after {waited:.1f}s")
+
+    def stats(self) -> dict:
+        stats = {
+            "queued": len(self._heap),
+            "dropped": self.dropped,
+            "merged": self.merged,
+            "retries": self.retries,
+        }
+        for priority, name in PRIORITY_NAMES.items():
+            count = self.wait_count[priority]
+            stats[f"wait_{name}_count"] = count
+            stats[f"wait_{name}_ms_avg"] = self.wait_seconds[priority] / count * 1000 if count else 0.0
+            stats[f"wait_{name}_ms_max"] = self.wait_max[priority] * 1000
+        return stats
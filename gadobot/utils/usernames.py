@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Optional
+from aiogram import types
+from ..config import Config
+
+logger = logging.getLogger(__name__)
+
+def normalize_username(name: str) -> str:
+    return name.lstrip("@").lower()
+
+class UsernameIndex:
+    '''
+    @username -> user_id, learnt passively from the updates the bot sees.
+
+    Lookups hit an in-memory LRU first and fall back to the users table, so resolving
+    a command target needs no API call. observe() only touches dicts: new or changed
+    names are collected and written in one batch every `flush_interval` seconds,
+    so a user who keeps talking under the same name costs no writes at all.
+    '''
+    def __init__(self, max_names: int = 100000, flush_interval: float = 30):
+        self.max_names = max_names
+        self.flush_interval = flush_interval
+        self._names: "OrderedDict[str, int]" = OrderedDict()
+        # Reverse of _names, to forget a user's old name when they rename
+        self._users: dict[int, str] = {}
+        # user_id -> name to write, oldest first so a name taken over within a batch ends up with its last owner
+        self._dirty: dict[int, str] = {}
+        self._db = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+
+    def observe(self, user: Optional[types.User]):
+        if user is None or not user.username:
+            return
+        name = normalize_username(user.username)
+        if self._names.get(name) == user.id:
+            self._names.move_to_end(name)
+            return
+        self._remember(name, user.id)
+        self._dirty.pop(user.id, None)
+        self._dirty[user.id] = name
+
+    def _remember(self, name: str, user_id: int):
+        old = self._users.get(user_id)
+        if old is not None and old != name and self._names.get(old) == user_id:
+            del self._names[old]
+        previous_owner = self._names.get(name)
+        if previous_owner is not None and previous_owner != user_id:
+            del self._users[previous_owner]
+        self._names[name] = user_id
+        self._names.move_to_end(name)
+        self._users[user_id] = name
+        while len(self._names) > self.max_names:
+            _, evicted = self._names.popitem(last=False)
+            del self._users[evicted]
+
+    async def resolve(self, repo, username: str) -> Optional[int]:
+        name = normalize_username(username)
+        user_id = self._names.get(name)
+        if user_id is not None:
+            self._names.move_to_end(name)
+            self.hits += 1
+            return user_id
+        self.misses += 1
+        # Seen by another shard worker or before a restart
+        user_id = await repo.get_user_by_username(name)
+        if user_id is not None:
+            self._remember(name, user_id)
+        return user_id
+
+    def start(self, db):
+        self._db = db
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._dirty or self._db is None:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            async with self._db.repository() as repo:
+                await repo.save_usernames(batch)
+            self.written += len(batch)
+        except asyncio.CancelledError:
+            self._requeue(batch)
+            raise
+        except Exception:
+            logger.exception("Saving %d usernames failed, retrying later", len(batch))
+            self._requeue(batch)
+
+    def _requeue(self, batch: dict[int, str]):
+        # Names seen meanwhile are newer, so they go after the failed batch
+        dirty, self._dirty = self._dirty, batch
+        for user_id, name in dirty.items():
+            self._dirty.pop(user_id, None)
+            self._dirty[user_id] = name
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {
+            "names": len(self._names),
+            "pending": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "written": self.written,
+        }
+
+username_index = UsernameIndex(Config.USERNAME_CACHE_SIZE, Config.USERNAME_FLUSH_INTERVAL)
+
+async def username_middleware(handler, event, data):
+    '''Outer middleware for messages and member updates: feeds every user seen into the index.'''
+    if isinstance(event, types.Message):
+        username_index.observe(event.from_user)
+        if event.reply_to_message:
+            username_index.observe(event.reply_to_message.from_user)
+        for member in event.new_chat_members or ():
+            username_index.observe(member)
+    elif isinstance(event, types.ChatMemberUpdated):
+        username_index.observe(event.from_user)
+        username_index.observe(event.new_chat_member.user)
+    return await handler(event, data)
@@ -0,0 +1,134 @@
+import asyncio
+import logging
+import secrets
+from typing import Optional
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from .config import Config
+from .updates import ChatSerializer, update_chat_id
+from .utils.helpers import shutdown_event
+from .utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+class WebhookServer:
+    '''
+    Receives updates over HTTP and feeds them to the dispatcher from a bounded queue.
+    A request is answered as soon as its update is queued. When the queue stays full
+    for `enqueue_timeout` seconds the request gets 503, so Telegram retries it later.
+    Requests must carry the secret token; without one a random secret is generated,
+    for run_webhook to register with Telegram.
+    Up to `workers` updates are handled at once, across chats; within a chat they run in order.
+    '''
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: Optional[str] = None, path: str = "/webhook",
+                 queue_size: int = 1000, workers: int = 16, enqueue_timeout: float = 1.0):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.path = path
+        self.enqueue_timeout = enqueue_timeout
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.serializer = ChatSerializer(workers)
+        self._task: Optional[asyncio.Task] = None
+        self._runner: Optional[web.AppRunner] = None
+
+        self.received = 0
+        self.rejected = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+
+        try:
+            await asyncio.wait_for(self.queue.put(update), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning("Webhook queue full (%d), asking Telegram to retry", self.queue.qsize())
+            return web.Response(status=503)
+        self.received += 1
+        return web.Response()
+
+    async def _dispatch(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                chat_id = update_chat_id(update)
+            except Exception:
+                # Malformed, the dispatcher will log it; this loop must outlive any update
+                chat_id = None
+            await self.serializer.submit(chat_id, lambda u=update: self._feed(u))
+
+    async def _feed(self, update: dict):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception:
+            logger.exception("Failed to process update %s", update.get("update_id"))
+        finally:
+            self.queue.task_done()
+
+    def start_workers(self):
+        self._task = asyncio.create_task(self._dispatch())
+
+    async def start(self, host: str, port: int):
+        self.start_workers()
+        self._runner = web.AppRunner(self.create_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Webhook server listening on %s:%d%s", host, port, self.path)
+
+    def stats(self) -> dict:
+        return {"queue_depth": self.queue.qsize(), "received": self.received, "rejected": self.rejected}
+
+    async def stop(self):
+        '''Stops accepting requests, drains queued updates and stops the workers.'''
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.queue.join()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.serializer.drain()
+
+async def run_webhook(dp: Dispatcher, bot: Bot, allowed_updates: list[str], workers: int = None):
+    '''
+    Registers the webhook with Telegram and serves it until SIGINT/SIGTERM.
+    dp can be anything with Dispatcher.feed_raw_update(bot, update).
+    '''
+    server = WebhookServer(
+        dp, bot,
+        secret=Config.WEBHOOK_SECRET,
+        path=Config.WEBHOOK_PATH,
+        queue_size=Config.WEBHOOK_QUEUE_SIZE,
+        workers=workers or Config.WEBHOOK_WORKERS,
+    )
+    stop = shutdown_event()
+    if Config.METRICS:
+        metrics.collect("webhook", server.stats, counters=("received", "rejected"))
+
+    await server.start(Config.WEBHOOK_HOST, Config.WEBHOOK_PORT)
+    try:
+        await bot.set_webhook(
+            Config.WEBHOOK_URL + Config.WEBHOOK_PATH,
+            secret_token=server.secret,
+            allowed_updates=allowed_updates,
+            drop_pending_updates=not Config.KEEP_PENDING_UPDATES,
+        )
+        await stop.wait()
+    finally:
+        await server.stop()
+        await bot.session.close()
@@ -0,0 +1,4 @@
+import os
+
+# gadobot.config refuses to load without a token; tests never reach Telegram
+os.environ.setdefault("BOT_TOKEN", "123456:test")
@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from gadobot import bot
+from gadobot.config import Config
+
+def test_unknown_handler_is_rejected(monkeypatch):
+    monkeypatch.setattr(Config, "HANDLERS", ["admin", "filter"])
+    with pytest.raises(ValueError, match="filter"):
+        bot.load_routers()
+
+def test_disabled_handlers_are_not_imported():
+    # A fresh interpreter, so modules imported by other tests don't count
+    code = (
+        "import sys; from gadobot.bot import load_routers; load_routers(); "
+        "print(sorted(m for m in sys.modules if m.startswith('gadobot.handlers.')))"
+    )
+    env = {**os.environ, "HANDLERS": "federation"}
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.split("\n")[-2] == "['gadobot.handlers.federation']"
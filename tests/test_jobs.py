@@ -0,0 +1,139 @@
+import asyncio
+import heapq
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from gadobot.database.models import Base
+from gadobot.database.repo import Repository
+from gadobot.jobs import MAX_ATTEMPTS, RETRY_DELAY, JobScheduler
+
+class FakeDatabase:
+    '''Just enough of Database for JobScheduler, on an in-memory SQLite database.'''
+    def __init__(self, engine):
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def repository(self):
+        repo = Repository(session_factory=self.session)
+        try:
+            yield repo
+        finally:
+            await repo.close()
+
+async def database() -> FakeDatabase:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return FakeDatabase(engine)
+
+@pytest.mark.parametrize("after_query", [True, False])
+def test_job_scheduled_during_refill_is_loaded_once(after_query):
+    async def run():
+        db = await database()
+        jobs = JobScheduler(db, bot=None, horizon=100)
+        await jobs._refill()
+
+        # A job between the old and the new window end is added while the next refill runs:
+        # after its query it must be pushed, before its query it must not be loaded twice
+        scheduled = []
+        real_repository = db.repository
+
+        async def schedule():
+            async with real_repository() as repo:
+                scheduled.append(await jobs.schedule(repo, "unwarn", 75, -1, 1))
+
+        @asynccontextmanager
+        async def racing_repository():
+            if not after_query:
+                await schedule()
+            async with real_repository() as repo:
+                yield repo
+            if after_query:
+                await schedule()
+
+        db.repository = racing_repository
+        jobs._loaded_until = int(time.time()) + 50
+        await jobs._refill()
+        return scheduled, jobs._heap
+
+    scheduled, heap = asyncio.run(run())
+    assert [job_id for _, job_id in heap] == scheduled
+
+def test_refill_loads_own_jobs_within_window():
+    async def run():
+        db = await database()
+        now = int(time.time())
+        async with db.repository() as repo:
+            overdue = await repo.add_job(now - 10, "unwarn", -2, 1)
+            soon = await repo.add_job(now + 50, "unwarn", -4, 1)
+            await repo.add_job(now + 500, "unwarn", -2, 1)
+            # Another shard's chat
+            await repo.add_job(now + 50, "unwarn", -3, 1)
+        jobs = JobScheduler(db, bot=None, shard=0, shards=2, horizon=100)
+        await jobs._refill()
+        return {job_id for _, job_id in jobs._heap}, overdue, soon
+
+    loaded, overdue, soon = asyncio.run(run())
+    assert loaded == {overdue, soon}
+
+def test_failed_job_is_retried_then_dropped():
+    calls = []
+
+    async def failing(repo, job):
+        calls.append(job.id)
+        raise RuntimeError("Telegram is down")
+
+    async def run():
+        db = await database()
+        jobs = JobScheduler(db, bot=None)
+        jobs.handlers["unwarn"] = failing
+        async with db.repository() as repo:
+            job_id = await jobs.schedule(repo, "unwarn", 0, -1, 1)
+
+        await jobs._execute([job_id])
+        retry = heapq.heappop(jobs._heap)
+        async with db.repository() as repo:
+            kept = [job.id for job in await repo.get_jobs([job_id])]
+
+        for _ in range(MAX_ATTEMPTS - 1):
+            await jobs._execute([job_id])
+        async with db.repository() as repo:
+            left = await repo.get_jobs([job_id])
+        return job_id, retry, kept, left, jobs
+
+    job_id, (retry_at, retry_id), kept, left, jobs = asyncio.run(run())
+    assert retry_id == job_id
+    assert retry_at >= int(time.time()) + RETRY_DELAY - 1
+    # Until it's dropped the row stays, so a restart runs it again
+    assert kept == [job_id]
+    assert calls == [job_id] * MAX_ATTEMPTS
+    assert left == []
+    assert (jobs.failed, jobs.dropped, jobs.executed) == (MAX_ATTEMPTS, 1, 0)
+    assert jobs._attempts == {}
+
+def test_job_runs_once_and_is_deleted():
+    calls = []
+
+    async def run():
+        db = await database()
+        jobs = JobScheduler(db, bot=None)
+
+        async def unwarn(repo, job):
+            calls.append((job.chat_id, job.user_id))
+
+        jobs.handlers["unwarn"] = unwarn
+        async with db.repository() as repo:
+            job_id = await jobs.schedule(repo, "unwarn", 0, -1, 1)
+        await jobs._execute([job_id, job_id])
+        # Cancelled or already done: nothing left to run
+        await jobs._execute([job_id])
+        async with db.repository() as repo:
+            return await repo.get_jobs([job_id]), jobs.executed
+
+    left, executed = asyncio.run(run())
+    assert calls == [(-1, 1)]
+    assert left == []
+    assert executed == 1
@@ -0,0 +1,30 @@
+import json
+import os
+
+import pytest
+
+from gadobot.resources.locales import LANG_DIR, available_locales, compile_template
+
+@pytest.mark.parametrize("text, kwargs", [
+    ("User {user_id} unbanned.", {"user_id": 5}),
+    ("{user} {user}!", {"user": "bob"}),
+    # Keywords are valid field names
+    ("{class} and {if}", {"class": 1, "if": 2}),
+    ("Literal {{braces}}", {}),
+    ("{{x}} is {x}", {"x": None}),
+    ("No fields", {"unused": 1}),
+    ("{x:>4}|{y!r}", {"x": 7, "y": "s"}),
+    ("{user.id}", {"user": type("U", (), {"id": 3})()}),
+])
+def test_matches_str_format(text, kwargs):
+    assert compile_template(text)(**kwargs) == text.format(**kwargs)
+
+def test_missing_field():
+    with pytest.raises(KeyError):
+        compile_template("Hi {name}")()
+
+def test_every_catalog_compiles():
+    for code in available_locales():
+        with open(os.path.join(LANG_DIR, f"{code}.json"), encoding="utf-8") as f:
+            for text in json.load(f).values():
+                compile_template(text)
@@ -0,0 +1,125 @@
+import random
+import re
+
+import pytest
+
+from gadobot.utils import matcher as matcher_module
+from gadobot.utils.matcher import TriggerMatcher, RegexRejected, required_literal, validate_regex
+
+# (pattern, texts) - texts mix matches and near misses
+CASES = [
+    # Counted quantifiers
+    ("[0-9]{5}", ["code 12346", "code 1234", "55555", "5"]),
+    ("x{10}", ["xxxxxxxxxx", "x10", "xxxxxxxxx", "10"]),
+    ("a{2,3}", ["caab", "a2,3", "ab"]),
+    (r"\d{3}-\d{4}", ["call 555-1234", "3-4", "55-1234"]),
+    ("ab{0}c", ["ac", "abc"]),
+    ("x{,3}yz", ["yz", "xxyz", "x"]),
+    ("a{x}", ["a{x}", "ax"]),
+    ("a{}", ["a{}", "a"]),
+    ("a{3}b", ["aaab", "aab", "ab"]),
+    ("ha{2,}!", ["haaaa!", "ha!", "haa!"]),
+    ("spam{2}?", ["spamm", "spam"]),
+    # Other quantifiers
+    ("colou?r", ["color", "colour", "colr"]),
+    ("ab+c", ["abbbc", "ac", "abc"]),
+    ("a+?bc", ["aaabc", "bc"]),
+    (r"spam\d*eggs", ["spameggs", "spam12eggs", "spam eggs"]),
+    # Alternation
+    ("foo|bar", ["foo", "bar", "baz"]),
+    ("(foo|bar)baz", ["foobaz", "barbaz", "baz"]),
+    ("(?:ab)+cd", ["ababcd", "cd", "abd"]),
+    ("free (money|cash)", ["free money", "free cash", "free"]),
+    # Classes
+    ("[]abc]def", ["]def", "adef", "def"]),
+    ("[^]x]yy", ["ayy", "xyy", "yy"]),
+    (r"[a-z]+\.com", ["example.com", ".com", "x.org"]),
+    (r"\.com", ["a.com", "acom"]),
+    # Escapes naming a character by code or name
+    (r"\x41bc", ["Abc", "41bc", "bc"]),
+    (r"\u0041bc", ["Abc", "0041bc"]),
+    (r"\U00000041bc", ["Abc", "00000041bc"]),
+    (r"\N{LATIN SMALL LETTER A}bc", ["abc", "{latin small letter a}bc", "bc"]),
+    (r"x\0101", ["x\x081", "x101", "x1"]),
+    (r"\x2e\x2ecom", ["..com", "x2ex2ecom"]),
+    # Flags
+    ("(?i:HELLO) there", ["hello there", "HeLLo there", "help there"]),
+    ("(?x: h e l l o)", ["hello", "h e l l o"]),
+]
+
+def expected(pattern: str, text: str):
+    return "hit" if re.search(pattern, text, re.IGNORECASE) else None
+
+@pytest.mark.parametrize("pattern,texts", CASES)
+def test_prefilter_agrees_with_re_search(pattern, texts):
+    matcher = TriggerMatcher([("regex", pattern, "hit")])
+    for text in texts:
+        assert matcher.match(text) == expected(pattern, text), (pattern, text)
+
+@pytest.mark.parametrize("pattern,texts", CASES)
+def test_required_literal_is_in_every_match(pattern, texts):
+    literal = required_literal(pattern)
+    for text in texts:
+        m = re.search(pattern, text, re.IGNORECASE)
+        if m:
+            assert literal in m.group(0).lower(), (pattern, text, literal)
+
+@pytest.mark.parametrize("pattern,literal", [
+    ("[0-9]{5}", ""),
+    ("x{10}", "xxxxxxxxxx"),
+    ("a{2,3}", "aa"),
+    (r"\d{3}-\d{4}", "-"),
+    ("foo|bar", ""),
+    ("(foo|bar)baz", "baz"),
+    ("colou?r", "colo"),
+    (r"\x41bc", "bc"),
+    (r"\N{LATIN SMALL LETTER A}bc", "bc"),
+    (r"xyz\0101", "xyz"),
+    ("Hello World", "hello world"),
+])
+def test_required_literal(pattern, literal):
+    assert required_literal(pattern) == literal
+
+def test_random_patterns_agree_with_re_search():
+    rnd = random.Random(7)
+    atoms = ["a", "b", "c", "1", "[ab]", "[0-9]", r"\d", ".", "(a|b)", "(?:ab)", r"\."]
+    quantifiers = ["", "", "", "?", "*", "+", "{2}", "{0}", "{1,2}", "{,2}", "{2,}", "+?"]
+    alphabet = "abc1.2"
+    for _ in range(500):
+        pattern = "".join(rnd.choice(atoms) + rnd.choice(quantifiers) for _ in range(rnd.randint(1, 5)))
+        try:
+            validate_regex(pattern)
+        except RegexRejected:
+            # Rejected triggers never match, by design
+            continue
+        matcher = TriggerMatcher([("regex", pattern, "hit")])
+        for _ in range(20):
+            text = "".join(rnd.choice(alphabet) for _ in range(rnd.randint(0, 8)))
+            assert matcher.match(text) == expected(pattern, text), (pattern, text)
+
+def test_first_added_trigger_wins():
+    matcher = TriggerMatcher([
+        ("regex", r"\d{3}", "digits"),
+        ("contains", "123", "literal"),
+    ])
+    assert matcher.match("abc 123") == "digits"
+    assert matcher.match("abc 12") is None
+
+# Passes validate_regex, but backtracks for seconds on a long run of digits
+SLOW_REGEX = r"\d*1\d*1\d*1\d*1\d*x"
+SLOW_TEXT = "1" * 2000 + " y"
+
+@pytest.mark.parametrize("slow", [SLOW_REGEX, SLOW_REGEX.replace("1", "[1]")])
+def test_slow_regex_is_cut_off_and_disabled(slow, monkeypatch):
+    # The second pattern has no required literal, so it runs in the combined alternation
+    monkeypatch.setattr(matcher_module, "REGEX_TIMEOUT", 0.01)
+    matcher = TriggerMatcher([
+        ("regex", slow, "slow"),
+        ("regex", "[x]|y$", "fallback"),
+        ("contains", "y", "literal"),
+    ])
+    assert matcher.match(SLOW_TEXT) == "fallback"
+    assert matcher.match("1 x") == "fallback"
+    # Other triggers still work after the slow one was dropped
+    assert matcher.match("just y") == "fallback"
+    assert matcher.match("yes") == "literal"
@@ -0,0 +1,56 @@
+from gadobot.utils.metrics import Metrics
+
+def families(text: str) -> dict[str, tuple[str, list[str]]]:
+    '''metric name -> (type, sample lines); fails if a sample comes outside its own family.'''
+    result = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split()
+            assert name not in result, f"{name} declared twice"
+            current = name
+            result[name] = (kind, [])
+        else:
+            assert line.split("{")[0].split()[0] == current, f"{line!r} outside its family"
+            result[current][1].append(line)
+    return result
+
+def test_counters_and_gauges():
+    metrics = Metrics()
+    metrics.collect("cache", lambda: {"chats": 3, "hits": 9, "misses": 1, "name": "x"}, counters=("hits", "misses"))
+    found = families(metrics.render())
+
+    assert found["gadobot_cache_chats"] == ("gauge", ["gadobot_cache_chats 3.0"])
+    assert found["gadobot_cache_hits_total"] == ("counter", ["gadobot_cache_hits_total 9.0"])
+    assert found["gadobot_cache_misses_total"] == ("counter", ["gadobot_cache_misses_total 1.0"])
+    assert found["gadobot_cache_hit_ratio"] == ("gauge", ["gadobot_cache_hit_ratio 0.9"])
+    assert not any("name" in name for name in found)
+
+def test_nested_stats_are_labelled():
+    metrics = Metrics()
+    workers = [
+        {"alive": True, "queue_depth": 4, "routed": 10},
+        {"alive": False, "queue_depth": 0, "routed": 7},
+    ]
+    metrics.collect("shards", lambda: {"workers": workers, "restarts": 1}, counters=("restarts", "routed"))
+    found = families(metrics.render())
+
+    assert found["gadobot_shards_alive"] == ("gauge", [
+        'gadobot_shards_alive{worker="0"} 1.0',
+        'gadobot_shards_alive{worker="1"} 0.0',
+    ])
+    assert found["gadobot_shards_queue_depth"][1] == [
+        'gadobot_shards_queue_depth{worker="0"} 4.0',
+        'gadobot_shards_queue_depth{worker="1"} 0.0',
+    ]
+    assert found["gadobot_shards_routed_total"] == ("counter", [
+        'gadobot_shards_routed_total{worker="0"} 10.0',
+        'gadobot_shards_routed_total{worker="1"} 7.0',
+    ])
+    assert found["gadobot_shards_restarts_total"] == ("counter", ["gadobot_shards_restarts_total 1.0"])
+
+def test_failing_collector_is_skipped():
+    metrics = Metrics()
+    metrics.collect("broken", lambda: 1 / 0)
+    metrics.collect("ok", lambda: {"value": 1})
+    assert families(metrics.render()) == {"gadobot_ok_value": ("gauge", ["gadobot_ok_value 1.0"])}
@@ -0,0 +1,75 @@
+import asyncio
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from gadobot.database.migrations import SCHEMA_VERSION, migrate
+from gadobot.database.models import Base
+from gadobot.database.repo import Repository
+
+# The tables as the first release's create_all made them, before any column was added
+BASELINE = [
+    "CREATE TABLE warns (id INTEGER PRIMARY KEY, chat_id BIGINT, user_id BIGINT, count INTEGER,"
+    " CONSTRAINT _chat_user_warn_uc UNIQUE (chat_id, user_id))",
+    "CREATE TABLE chat_settings (chat_id BIGINT PRIMARY KEY, warn_limit INTEGER, lang VARCHAR)",
+    "CREATE TABLE blacklist (id INTEGER PRIMARY KEY, chat_id BIGINT, user_id BIGINT,"
+    " CONSTRAINT _chat_user_bl_uc UNIQUE (chat_id, user_id))",
+    "CREATE TABLE filters (id INTEGER PRIMARY KEY, chat_id BIGINT, trigger VARCHAR, response VARCHAR,"
+    " file_id VARCHAR, file_type VARCHAR)",
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, user_id BIGINT, lang VARCHAR)",
+    "CREATE INDEX ix_warns_chat_id ON warns (chat_id)",
+    "CREATE INDEX ix_warns_user_id ON warns (user_id)",
+    "CREATE INDEX ix_blacklist_chat_id ON blacklist (chat_id)",
+    "CREATE INDEX ix_filters_chat_id ON filters (chat_id)",
+    "CREATE UNIQUE INDEX ix_users_user_id ON users (user_id)",
+    "INSERT INTO filters (chat_id, trigger, response) VALUES (-1, 'hi', 'hello')",
+    "INSERT INTO chat_settings (chat_id, warn_limit, lang) VALUES (-1, 2, 'eng')",
+]
+
+def schema(conn) -> dict[str, set]:
+    inspector = inspect(conn)
+    return {
+        table: {c["name"] for c in inspector.get_columns(table)} | {i["name"] for i in inspector.get_indexes(table)}
+        for table in inspector.get_table_names()
+    }
+
+def test_migrates_baseline_database(tmp_path):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'gado.db'}")
+        async with engine.begin() as conn:
+            for statement in BASELINE:
+                await conn.execute(text(statement))
+        async with engine.begin() as conn:
+            first = await conn.run_sync(migrate)
+        async with engine.begin() as conn:
+            second = await conn.run_sync(migrate)
+            migrated = await conn.run_sync(schema)
+
+        # Rows from before keep working with the new code
+        repo = Repository(session_factory=async_sessionmaker(engine, expire_on_commit=False))
+        try:
+            Repository.invalidate_caches()
+            match = await repo.match_filter(-1, "hi")
+            warns = [await repo.warn(-1, 1) for _ in range(2)]
+        finally:
+            await repo.close()
+            Repository.invalidate_caches()
+
+        fresh = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fresh.db'}")
+        async with fresh.begin() as conn:
+            created = await conn.run_sync(migrate)
+            expected = await conn.run_sync(schema)
+        await engine.dispose()
+        await fresh.dispose()
+        return first, second, migrated, match, warns, created, expected
+
+    first, second, migrated, match, warns, created, expected = asyncio.run(run())
+    assert first == (0, SCHEMA_VERSION)
+    assert second == (SCHEMA_VERSION, SCHEMA_VERSION)
+    assert created == (None, SCHEMA_VERSION)
+    # Same tables, columns and indexes as a database created from the models
+    assert set(migrated) == set(expected) >= set(Base.metadata.tables)
+    for table in expected:
+        assert migrated[table] == expected[table], table
+    assert match.response == "hello"
+    assert warns == [(1, 2, False), (2, 2, True)]
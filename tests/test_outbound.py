@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.methods import SendMessage
+
+from gadobot.utils.outbound import LOW, OutboundDropped, OutboundScheduler, send_priority
+
+def test_stale_low_sends_take_no_token():
+    async def run():
+        # One token per 0.2s, and the low send may wait 0.3s: it can't get one in time.
+        # Its group gets one message per 10s, so a lost chat token would show too.
+        scheduler = OutboundScheduler(global_rate=5, chat_rate=1000, group_per_minute=6, low_max_wait=0.3)
+        scheduler.global_bucket.tokens = 0
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.text)
+
+        async def low():
+            with send_priority(LOW):
+                await scheduler(make_request, None, SendMessage(chat_id=-1, text="low"))
+
+        normal = [asyncio.create_task(scheduler(make_request, None, SendMessage(chat_id=2, text=f"n{i}")))
+                  for i in range(3)]
+        low_task = asyncio.create_task(low())
+        await asyncio.gather(*normal)
+        with pytest.raises(OutboundDropped):
+            await low_task
+        # The dropped send took no global token: the one it waited for is still there for the next caller,
+        # and its group's next message isn't held back either
+        now = time.monotonic()
+        return scheduler, sent, scheduler.global_bucket.wait_time(now), scheduler._chats[-1].wait_time(now)
+
+    scheduler, sent, wait, chat_wait = asyncio.run(run())
+    assert sent == ["n0", "n1", "n2"]
+    assert scheduler.dropped == 1
+    assert wait < 0.05
+    assert chat_wait == 0
+
+def test_chat_buckets_are_bounded_lru():
+    scheduler = OutboundScheduler(max_chats=3)
+    for chat_id in (1, 2, 3):
+        scheduler._chat_bucket(chat_id, 0)
+    # Touching 1 makes 2 the least recently used
+    scheduler._chat_bucket(1, 0)
+    scheduler._chat_bucket(4, 0)
+    assert list(scheduler._chats) == [3, 1, 4]
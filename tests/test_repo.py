@@ -0,0 +1,59 @@
+import asyncio
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from gadobot.database.models import Base
+from gadobot.database.repo import DEFAULT_WARN_LIMIT, Repository
+
+async def repository() -> Repository:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return Repository(session_factory=async_sessionmaker(engine, expire_on_commit=False))
+
+def test_warn_resets_at_limit():
+    async def run():
+        repo = await repository()
+        try:
+            return [await repo.warn(-1, 1) for _ in range(DEFAULT_WARN_LIMIT + 1)], await repo.get_warns(-1, 1)
+        finally:
+            await repo.close()
+
+    results, stored = asyncio.run(run())
+    assert results == [(1, 3, False), (2, 3, False), (3, 3, True), (1, 3, False)]
+    assert stored == 1
+
+def test_warn_with_limit_one_bans_at_once():
+    async def run():
+        repo = await repository()
+        try:
+            await repo.set_warn_limit(-1, 1)
+            return [await repo.warn(-1, 1) for _ in range(2)], await repo.get_warns(-1, 1)
+        finally:
+            await repo.close()
+
+    results, stored = asyncio.run(run())
+    assert results == [(1, 1, True), (1, 1, True)]
+    assert stored == 0
+
+def test_warn_follows_limit_change():
+    async def run():
+        repo = await repository()
+        try:
+            first = [await repo.warn(-1, 1) for _ in range(2)]
+            # Lowered below the current count: the next warn reaches it
+            await repo.set_warn_limit(-1, 2)
+            lowered = await repo.warn(-1, 1)
+            await repo.set_warn_limit(-1, 5)
+            raised = [await repo.warn(-1, 1) for _ in range(5)]
+            # Other chats keep the default
+            other = await repo.warn(-2, 1)
+            return first, lowered, raised, other
+        finally:
+            await repo.close()
+
+    first, lowered, raised, other = asyncio.run(run())
+    assert first == [(1, 3, False), (2, 3, False)]
+    assert lowered == (2, 2, True)
+    assert raised == [(1, 5, False), (2, 5, False), (3, 5, False), (4, 5, False), (5, 5, True)]
+    assert other == (1, DEFAULT_WARN_LIMIT, False)
@@ -0,0 +1,87 @@
+import asyncio
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from gadobot.database.models import Base, Blacklist, ChatSettings, CustomFilter, User, Warn
+from gadobot.database.repo import Repository
+from gadobot.database.transfer import import_ndjson, export_ndjson
+
+async def database() -> async_sessionmaker:
+    engine = create_async_engine("sqlite+aiosqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return async_sessionmaker(engine, expire_on_commit=False)
+
+async def table_rows(session_factory) -> dict[str, set]:
+    async with session_factory() as session:
+        async def rows(*columns):
+            return set((await session.execute(select(*columns))).all())
+        return {
+            "chat_settings": await rows(ChatSettings.chat_id, ChatSettings.warn_limit, ChatSettings.flood_limit),
+            "users": await rows(User.user_id, User.lang, User.username),
+            "warns": await rows(Warn.chat_id, Warn.user_id, Warn.count),
+            "blacklist": await rows(Blacklist.chat_id, Blacklist.user_id),
+            # Not a set: duplicates must show
+            "filters": sorted((await session.execute(
+                select(CustomFilter.chat_id, CustomFilter.trigger, CustomFilter.response, CustomFilter.mode)
+            )).all()),
+        }
+
+def test_export_import_round_trip(tmp_path):
+    path = str(tmp_path / "export.ndjson.gz")
+    invalidated = []
+
+    async def run():
+        source = await database()
+        async with source() as session:
+            session.add_all([
+                ChatSettings(chat_id=-1, warn_limit=5, lang="eng", flood_limit=7),
+                User(user_id=1, lang="ita", username="alice"),
+                Warn(chat_id=-1, user_id=1, count=2),
+                Blacklist(chat_id=-1, user_id=2),
+                CustomFilter(chat_id=-1, trigger="hi", response="hello", mode="exact"),
+                CustomFilter(chat_id=-1, trigger="hi", response="hey", mode="contains"),
+                CustomFilter(chat_id=-2, trigger="spam", response="no", mode=None),
+            ])
+            await session.commit()
+        async with source() as session:
+            repo = Repository(session=session)
+            assert await export_ndjson(repo, path, chunk=2) == 7
+
+        target = await database()
+        Repository.on_invalidate_all = lambda: invalidated.append(True)
+        try:
+            # The second import is a retry: it must not duplicate anything
+            for _ in range(2):
+                async with target() as session:
+                    assert await import_ndjson(Repository(session=session), path, batch=2, transaction_rows=3) == 7
+        finally:
+            Repository.on_invalidate_all = None
+        return await table_rows(source), await table_rows(target)
+
+    exported, imported = asyncio.run(run())
+    assert imported == exported
+    assert len(imported["filters"]) == 3
+    # Other workers were told to drop their caches after each import
+    assert invalidated == [True, True]
+
+def test_import_updates_matching_filter(tmp_path):
+    path = str(tmp_path / "export.ndjson.gz")
+
+    async def run():
+        source = await database()
+        async with source() as session:
+            session.add(CustomFilter(chat_id=-1, trigger="hi", response="new", mode="exact"))
+            await session.commit()
+            await export_ndjson(Repository(session=session), path)
+
+        target = await database()
+        async with target() as session:
+            # Rows from before filter modes existed have no mode, which means exact
+            await session.execute(insert(CustomFilter).values(chat_id=-1, trigger="hi", response="old", mode=None))
+            await session.commit()
+            await import_ndjson(Repository(session=session), path)
+        return await table_rows(target)
+
+    assert asyncio.run(run())["filters"] == [(-1, "hi", "new", None)]
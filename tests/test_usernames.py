@@ -0,0 +1,76 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from aiogram import types
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from gadobot.database.models import Base, User
+from gadobot.database.repo import Repository
+from gadobot.utils.usernames import UsernameIndex
+
+def user(user_id: int, username: str) -> types.User:
+    return types.User(id=user_id, is_bot=False, first_name="x", username=username)
+
+class FakeDatabase:
+    '''Just enough of Database for UsernameIndex.flush(), on an in-memory SQLite database.'''
+    def __init__(self, engine):
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def repository(self):
+        repo = Repository(session_factory=self.session)
+        try:
+            yield repo
+        finally:
+            await repo.close()
+
+    async def users(self) -> dict[int, str]:
+        async with self.session() as session:
+            return dict((await session.execute(select(User.user_id, User.username))).all())
+
+def test_rename_forgets_old_name():
+    index = UsernameIndex()
+    index.observe(user(1, "Alice"))
+    index.observe(user(1, "alice_2"))
+    assert index._names == {"alice_2": 1}
+
+    # Someone else takes the free name; the first user keeps theirs
+    index.observe(user(2, "alice"))
+    index.observe(user(3, "alice"))
+    assert index._names == {"alice_2": 1, "alice": 3}
+
+def test_eviction_keeps_reverse_map_in_sync():
+    index = UsernameIndex(max_names=2)
+    for i in range(5):
+        index.observe(user(i, f"user{i}"))
+    assert dict(index._names) == {"user3": 3, "user4": 4}
+    assert index._users == {3: "user3", 4: "user4"}
+
+def test_name_taken_over_within_one_batch():
+    async def run():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        db = FakeDatabase(engine)
+
+        # Saved earlier: user 1 is "bob"
+        async with db.repository() as repo:
+            await repo.save_usernames({1: "bob"})
+
+        index = UsernameIndex()
+        index._db = db
+        # User 2 takes "bob" first, then user 1 is seen again under the old name they no longer hold,
+        # and finally user 2 is seen again: the last sighting decides
+        index.observe(user(2, "bob"))
+        index.observe(user(1, "bob"))
+        index.observe(user(3, "carol"))
+        index.observe(user(2, "bob"))
+        await index.flush()
+
+        users = await db.users()
+        await engine.dispose()
+        return users
+
+    users = asyncio.run(run())
+    assert users == {1: None, 2: "bob", 3: "carol"}
@@ -0,0 +1,115 @@
+import asyncio
+import random
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from gadobot.webhook import SECRET_HEADER, WebhookServer
+
+SECRET = "s3cret"
+
+class FakeDispatcher:
+    '''Records the update ids fed per chat; handling takes a random while, so unordered feeding would show.'''
+    def __init__(self):
+        self.fed: dict[int, list[int]] = {}
+        self.running = 0
+        self.max_running = 0
+
+    async def feed_raw_update(self, bot, update):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(random.random() / 100)
+            chat_id = update["message"]["chat"]["id"]
+            self.fed.setdefault(chat_id, []).append(update["update_id"])
+        finally:
+            self.running -= 1
+
+def message_update(update_id: int, chat_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": "hi",
+            "chat": {"id": chat_id, "type": "group", "title": "t"},
+        },
+    }
+
+async def serve(dp, scenario, **kwargs):
+    server = WebhookServer(dp, bot=None, secret=SECRET, **kwargs)
+    server.start_workers()
+    client = TestClient(TestServer(server.create_app()))
+    await client.start_server()
+    try:
+        await scenario(server, client)
+    finally:
+        await client.close()
+        await server.stop()
+    return server
+
+def test_rejects_wrong_secret():
+    dp = FakeDispatcher()
+
+    async def scenario(server, client):
+        missing = await client.post("/webhook", json=message_update(1, -1))
+        wrong = await client.post("/webhook", json=message_update(2, -1), headers={SECRET_HEADER: "nope"})
+        assert missing.status == wrong.status == 401
+
+    server = asyncio.run(serve(dp, scenario))
+    assert server.received == 0
+    assert dp.fed == {}
+
+def test_rejects_malformed_body():
+    async def scenario(server, client):
+        headers = {SECRET_HEADER: SECRET}
+        assert (await client.post("/webhook", data="{", headers=headers)).status == 400
+        assert (await client.post("/webhook", json=[1, 2], headers=headers)).status == 400
+
+    asyncio.run(serve(FakeDispatcher(), scenario))
+
+def test_survives_update_with_wrong_shape():
+    dp = FakeDispatcher()
+
+    async def scenario(server, client):
+        headers = {SECRET_HEADER: SECRET}
+        # update_chat_id fails on it; the following updates must still be handled
+        assert (await client.post("/webhook", json={"update_id": 1, "callback_query": "x"}, headers=headers)).status == 200
+        assert (await client.post("/webhook", json=message_update(2, -1), headers=headers)).status == 200
+        await asyncio.wait_for(server.queue.join(), 1)
+
+    asyncio.run(serve(dp, scenario))
+    assert dp.fed == {-1: [2]}
+
+def test_generates_secret_when_unset():
+    async def scenario(server, client):
+        assert server.secret
+        assert (await client.post("/webhook", json=message_update(1, -1))).status == 401
+
+    async def run():
+        server = WebhookServer(FakeDispatcher(), bot=None)
+        server.start_workers()
+        client = TestClient(TestServer(server.create_app()))
+        await client.start_server()
+        try:
+            await scenario(server, client)
+        finally:
+            await client.close()
+            await server.stop()
+
+    asyncio.run(run())
+
+def test_keeps_order_within_chat():
+    dp = FakeDispatcher()
+    chats = [-1, -2, -3, -4]
+    updates = [message_update(i, random.choice(chats)) for i in range(200)]
+
+    async def scenario(server, client):
+        for update in updates:
+            response = await client.post("/webhook", json=update, headers={SECRET_HEADER: SECRET})
+            assert response.status == 200
+
+    server = asyncio.run(serve(dp, scenario, workers=8))
+    assert server.received == len(updates)
+    for chat_id in chats:
+        expected = [u["update_id"] for u in updates if u["message"]["chat"]["id"] == chat_id]
+        assert dp.fed.get(chat_id, []) == expected
+    # Different chats still ran side by side
+    assert dp.max_running > 1
@@ -0,0 +1,74 @@
+import asyncio
+
+from gadobot.config import Config
+from gadobot.database.engine import Database
+from gadobot.database.repo import Repository
+
+def write_behind_database(tmp_path, monkeypatch) -> Database:
+    '''A file SQLite database with its own WAL readers; batches are only committed by flush().'''
+    monkeypatch.setattr(Config, "DB_URL", f"sqlite+aiosqlite:///{tmp_path / 'gado.db'}")
+    monkeypatch.setattr(Config, "WRITE_BEHIND", True)
+    monkeypatch.setattr(Config, "WRITE_BEHIND_INTERVAL_MS", 3600 * 1000)
+    return Database()
+
+def test_reads_see_pending_writes(tmp_path, monkeypatch):
+    async def run():
+        db = write_behind_database(tmp_path, monkeypatch)
+        await db.migrate()
+        db.start()
+        Repository.invalidate_caches()
+        try:
+            async with db.repository() as repo:
+                await repo.warn(-1, 1)
+                await repo.add_filter(-1, "hi", "hello")
+                # Not in the filter cache, so it's loaded from the uncommitted batch
+                Repository.invalidate_caches()
+                pending = db.write_behind.pending
+                seen = await repo.get_warns(-1, 1), (await repo.match_filter(-1, "hi")).response
+                # Reads are not batch statements
+                assert db.write_behind.pending == pending
+            await db.write_behind.flush()
+            Repository.invalidate_caches()
+            async with db.repository() as repo:
+                committed = await repo.get_warns(-1, 1), (await repo.match_filter(-1, "hi")).response
+            return pending, seen, committed
+        finally:
+            await db.close()
+
+    pending, seen, committed = asyncio.run(run())
+    assert pending == 2
+    assert seen == committed == (1, "hello")
+
+def test_failed_batch_drops_caches(tmp_path, monkeypatch):
+    async def run():
+        db = write_behind_database(tmp_path, monkeypatch)
+        await db.migrate()
+        db.start()
+        Repository.invalidate_caches()
+        try:
+            async with db.repository() as repo:
+                # Caches "no filters", then the write-through adds the new one
+                assert await repo.match_filter(-1, "hi") is None
+                await repo.add_filter(-1, "hi", "hello")
+                assert (await repo.match_filter(-1, "hi")).response == "hello"
+
+            session = db.write_behind._session
+            commit = session.commit
+
+            async def failing_commit():
+                session.commit = commit
+                raise RuntimeError("disk full")
+
+            session.commit = failing_commit
+            await db.write_behind.flush()
+
+            async with db.repository() as repo:
+                return db.write_behind.failed_commits, await repo.match_filter(-1, "hi"), await repo.get_filters(-1)
+        finally:
+            await db.close()
+
+    failed_commits, match, rows = asyncio.run(run())
+    assert failed_commits == 1
+    # The rolled back filter is neither cached nor stored
+    assert match is None
+    assert rows == []